@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""Benchmark snapshot discovery, copy planning and pruning at fleet scale.
+
+Every benchmark runs against a fresh dbsnap.testing.fake_aws.FakeAWS
+account, so no AWS credentials are needed, and records:
+
+api_calls:
+ RDS/S3 api calls made, the cost which grows with the fleet in production.
+
+wall_ms:
+ wall clock time, the best of --repeat runs.
+
+peak_kb:
+ peak memory allocated while running, as traced by tracemalloc.
+
+Benchmarks:
+
+available_snapshots:
+ get_available_snapshots for every database (--snapshots automated each).
+
+available_dbsnap_snapshots:
+ get_available_dbsnap_snapshots for every database, in a region holding
+ --copies dbsnap-copy snapshots of each database.
+
+old_dbsnap_snapshots:
+ get_old_dbsnap_snapshots for every database, keeping --keep.
+
+snapshot_objects:
+ build a dbsnap.Snapshot from every snapshot description of the fleet.
+
+copy_flow:
+ a full dbsnap-copy run of every database into another region with
+ --prune-old --keep.
+
+Save a baseline with --save-baseline, and compare a later run against it
+with --compare. A comparison fails when a benchmark makes more api calls
+than the baseline, or is slower / uses more memory than the baseline
+times --time-tolerance / --memory-tolerance.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from dbsnap import (  # noqa: E402
+    Snapshot,
+    get_available_snapshots,
+    get_available_dbsnap_snapshots,
+    get_old_dbsnap_snapshots,
+)
+from dbsnap.testing.fake_aws import FakeAWS  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline_fleet.json")
+
+SOURCE_REGION = "us-east-1"
+DEST_REGION = "us-west-2"
+
+
+def database_ids(args):
+    return ["db-{:04d}".format(i) for i in range(args.databases)]
+
+
+def make_fleet(args):
+    """A fake account with every database and its snapshots in two regions."""
+    # instant copies, dbsnap-copy waits for new copies before pruning.
+    aws = FakeAWS(copy_quota=args.databases + 1, copy_seconds_per_gb=0)
+    source = aws.rds(SOURCE_REGION)
+    dest = aws.rds(DEST_REGION)
+    for identifier in database_ids(args):
+        source.add_instance(identifier)
+        source.add_snapshot(identifier, count=args.snapshots)
+        records = source.add_snapshot(
+            identifier, snapshot_id="manual-" + identifier, snapshot_type="manual"
+        )
+        dest.add_snapshot(
+            identifier,
+            snapshot_id="dbsnap-copy-" + identifier,
+            snapshot_type="manual",
+            count=args.copies,
+            tags={
+                "created_by": "dbsnap-copy",
+                "source_snapshot_arn": records[0]["DBSnapshotArn"],
+            },
+        )
+    return aws
+
+
+def bench_available_snapshots(aws, args):
+    rds = aws.rds(SOURCE_REGION)
+    for identifier in database_ids(args):
+        get_available_snapshots(rds, identifier)
+
+
+def bench_available_dbsnap_snapshots(aws, args):
+    rds = aws.rds(DEST_REGION)
+    for identifier in database_ids(args):
+        get_available_dbsnap_snapshots(rds, identifier)
+
+
+def bench_old_dbsnap_snapshots(aws, args):
+    rds = aws.rds(DEST_REGION)
+    for identifier in database_ids(args):
+        get_old_dbsnap_snapshots(rds, identifier, args.keep)
+
+
+def bench_snapshot_objects(aws, args):
+    rds = aws.rds(SOURCE_REGION)
+    descriptions = list(rds.snapshots.values())
+    return [Snapshot(d, rds) for d in descriptions]
+
+
+def bench_copy_flow(aws, args):
+    from dbsnap_copy.__main__ import main
+
+    argv = ["{}:{}".format(SOURCE_REGION, i) for i in database_ids(args)]
+    argv += ["-d", DEST_REGION + ":", "--prune-old", str(args.keep)]
+    # every copy fits in the quota of the fake, nothing waits for a slot.
+    argv += ["--copy-quota", str(aws.copy_quota)]
+    aws.install()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        main(argv)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        aws.uninstall()
+
+
+BENCHMARKS = OrderedDict(
+    [
+        ("available_snapshots", bench_available_snapshots),
+        ("available_dbsnap_snapshots", bench_available_dbsnap_snapshots),
+        ("old_dbsnap_snapshots", bench_old_dbsnap_snapshots),
+        ("snapshot_objects", bench_snapshot_objects),
+        ("copy_flow", bench_copy_flow),
+    ]
+)
+
+
+def run_once(bench, args, trace_memory):
+    aws = make_fleet(args)
+    before = sum(aws.calls.values())
+    if trace_memory:
+        tracemalloc.start()
+    started = time.time()
+    result = bench(aws, args)
+    wall_ms = (time.time() - started) * 1000
+    peak_kb = None
+    if trace_memory:
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024.0
+        tracemalloc.stop()
+    del result
+    return sum(aws.calls.values()) - before, wall_ms, peak_kb
+
+
+def run_benchmark(bench, args):
+    """Time `bench` --repeat times, then measure its memory in one more run.
+
+    tracemalloc slows everything down, so it is not on while timing.
+    """
+    walls = []
+    for _ in range(args.repeat):
+        api_calls, wall_ms, _ = run_once(bench, args, False)
+        walls.append(wall_ms)
+    peak_kb = None
+    if tracemalloc is not None:
+        peak_kb = round(run_once(bench, args, True)[2], 1)
+    return {"api_calls": api_calls, "wall_ms": round(min(walls), 2), "peak_kb": peak_kb}
+
+
+def fleet_params(args):
+    return {
+        "databases": args.databases,
+        "snapshots": args.snapshots,
+        "copies": args.copies,
+        "keep": args.keep,
+    }
+
+
+def compare(results, baseline, args):
+    """Returns a list of regressions of `results` against `baseline`."""
+    if baseline["params"] != fleet_params(args):
+        return [
+            "baseline was taken with {}, not {}".format(
+                baseline["params"], fleet_params(args)
+            )
+        ]
+    limits = [
+        ("api_calls", 1.0),
+        ("wall_ms", args.time_tolerance),
+        ("peak_kb", args.memory_tolerance),
+    ]
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for metric, tolerance in limits:
+            if result[metric] is None or base.get(metric) is None:
+                continue
+            if result[metric] > base[metric] * tolerance:
+                regressions.append(
+                    "{} {} {} > baseline {} x {}".format(
+                        name, metric, result[metric], base[metric], tolerance
+                    )
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--databases", type=int, default=100)
+    parser.add_argument("--snapshots", type=int, default=35)
+    parser.add_argument("--copies", type=int, default=30)
+    parser.add_argument("--keep", type=int, default=7)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        action="append",
+        choices=list(BENCHMARKS),
+        help="Run only these benchmarks (default: all).",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=2.0)
+    parser.add_argument("--memory-tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = OrderedDict()
+    for name in args.benchmark or BENCHMARKS:
+        results[name] = run_benchmark(BENCHMARKS[name], args)
+        print("{:<28} {}".format(name, json.dumps(results[name], sort_keys=True)))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"params": fleet_params(args), "results": results},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        print("Saved baseline to {}".format(args.baseline))
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args)
+        for regression in regressions:
+            print("REGRESSION: " + regression, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Measure the AWS Lambda cold start cost of aws_lambda.py.
+
+Every sample runs in a fresh Python interpreter and records:
+
+import_ms:
+ time to `import aws_lambda`, the Lambda init phase.
+
+first_invoke_ms:
+ time for the first `lambda_handler` call with an unrelated event,
+ the dispatch cost which is paid before any AWS call is made.
+
+first_client_ms:
+ time for the first `dbsnap.clients.get_client("rds")`, where boto3 is
+ imported and the client is built on the first real invocation.
+
+Pass --max-import-ms / --max-first-invoke-ms to exit non-zero when the
+median exceeds a budget, for example in CI.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE = """
+import json, time
+start = time.time()
+import aws_lambda
+imported = time.time()
+aws_lambda.lambda_handler({}, None)
+invoked = time.time()
+from dbsnap.clients import get_client
+get_client("rds", "us-east-1")
+client = time.time()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_invoke_ms": (invoked - imported) * 1000,
+    "first_client_ms": (client - invoked) * 1000,
+}))
+"""
+
+METRICS = ("import_ms", "first_invoke_ms", "first_client_ms")
+
+
+def take_sample():
+    env = dict(os.environ, AWS_DEFAULT_REGION="us-east-1", LOG_LEVEL="WARNING")
+    output = subprocess.check_output(
+        [sys.executable, "-c", SAMPLE], cwd=REPO_ROOT, env=env
+    )
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def summarize(samples):
+    summary = {}
+    for metric in METRICS:
+        values = [s[metric] for s in samples]
+        summary[metric] = {
+            "median": round(median(values), 2),
+            "min": round(min(values), 2),
+            "max": round(max(values), 2),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--runs", type=int, default=10)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-first-invoke-ms", type=float)
+    args = parser.parse_args()
+
+    summary = summarize([take_sample() for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2, sort_keys=True))
+
+    budgets = {
+        "import_ms": args.max_import_ms,
+        "first_invoke_ms": args.max_first_invoke_ms,
+    }
+    over = [
+        metric
+        for metric, budget in budgets.items()
+        if budget is not None and summary[metric]["median"] > budget
+    ]
+    for metric in over:
+        print(
+            "{} median {}ms is over the {}ms budget".format(
+                metric, summary[metric]["median"], budgets[metric]
+            ),
+            file=sys.stderr,
+        )
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
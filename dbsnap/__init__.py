@@ -1,4 +1,33 @@
+# Keep this module cheap to import, it is on the AWS Lambda cold start path.
+# Nothing here (or in the modules below) may import boto3 at load time,
+# AWS clients are created on demand by `dbsnap.clients.get_client`.
 from .snapshot import Snapshot
+from .database import Database
 
-from .utils import *
-from .rds_funcs import *
+from .utils import (
+    make_tag_dict,
+    get_tags_for_rds_arn,
+    get_tags_for_rds_arns,
+    prefetch_tags,
+    paginate,
+)
+from .rds_funcs import (
+    VALID_SNAPSHOT_TYPES,
+    SAFETY_TAG_KEY,
+    SAFETY_TAG_VAL,
+    iter_snapshot_descriptions,
+    iter_available_snapshots,
+    get_available_snapshots,
+    get_available_dbsnap_snapshots,
+    get_old_dbsnap_snapshots,
+    get_latest_snapshot,
+    generate_password,
+    dbsnap_verify_identifier,
+    get_database_subnet_group_description,
+    safer_create_database_subnet_group,
+    restore_from_latest_snapshot,
+    create_cluster_instance,
+    modify_instance_or_cluster_for_verify,
+    delete_verified_database,
+    destroy_database_subnet_group,
+)
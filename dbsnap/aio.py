@@ -0,0 +1,182 @@
+"""asyncio versions of the core dbsnap operations (Python 3.5+).
+
+There is no async RDS client, boto3 clients block, so every call runs in
+a thread pool executor while the event loop waits. An asyncio.Semaphore
+caps the RDS calls in flight, share one between AsyncRDS objects to share
+an api rate limit between regions. A whole fleet then runs from one event
+loop, needing only as many threads as calls in flight instead of a thread
+per database::
+
+    async def latest_snapshots(identifiers):
+        rds = AsyncRDS(get_client("rds", "us-east-1"), max_concurrency=8)
+        return await asyncio.gather(
+            *[rds.get_latest_snapshot(i) for i in identifiers]
+        )
+
+This module is not imported by `dbsnap` itself, it needs Python 3.5+.
+"""
+import asyncio
+import functools
+
+from .copy_job import CopyJob
+from .database import Database
+from .rds_funcs import (
+    get_available_snapshots,
+    get_latest_snapshot,
+    get_old_dbsnap_snapshots,
+    restore_from_latest_snapshot,
+)
+from .utils import get_tags_for_rds_arn
+
+# RDS calls in flight per AsyncRDS unless a semaphore is shared.
+DEFAULT_MAX_CONCURRENCY = 8
+
+# the loop of the calling coroutine, Python 3.5 and 3.6 only have
+# get_event_loop.
+get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+
+class AsyncRDS(object):
+    """Run dbsnap operations on one RDS session from an asyncio event loop.
+
+    Args:
+        session: the RDS api connection (a boto3 client).
+        semaphore (asyncio.Semaphore): shared limit of calls in flight,
+            default a new one of `max_concurrency`.
+        max_concurrency (int): calls in flight without a shared semaphore.
+        executor (concurrent.futures.Executor): runs the blocking calls,
+            default the event loop's executor.
+    """
+
+    def __init__(
+        self,
+        session,
+        semaphore=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        executor=None,
+    ):
+        self.session = session
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self._semaphore = semaphore
+
+    @property
+    def semaphore(self):
+        # created on first use, inside the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def call(self, func, *args, **kwargs):
+        """Run the blocking `func(*args, **kwargs)` within the rate limit."""
+        loop = get_running_loop()
+        async with self.semaphore:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def get_available_snapshots(self, identifier, snapshot_type=None):
+        return await self.call(
+            get_available_snapshots, self.session, identifier, snapshot_type
+        )
+
+    async def get_latest_snapshot(self, identifier, snapshot_type=None, index=None):
+        return await self.call(
+            get_latest_snapshot, self.session, identifier, snapshot_type, index
+        )
+
+    async def get_old_dbsnap_snapshots(self, identifier, keep_count, index=None):
+        return await self.call(
+            get_old_dbsnap_snapshots, self.session, identifier, keep_count, index
+        )
+
+    async def get_tags(self, arn):
+        return await self.call(get_tags_for_rds_arn, self.session, arn)
+
+    async def get_tags_many(self, arns):
+        """Returns a dict of tag dicts keyed by ARN, one call per cache miss."""
+        results = await asyncio.gather(*[self.get_tags(arn) for arn in arns])
+        return dict(zip(arns, results))
+
+    async def copy_snapshot(
+        self,
+        snapshot,
+        target_snapshot_name,
+        dest=None,
+        tags=None,
+        kms_key=None,
+        **job_kwargs
+    ):
+        """Copy `snapshot` into the region of `dest` (an AsyncRDS, default self).
+
+        `job_kwargs` are passed on to the CopyJob, like `max_delay`.
+
+        Returns:
+            :class:`dbsnap.copy_job.CopyJob`: to await with `wait_for_copy`.
+        """
+        dest = dest or self
+        return await dest.call(
+            CopyJob.start,
+            snapshot,
+            target_snapshot_name,
+            dest_session=dest.session,
+            tags=tags,
+            kms_key=kms_key,
+            **job_kwargs
+        )
+
+    async def wait_for_copy(self, copy_job, timeout=None, sleep=asyncio.sleep):
+        """Poll `copy_job` until done without blocking the event loop.
+
+        Returns:
+            bool: True if the copy is available.
+        """
+        deadline = None if timeout is None else copy_job.clock() + timeout
+        while not await self.call(copy_job.poll):
+            delay = copy_job.next_delay()
+            if deadline is not None:
+                remaining = deadline - copy_job.clock()
+                if remaining <= 0:
+                    break
+                delay = min(delay, remaining)
+            await sleep(delay)
+        return copy_job.available
+
+    async def copy_and_wait(
+        self,
+        snapshot,
+        target_snapshot_name,
+        dest=None,
+        timeout=None,
+        sleep=asyncio.sleep,
+        **copy_kwargs
+    ):
+        """Copy `snapshot` and wait for the copy, see `copy_snapshot`.
+
+        Returns:
+            :class:`dbsnap.copy_job.CopyJob`: done, unless `timeout` passed.
+        """
+        dest = dest or self
+        copy_job = await self.copy_snapshot(
+            snapshot, target_snapshot_name, dest=dest, **copy_kwargs
+        )
+        await dest.wait_for_copy(copy_job, timeout, sleep)
+        return copy_job
+
+    async def delete_snapshot(self, snapshot):
+        return await self.call(snapshot.delete)
+
+    async def describe_database(self, identifier, kind=None):
+        """Returns a dbsnap.Database or None if `identifier` does not exist."""
+        database = await self.call(
+            Database, identifier=identifier, session=self.session, kind=kind
+        )
+        return database if database else None
+
+    async def get_events(self, database, since=None, duration=1440):
+        return await self.call(database.get_events, duration=duration, since=since)
+
+    async def restore_from_latest_snapshot(self, identifier, subnet_ids):
+        return await self.call(
+            restore_from_latest_snapshot, self.session, identifier, subnet_ids
+        )
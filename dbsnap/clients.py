@@ -0,0 +1,86 @@
+import json
+import threading
+
+# connections each client keeps open, sized for the thread pools used by
+# dbsnap-copy and the tag/prune helpers (botocore defaults to 10).
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+
+_session = None
+_clients = {}
+_factory = None
+_lock = threading.Lock()
+
+
+def _client_key(service, region_name, config_options):
+    return (service, region_name, json.dumps(config_options, sort_keys=True))
+
+
+def get_client(
+    service,
+    region_name=None,
+    max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+    **config_options
+):
+    """Returns a boto3 client which is shared by the whole process.
+
+    Clients are keyed by service, region and config, so warm AWS Lambda
+    invocations and threads reuse the same client and connection pool.
+    boto3 itself is only imported the first time a client is needed.
+
+    Args:
+        service (str): The AWS service name, like "rds" or "s3".
+        region_name (str): The AWS region, None for the default region.
+        max_pool_connections (int): The size of the client connection pool.
+        config_options: More :class:`botocore.config.Config` arguments,
+            like `retries={"max_attempts": 3}`.
+    Returns:
+        A boto3 client.
+    """
+    global _session
+    config_options["max_pool_connections"] = max_pool_connections
+    key = _client_key(service, region_name, config_options)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None and _factory is not None:
+            client = _clients[key] = _factory(service, region_name=region_name)
+        elif client is None:
+            import boto3
+            from botocore.config import Config
+
+            if _session is None:
+                # share boto3's default session, so modeled exception classes
+                # match those of clients made with `boto3.client`. sessions
+                # are not thread safe, it is only used while holding the lock.
+                if boto3.DEFAULT_SESSION is None:
+                    boto3.setup_default_session()
+                _session = boto3.DEFAULT_SESSION
+            client = _session.client(
+                service, region_name=region_name, config=Config(**config_options)
+            )
+            _clients[key] = client
+        return client
+
+
+def clear_clients():
+    """Forget every pooled client and the shared session."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
+
+
+def set_client_factory(factory=None):
+    """Make `get_client` build clients with `factory` instead of boto3.
+
+    Args:
+        factory (callable): called like `factory(service, region_name=...)`,
+            for example :meth:`dbsnap.testing.fake_aws.FakeAWS.client`.
+            None goes back to boto3.
+    """
+    global _factory
+    clear_clients()
+    _factory = factory
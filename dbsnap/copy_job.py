@@ -0,0 +1,258 @@
+"""Track snapshot copies until they are available.
+
+`Snapshot.copy` returns as soon as RDS accepted the copy, the copy itself
+can take hours for a large cross-region snapshot. A CopyJob follows one
+copy: `poll` describes it once (never blocks) and `wait` / `wait_for_copies`
+poll until done, sleeping longer while a copy has a long way to go::
+
+    jobs = [CopyJob.start(s, "name-" + s.id, dest_session=west) for s in snaps]
+    pending = wait_for_copies(jobs, timeout=3600)
+    for job in jobs:
+        print(job.stats)
+"""
+import logging
+import time
+
+from .utils import get_error_code
+
+logger = logging.getLogger("dbsnap")
+
+# snapshot statuses of a copy which is still going.
+IN_PROGRESS_STATUSES = ("creating", "copying", "pending")
+
+# polling delays in seconds.
+DEFAULT_MIN_DELAY = 5
+DEFAULT_MAX_DELAY = 300
+
+# the most snapshot ids in one filtered describe call.
+MAX_FILTER_VALUES = 100
+
+NOT_FOUND_ERROR_CODES = (
+    "DBSnapshotNotFound",
+    "DBSnapshotNotFoundFault",
+    "DBClusterSnapshotNotFoundFault",
+)
+
+
+class CopyJob(object):
+    """Follow the copy `snapshot` (the target, as returned by Snapshot.copy).
+
+    Args:
+        snapshot (:class:`dbsnap.Snapshot`): the new copy, its session is
+            the RDS api connection of the destination region.
+        source (:class:`dbsnap.Snapshot`): the snapshot being copied.
+        clock (callable): returns the current time in seconds.
+        min_delay (float): shortest seconds between two polls.
+        max_delay (float): longest seconds between two polls.
+    """
+
+    def __init__(
+        self,
+        snapshot,
+        source=None,
+        clock=time.time,
+        min_delay=DEFAULT_MIN_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+    ):
+        self.snapshot = snapshot
+        self.source = source
+        self.clock = clock
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.started = clock()
+        self.finished = None
+        self.status = None
+        self.percent_progress = 0
+        self.polls = 0
+        self._delay = min_delay
+        self.size_gb = snapshot.allocated_storage
+        if self.size_gb is None and source is not None:
+            self.size_gb = source.allocated_storage
+        self.update_status(snapshot.status)
+
+    @classmethod
+    def start(
+        cls,
+        source,
+        target_snapshot_name,
+        dest_session=None,
+        tags=None,
+        kms_key=None,
+        **kwargs
+    ):
+        """Copy `source` (see Snapshot.copy) and return a CopyJob for it."""
+        snapshot = source.copy(
+            target_snapshot_name, dest_session=dest_session, tags=tags, kms_key=kms_key
+        )
+        return cls(snapshot, source, **kwargs)
+
+    @property
+    def id(self):
+        return self.snapshot.id
+
+    @property
+    def session(self):
+        return self.snapshot.session
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def available(self):
+        return self.status == "available"
+
+    @property
+    def failed(self):
+        return self.done and not self.available
+
+    @property
+    def duration(self):
+        """float: seconds since the copy started, until it finished."""
+        return (self.finished or self.clock()) - self.started
+
+    @property
+    def throughput(self):
+        """float: GB copied per minute, None until the copy is available."""
+        if not self.available or not self.size_gb:
+            return None
+        return self.size_gb / max(self.duration / 60.0, 1e-9)
+
+    @property
+    def stats(self):
+        """dict: to log once the job is done."""
+        throughput = self.throughput
+        return {
+            "id": self.id,
+            "status": self.status,
+            "percent_progress": self.percent_progress,
+            "duration": round(self.duration, 1),
+            "size_gb": self.size_gb,
+            "gb_per_min": None if throughput is None else round(throughput, 2),
+            "polls": self.polls,
+        }
+
+    def update_status(self, status, percent_progress=None):
+        """Record a describe of the copy, None when it no longer exists."""
+        if self.done:
+            return
+        self.status = status or "deleted"
+        if status == "available":
+            self.percent_progress = 100
+        elif percent_progress is not None:
+            self.percent_progress = percent_progress
+        if self.status not in IN_PROGRESS_STATUSES:
+            self.finished = self.clock()
+            logger.info("Copy %s finished: %s", self.id, self.stats)
+
+    def update(self, description):
+        """Record a snapshot description of the copy, or None if it is gone."""
+        self.polls += 1
+        if description is None:
+            self.update_status(None)
+        else:
+            self.update_status(
+                description.get("Status"), description.get("PercentProgress")
+            )
+
+    def poll(self):
+        """Describe the copy once.
+
+        Returns:
+            bool: True once the copy is done (available or failed).
+        """
+        if not self.done:
+            poll_copies([self])
+        return self.done
+
+    def next_delay(self):
+        """Seconds to sleep before the next poll.
+
+        Half the time the copy still needs at its rate so far, or an
+        exponential backoff while RDS reports no progress, within
+        [min_delay, max_delay].
+        """
+        elapsed = self.clock() - self.started
+        if self.percent_progress > 0 and elapsed > 0:
+            rate = self.percent_progress / float(elapsed)
+            delay = (100 - self.percent_progress) / rate / 2.0
+        else:
+            delay = self._delay
+            self._delay = min(self.max_delay, self._delay * 2)
+        return max(self.min_delay, min(self.max_delay, delay))
+
+    def wait(self, timeout=None, sleep=time.sleep):
+        """Poll until the copy is done or `timeout` seconds passed.
+
+        Returns:
+            bool: True if the copy is available.
+        """
+        wait_for_copies([self], timeout, sleep, self.clock)
+        return self.available
+
+
+def _describe_copies(session, is_cluster, ids):
+    """Yields the descriptions of snapshots `ids`, one call per 100 ids."""
+    if is_cluster:
+        method = session.describe_db_cluster_snapshots
+        result_key, filter_name = "DBClusterSnapshots", "db-cluster-snapshot-id"
+    else:
+        method = session.describe_db_snapshots
+        result_key, filter_name = "DBSnapshots", "db-snapshot-id"
+    for i in range(0, len(ids), MAX_FILTER_VALUES):
+        chunk = ids[i : i + MAX_FILTER_VALUES]
+        response = method(Filters=[{"Name": filter_name, "Values": chunk}])
+        for description in response[result_key]:
+            yield description
+
+
+def poll_copies(jobs):
+    """Describe every unfinished job, with one call per session and kind."""
+    groups = {}
+    for job in jobs:
+        if not job.done:
+            key = (id(job.session), job.snapshot.is_cluster)
+            groups.setdefault(key, []).append(job)
+    for (_, is_cluster), group in groups.items():
+        id_key = "DBClusterSnapshotIdentifier" if is_cluster else "DBSnapshotIdentifier"
+        try:
+            descriptions = {
+                d[id_key]: d
+                for d in _describe_copies(
+                    group[0].session, is_cluster, [j.id for j in group]
+                )
+            }
+        except Exception as e:
+            if get_error_code(e) not in NOT_FOUND_ERROR_CODES:
+                raise
+            descriptions = {}
+        for job in group:
+            job.update(descriptions.get(job.id))
+
+
+def wait_for_copies(jobs, timeout=None, sleep=time.sleep, clock=time.time):
+    """Poll many copies at once until all are done or `timeout` seconds passed.
+
+    Args:
+        jobs (list): :class:`CopyJob` objects.
+        timeout (float): give up after this many seconds, None waits forever.
+        sleep (callable): used to wait between polls.
+        clock (callable): returns the current time in seconds.
+    Returns:
+        list: the jobs which are still in progress.
+    """
+    deadline = None if timeout is None else clock() + timeout
+    pending = [j for j in jobs if not j.done]
+    while pending:
+        poll_copies(pending)
+        pending = [j for j in pending if not j.done]
+        if not pending:
+            break
+        delay = min(j.next_delay() for j in pending)
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
+            delay = min(delay, remaining)
+        sleep(delay)
+    return pending
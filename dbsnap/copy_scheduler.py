@@ -0,0 +1,362 @@
+"""Start snapshot copies within the RDS copy quota of each region.
+
+RDS only lets so many snapshot copies be in progress per destination
+region, more copy calls fail with SnapshotQuotaExceeded. A CopyScheduler
+queues CopyRequests per destination region and keeps at most `quota`
+copies in flight in each, starting the next request as soon as a copy
+finishes:
+
+* requests start in priority order: "age" starts databases whose last
+  successful copy is oldest (or which were never copied) first, "size"
+  starts the largest databases first, so the longest copies overlap,
+* a SnapshotQuotaExceeded answer (copies started by someone else) puts
+  the request back in the queue instead of failing it,
+* the queue, the copies in flight and when each database was last copied
+  persist as JSON (`save` / `load_copy_scheduler`), so a run which timed
+  out leaves its queue to the next run, which also counts the copies it
+  left in flight against the quota::
+
+    scheduler = load_copy_scheduler("s3://my-bucket/dbsnap-copy-queue.json")
+    scheduler.submit(CopyRequest("us-east-1:db>us-west-2", snapshot, "us-west-2", name))
+    scheduler.run(sessions, timeout=3600)
+    scheduler.save()
+"""
+import json
+import logging
+import time
+
+from .copy_job import CopyJob, poll_copies
+from .snapshot_index import (
+    read_location,
+    record_to_snapshot,
+    snapshot_to_record,
+    write_location,
+)
+from .utils import get_error_code
+
+logger = logging.getLogger("dbsnap")
+
+# RDS allows 20 snapshot copies in progress per destination region.
+DEFAULT_COPY_QUOTA = 20
+
+PRIORITIES = ("age", "size")
+
+QUOTA_ERROR_CODES = ("SnapshotQuotaExceeded", "SnapshotQuotaExceededFault")
+
+# seconds to wait after SnapshotQuotaExceeded without copies of our own to
+# poll, the copies in the way are someone else's.
+DEFAULT_RETRY_DELAY = 60
+
+QUEUE_VERSION = 1
+
+
+class CopyRequest(object):
+    """A snapshot copy waiting for a slot in its destination region.
+
+    Args:
+        key (str): identifies the database and destination, a later request
+            with the same key replaces a queued one.
+        source (:class:`dbsnap.Snapshot`): the snapshot to copy.
+        dest_region (str): the region to copy to.
+        target_name (str): the name of the copy.
+        tags (dict): tags of the copy.
+        kms_key (str): KMS key of the copy.
+        enqueued (float): when the request was first queued.
+    """
+
+    def __init__(
+        self,
+        key,
+        source,
+        dest_region,
+        target_name,
+        tags=None,
+        kms_key=None,
+        enqueued=None,
+    ):
+        self.key = key
+        self.source = source
+        self.dest_region = dest_region
+        self.target_name = target_name
+        self.tags = tags
+        self.kms_key = kms_key
+        self.enqueued = enqueued
+
+    @property
+    def size_gb(self):
+        return self.source.allocated_storage or 0
+
+    def to_record(self):
+        return {
+            "key": self.key,
+            "source": snapshot_to_record(self.source),
+            "dest_region": self.dest_region,
+            "target_name": self.target_name,
+            "tags": self.tags,
+            "kms_key": self.kms_key,
+            "enqueued": self.enqueued,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            record["key"],
+            record_to_snapshot(record["source"]),
+            record["dest_region"],
+            record["target_name"],
+            record["tags"],
+            record["kms_key"],
+            record["enqueued"],
+        )
+
+
+class CopyScheduler(object):
+    """Queues of CopyRequests per destination region, see the module docstring.
+
+    Args:
+        quota (int): copies in flight per destination region.
+        priority (str): "age" or "size", see the module docstring.
+        location (str): a file path or s3://bucket/key to save to.
+        clock (callable): returns the current time in seconds.
+        sleep (callable): used to wait for copies to finish.
+    """
+
+    def __init__(
+        self,
+        quota=DEFAULT_COPY_QUOTA,
+        priority="age",
+        location=None,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        if priority not in PRIORITIES:
+            raise ValueError(
+                "Copy priority {} not one of {}.".format(
+                    priority, ", ".join(PRIORITIES)
+                )
+            )
+        self.quota = quota
+        self.priority = priority
+        self.location = location
+        self.clock = clock
+        self.sleep = sleep
+        self.retry_delay = DEFAULT_RETRY_DELAY
+        # queued CopyRequests by key.
+        self.queue = {}
+        # (CopyRequest, CopyJob) tuples by key.
+        self.in_flight = {}
+        # when the last copy of a key became available.
+        self.last_copied = {}
+        # outcomes of this run by key.
+        self.jobs = {}
+        self.errors = {}
+        self.quota_errors = 0
+        self.polls = 0
+
+    def submit(self, request):
+        """Queue `request`.
+
+        Returns:
+            bool: False if the same snapshot is already being copied.
+        """
+        flight = self.in_flight.get(request.key)
+        if flight is not None and flight[0].source.arn == request.source.arn:
+            return False
+        queued = self.queue.get(request.key)
+        if queued is not None:
+            # keep the place in the queue of the request it replaces.
+            request.enqueued = queued.enqueued
+        if request.enqueued is None:
+            request.enqueued = self.clock()
+        self.queue[request.key] = request
+        return True
+
+    def sort_key(self, request):
+        if self.priority == "size":
+            return (-request.size_gb, request.enqueued)
+        return (self.last_copied.get(request.key, 0), request.enqueued)
+
+    def queued(self, region=None):
+        """Returns the queued requests (of `region`) in priority order."""
+        requests = [
+            r for r in self.queue.values() if region is None or r.dest_region == region
+        ]
+        return sorted(requests, key=self.sort_key)
+
+    def copies_in_flight(self, region):
+        return len([1 for r, _ in self.in_flight.values() if r.dest_region == region])
+
+    def regions(self):
+        """Returns the source and destination regions of queued and in flight copies."""
+        requests = list(self.queue.values()) + [r for r, _ in self.in_flight.values()]
+        regions = set()
+        for request in requests:
+            regions.update((request.source.region, request.dest_region))
+        return regions
+
+    def bind(self, sessions):
+        """Give snapshots loaded from a saved queue their region's session."""
+        for request in self.queue.values():
+            if request.source.session is None:
+                request.source.session = sessions[request.source.region]
+        for request, job in self.in_flight.values():
+            if job.snapshot.session is None:
+                job.snapshot.session = sessions[request.dest_region]
+
+    def start_ready(self, sessions):
+        """Start queued requests while their regions have free slots.
+
+        Returns:
+            list: the regions whose queue is blocked by the quota.
+        """
+        blocked = []
+        regions = sorted(set(r.dest_region for r in self.queue.values()))
+        for region in regions:
+            for request in self.queued(region):
+                if self.copies_in_flight(region) >= self.quota:
+                    blocked.append(region)
+                    break
+                if not self._start(request, sessions[region]):
+                    blocked.append(region)
+                    break
+        return blocked
+
+    def _start(self, request, dest_session):
+        """Start the copy of `request`, returns False on a quota error."""
+        try:
+            job = CopyJob.start(
+                request.source,
+                request.target_name,
+                dest_session=dest_session,
+                tags=request.tags,
+                kms_key=request.kms_key,
+                clock=self.clock,
+            )
+        except Exception as e:
+            if get_error_code(e) in QUOTA_ERROR_CODES:
+                self.quota_errors += 1
+                logger.info(
+                    "Copy quota of %s is full, %s waits.",
+                    request.dest_region,
+                    request.key,
+                )
+                return False
+            logger.warning("Copy of %s failed to start: %r", request.key, e)
+            del self.queue[request.key]
+            self.errors[request.key] = e
+            return True
+        del self.queue[request.key]
+        self.in_flight[request.key] = (request, job)
+        self.jobs[request.key] = job
+        logger.info("Started copy %s of %s.", job.id, request.key)
+        return True
+
+    def poll(self, regions=None):
+        """Describe the copies in flight (in `regions`), freeing finished slots."""
+        flights = [
+            (r, j)
+            for r, j in self.in_flight.values()
+            if regions is None or r.dest_region in regions
+        ]
+        if not flights:
+            return
+        self.polls += 1
+        poll_copies([j for _, j in flights])
+        for request, job in flights:
+            if job.done:
+                del self.in_flight[request.key]
+                if job.available:
+                    self.last_copied[request.key] = self.clock()
+
+    def run(self, sessions, timeout=None):
+        """Start every queued request, waiting for slots as copies finish.
+
+        Returns once the queue is empty or after `timeout` seconds, the copies
+        started last are still in flight then.
+
+        Args:
+            sessions (dict): RDS api connections keyed by region name.
+            timeout (float): give up after this many seconds, None waits forever.
+        Returns:
+            list: the requests still queued.
+        """
+        self.bind(sessions)
+        # copies of a saved queue may have finished since, free their slots.
+        self.poll()
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            blocked = self.start_ready(sessions)
+            if not blocked:
+                break
+            jobs = [j for r, j in self.in_flight.values() if r.dest_region in blocked]
+            delay = min([j.next_delay() for j in jobs] or [self.retry_delay])
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+                delay = min(delay, remaining)
+            self.sleep(delay)
+            self.poll(blocked)
+        return self.queued()
+
+    @property
+    def stats(self):
+        """dict: counters to log at the end of a run."""
+        return {
+            "started": len(self.jobs),
+            "failed_to_start": len(self.errors),
+            "queued": len(self.queue),
+            "in_flight": len(self.in_flight),
+            "quota_errors": self.quota_errors,
+            "polls": self.polls,
+        }
+
+    def to_dict(self):
+        return {
+            "version": QUEUE_VERSION,
+            "queue": [r.to_record() for r in self.queued()],
+            "in_flight": [
+                {
+                    "request": r.to_record(),
+                    "snapshot": snapshot_to_record(j.snapshot),
+                    "started": j.started,
+                }
+                for r, j in self.in_flight.values()
+            ],
+            "last_copied": self.last_copied,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def save(self, location=None):
+        """Write the queue to a file path or s3://bucket/key."""
+        write_location(location or self.location, self.to_json())
+
+
+def load_copy_scheduler(location, clock=time.time, **kwargs):
+    """Returns the CopyScheduler saved at `location`, or an empty one.
+
+    Args:
+        location (str): a file path or s3://bucket/key.
+        kwargs: CopyScheduler arguments, like `quota`.
+    """
+    scheduler = CopyScheduler(location=location, clock=clock, **kwargs)
+    body = read_location(location)
+    if not body:
+        return scheduler
+    document = json.loads(body)
+    if document.get("version") != QUEUE_VERSION:
+        return scheduler
+    scheduler.last_copied = document["last_copied"]
+    for record in document["queue"]:
+        request = CopyRequest.from_record(record)
+        scheduler.queue[request.key] = request
+    for record in document["in_flight"]:
+        request = CopyRequest.from_record(record["request"])
+        job = CopyJob(
+            record_to_snapshot(record["snapshot"]), request.source, clock=clock
+        )
+        job.started = record["started"]
+        scheduler.in_flight[request.key] = (request, job)
+    return scheduler
@@ -1,17 +1,50 @@
-from .utils import get_tags_for_rds_arn
+import time
+
+from .identifier_index import get_identifier_index, INSTANCE, CLUSTER
+from .tag_cache import get_tag_cache
+from .utils import (
+    get_tags_for_rds_arn,
+    make_tag_dict,
+    paginate,
+    datetime_to_timestamp,
+    timestamp_to_datetime,
+)
 
 
 class Database(object):
     """Normalise DB Instance and Cluster Descriptions into a single type."""
 
-    def __init__(self, identifier=None, description=None, session=None):
+    __slots__ = (
+        "id",
+        "arn",
+        "status",
+        "engine",
+        "engine_version",
+        "kms_key_id",
+        "cluster_member_descriptions",
+        "cluster_member_ids",
+        "description",
+        "session",
+        "events_seen_until",
+    )
+
+    def __init__(self, identifier=None, description=None, session=None, kind=None):
+        """
+        identifier (str): an instance or cluster identifier to describe.
+        description (dict): an instance or cluster description.
+        session: the RDS api connection.
+        kind (str): dbsnap.identifier_index.INSTANCE or CLUSTER if known,
+            saves describing the wrong kind of resource first.
+        """
 
         self.id = None
         self.description = description
         self.session = session
+        # the newest event timestamp returned by get_events.
+        self.events_seen_until = None
 
         if identifier:
-            self.description = self.get_description_by_id(identifier)
+            self.description = self.get_description_by_id(identifier, kind)
 
         if self.description:
             self.setattrs_from_description()
@@ -22,26 +55,70 @@ class Database(object):
             return False
         return True
 
-    def get_description_by_id(self, identifier):
-        """Return Database object or None."""
+    def get_description_by_id(self, identifier, kind=None):
+        """Return the instance or cluster description of `identifier` or None.
+
+        Whether `identifier` is an instance or a cluster is remembered in
+        the session's IdentifierIndex, so later lookups take a single call.
+        """
+        index = get_identifier_index(self.session)
+        kind = kind or index.get(identifier)
+
+        if kind == CLUSTER:
+            description = self._describe_cluster(identifier)
+        elif kind == INSTANCE:
+            description = self._describe_instance(identifier)
+        else:
+            description = self._describe_instance(identifier)
+            kind = INSTANCE
+            if description is None:
+                description = self._describe_cluster(identifier)
+                kind = CLUSTER
+
+        if description is None:
+            index.forget(identifier)
+        else:
+            index.set(identifier, kind)
+        return description
+
+    def _describe_instance(self, identifier):
+        # a filter answers with an empty list instead of raising NotFound.
         try:
-            return self.session.describe_db_instances(DBInstanceIdentifier=identifier)[
-                "DBInstances"
-            ][0]
+            instances = self.session.describe_db_instances(
+                Filters=[{"Name": "db-instance-id", "Values": [identifier]}]
+            )["DBInstances"]
         except self.session.exceptions.DBInstanceNotFoundFault:
-            pass
+            return None
+        return instances[0] if instances else None
 
+    def _describe_cluster(self, identifier):
         try:
-            return self.session.describe_db_clusters(DBClusterIdentifier=identifier)[
-                "DBClusters"
-            ][0]
+            clusters = self.session.describe_db_clusters(
+                Filters=[{"Name": "db-cluster-id", "Values": [identifier]}]
+            )["DBClusters"]
         except self.session.exceptions.DBClusterNotFoundFault:
-            pass
+            return None
+        return clusters[0] if clusters else None
+
+    @property
+    def kind(self):
+        """str: dbsnap.identifier_index.INSTANCE or CLUSTER."""
+        return CLUSTER if self.is_cluster else INSTANCE
 
     @property
     def tags(self):
         return get_tags_for_rds_arn(self.session, self.arn)
 
+    def invalidate_tags(self):
+        """Forget cached tags, for example after tagging this resource."""
+        get_tag_cache(self.session).invalidate(self.arn)
+
+    def _compose_tags(self):
+        # newer describe responses include the tags, saving a lookup.
+        tag_list = self.description.get("TagList")
+        if tag_list is not None and self.session is not None:
+            get_tag_cache(self.session).set(self.arn, make_tag_dict(tag_list))
+
     @property
     def region(self):
         return self.arn.split(":")[3]
@@ -61,6 +138,7 @@ class Database(object):
             self.compose_cluster()
         else:
             self.compose_instance()
+        self._compose_tags()
 
     def _compose_common(self):
         self.kms_key_id = self.description.get("KmsKeyId")
@@ -87,10 +165,21 @@ class Database(object):
     def cluster_members(self):
         """Return a list of cluster member instance Database objects."""
         if self.is_cluster:
-            return [
-                Database(identifier=i, session=self.session)
-                for i in self.cluster_member_ids
-            ]
+            if not self.cluster_member_ids:
+                return []
+            # one filtered describe for all members instead of one per member.
+            descriptions = paginate(
+                self.session.describe_db_instances,
+                "DBInstances",
+                Filters=[{"Name": "db-cluster-id", "Values": [self.id]}],
+            )
+            members = {}
+            index = get_identifier_index(self.session)
+            for description in descriptions:
+                member = Database(description=description, session=self.session)
+                index.set(member.id, INSTANCE)
+                members[member.id] = member
+            return [members[i] for i in self.cluster_member_ids if i in members]
 
     def create_cluster_instance(
         self, instance_identifier, instance_class="db.r4.large", tags=None
@@ -129,28 +218,75 @@ class Database(object):
             except self.session.exceptions.InvalidDBInstanceStateFault:
                 pass
 
-    def get_events(self, event_catagories=None, duration=1440):
+    @property
+    def event_source_type(self):
+        """str: the describe_events SourceType of this database."""
+        return "db-cluster" if self.is_cluster else "db-instance"
+
+    def get_events(self, event_catagories=None, duration=1440, since=None):
+        """Returns the RDS events of this database, oldest first.
+
+        Args:
+            event_catagories (list): only return events of these categories.
+            duration (int): minutes of events to return when `since` is None.
+            since (float): only return events newer than this POSIX
+                timestamp, for example a high-water mark kept between runs.
+        Returns:
+            list: event dictionaries from every page of describe_events.
+        """
+        args = {
+            "SourceIdentifier": self.id,
+            "SourceType": self.event_source_type,
+            "EventCategories": event_catagories or [],
+        }
+        if since is None:
+            args["Duration"] = duration
+        else:
+            args["StartTime"] = timestamp_to_datetime(since)
+
         events = []
-        if not event_catagories:
-            event_catagories = []
-        events.extend(
-            self.session.describe_events(
-                SourceIdentifier=self.id,
-                SourceType="db-instance",
-                EventCategories=event_catagories,
-                Duration=duration,
-            )["Events"]
-        )
-        events.extend(
-            self.session.describe_events(
-                SourceIdentifier=self.id,
-                SourceType="db-cluster",
-                EventCategories=event_catagories,
-                Duration=duration,
-            )["Events"]
-        )
+        for event in paginate(self.session.describe_events, "Events", **args):
+            timestamp = datetime_to_timestamp(event["Date"])
+            # StartTime is inclusive, we want strictly newer events.
+            if since is not None and timestamp <= since:
+                continue
+            if self.events_seen_until is None or timestamp > self.events_seen_until:
+                self.events_seen_until = timestamp
+            events.append(event)
         return events
 
+    def wait_for_event(
+        self,
+        predicate,
+        since=None,
+        timeout=0,
+        interval=30,
+        sleep=time.sleep,
+        clock=time.time,
+    ):
+        """Returns the first new event matching `predicate` or None.
+
+        Polls describe_events every `interval` seconds until `timeout`
+        seconds passed, only fetching events newer than the last poll.
+        The default timeout of 0 checks once, which suits a Lambda wakeup.
+
+        Args:
+            predicate (callable): called with each event dictionary.
+            since (float): only consider events newer than this POSIX
+                timestamp. Afterwards `events_seen_until` holds the newest
+                event timestamp seen, to persist as the next `since`.
+        """
+        deadline = clock() + timeout
+        while True:
+            for event in self.get_events(since=since):
+                if predicate(event):
+                    return event
+            if self.events_seen_until is not None:
+                since = self.events_seen_until
+            if clock() + interval > deadline:
+                return None
+            sleep(interval)
+
     @property
     def event_messages(self, event_catagories=None, duration=1440):
         events = self.get_events(event_catagories, duration)
@@ -0,0 +1,39 @@
+import threading
+import weakref
+
+INSTANCE = "instance"
+CLUSTER = "cluster"
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+class IdentifierIndex(object):
+    """Remember whether an RDS identifier names an instance or a cluster."""
+
+    def __init__(self):
+        self._kinds = {}
+        self._lock = threading.Lock()
+
+    def get(self, identifier):
+        """Returns INSTANCE, CLUSTER or None if unknown."""
+        return self._kinds.get(identifier)
+
+    def set(self, identifier, kind):
+        if kind not in (INSTANCE, CLUSTER):
+            raise ValueError("Invalid identifier kind: {}".format(kind))
+        with self._lock:
+            self._kinds[identifier] = kind
+
+    def forget(self, identifier):
+        with self._lock:
+            self._kinds.pop(identifier, None)
+
+
+def get_identifier_index(session):
+    """Returns the IdentifierIndex shared by everything using this RDS `session`."""
+    with _indexes_lock:
+        index = _indexes.get(session)
+        if index is None:
+            index = _indexes[session] = IdentifierIndex()
+        return index
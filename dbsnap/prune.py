@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import backoff_delay, get_error_code, is_throttle_error
+
+logger = logging.getLogger("dbsnap")
+
+# error codes which mean the snapshot is already gone.
+NOT_FOUND_ERROR_CODES = {"DBSnapshotNotFound", "DBClusterSnapshotNotFoundFault"}
+
+
+class PruneResult(object):
+    """The outcome of pruning a list of snapshots."""
+
+    def __init__(self):
+        self.deleted = []
+        self.failed = []
+        self.skipped = []
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, outcome, snapshot, latency=None, error=None):
+        with self._lock:
+            if outcome == "deleted":
+                self.deleted.append(snapshot)
+            elif outcome == "failed":
+                self.failed.append((snapshot, error))
+            else:
+                self.skipped.append(snapshot)
+            if latency is not None:
+                self.latencies.append(latency)
+
+    @property
+    def stats(self):
+        """dict: counts and delete latency (seconds) percentiles."""
+        latencies = sorted(self.latencies)
+        stats = {
+            "deleted": len(self.deleted),
+            "failed": len(self.failed),
+            "skipped": len(self.skipped),
+        }
+        if latencies:
+            stats["latency_p50"] = latencies[len(latencies) // 2]
+            stats["latency_max"] = latencies[-1]
+        return stats
+
+
+def delete_snapshot_with_backoff(
+    snapshot, max_attempts=5, base_delay=0.5, max_delay=20, sleep=time.sleep
+):
+    """Delete `snapshot`, retrying throttled calls with jittered backoff.
+
+    Retries come out of the process wide retry budget, see dbsnap.rate_limit.
+    A snapshot whose session is a rate limited client is deleted once, the
+    client retries on its own.
+    """
+    from .rate_limit import LimitedClient, get_retry_budget
+
+    if isinstance(snapshot.session, LimitedClient):
+        return snapshot.delete()
+    for attempt in range(max_attempts):
+        try:
+            return snapshot.delete()
+        except Exception as e:
+            if not is_throttle_error(e) or attempt == max_attempts - 1:
+                raise
+            if not get_retry_budget().try_retry():
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.debug("Throttled deleting %s, retry in %.2fs", snapshot.id, delay)
+            sleep(delay)
+
+
+def prune_snapshots(
+    snapshots,
+    max_workers=4,
+    dry_run=False,
+    max_attempts=5,
+    base_delay=0.5,
+    max_delay=20,
+    sleep=time.sleep,
+):
+    """Delete snapshots concurrently and report what happened.
+
+    A failed delete is recorded and does not stop the others. Snapshots
+    which are not available, already gone, or seen in a dry run are skipped.
+
+    Args:
+        snapshots (list): dbsnap.Snapshot objects to delete.
+        max_workers (int): The most deletes to run at the same time.
+        dry_run (bool): If True, skip every snapshot instead of deleting.
+        max_attempts (int): attempts per snapshot when throttled.
+        base_delay (float): first backoff delay in seconds.
+        max_delay (float): longest backoff delay in seconds.
+        sleep (callable): used to wait between attempts.
+    Returns:
+        :class:`PruneResult`: the deleted, failed and skipped snapshots.
+    """
+    result = PruneResult()
+
+    def prune(snapshot):
+        if dry_run or snapshot.status != "available":
+            result.record("skipped", snapshot)
+            return
+        started = time.time()
+        try:
+            delete_snapshot_with_backoff(
+                snapshot, max_attempts, base_delay, max_delay, sleep
+            )
+        except Exception as e:
+            if get_error_code(e) in NOT_FOUND_ERROR_CODES:
+                result.record("skipped", snapshot, time.time() - started)
+            else:
+                logger.warning("Failed to delete snapshot %s: %r", snapshot.id, e)
+                result.record("failed", snapshot, time.time() - started, e)
+        else:
+            result.record("deleted", snapshot, time.time() - started)
+
+    snapshots = list(snapshots)
+    if snapshots:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            # consume the iterator so worker exceptions surface here.
+            list(pool.map(prune, snapshots))
+    return result
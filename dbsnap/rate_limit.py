@@ -0,0 +1,345 @@
+"""Client side rate limiting and a retry budget for AWS api calls.
+
+RDS throttles per account and region, and every retry of a throttled call
+is more load on an api which is already saying "slow down". Wrap a client
+with `limit_client` and its calls:
+
+* take a token from a bucket shared per (region, api family). A bucket
+  does not limit until RDS throttles, then it halves the rate it observed
+  and raises it again by `increase` calls per second every second,
+* retry throttled and transient errors, and the connection errors botocore
+  would have retried, with jittered backoff, but only
+  while the process wide RetryBudget allows, so retries stay a fraction
+  of all calls instead of multiplying load across threads.
+
+`rate_limit_stats()` reports throttle rate, time spent waiting and the
+effective calls per second of every bucket, to tune these under load.
+"""
+import collections
+import logging
+import threading
+import time
+import weakref
+
+from .utils import backoff_delay, get_error_code, is_throttle_error
+
+logger = logging.getLogger("dbsnap")
+
+# transient errors which are worth a retry besides throttling.
+TRANSIENT_ERROR_CODES = {
+    "InternalFailure",
+    "InternalError",
+    "ServiceUnavailable",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+
+# client attributes which do not call the api.
+LOCAL_ATTRIBUTES = (
+    "can_paginate",
+    "close",
+    "exceptions",
+    "generate_presigned_url",
+    "get_paginator",
+    "get_waiter",
+    "meta",
+)
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# botocore retries on its own unless told not to, the limited client retries
+# instead (connection errors included) so retries are rate limited and budgeted.
+NO_BOTOCORE_RETRIES = {"retries": {"max_attempts": 0}}
+
+
+def api_family(operation):
+    """Returns "read" or "write", the rate limit bucket of an operation."""
+    if operation.startswith(("describe_", "list_", "get_")):
+        return "read"
+    return "write"
+
+
+class TokenBucket(object):
+    """An adaptive token bucket, see the module docstring.
+
+    Args:
+        burst (int): tokens the bucket holds once it limits.
+        min_rate (float): never limit below this many calls per second.
+        max_rate (float): stop limiting once the rate is back to this.
+        decrease (float): multiply the rate by this on a throttle.
+        increase (float): calls per second the rate grows every second.
+        clock (callable): returns the current time in seconds.
+        sleep (callable): used to wait for a token.
+    """
+
+    def __init__(
+        self,
+        burst=10,
+        min_rate=0.5,
+        max_rate=100.0,
+        decrease=0.5,
+        increase=1.0,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.clock = clock
+        self.sleep = sleep
+        # calls per second, None while not limiting.
+        self.rate = None
+        self.tokens = burst
+        self.requests = 0
+        self.throttles = 0
+        self.wait_seconds = 0.0
+        self._last_refill = clock()
+        self._first_request = None
+        self._recent = collections.deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._last_refill)
+        self._last_refill = now
+        if self.rate is None:
+            return
+        self.rate += self.increase * elapsed
+        if self.rate >= self.max_rate:
+            self.rate = None
+            self.tokens = self.burst
+        else:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def acquire(self):
+        """Take a token, sleeping until one is free.
+
+        Returns:
+            float: seconds waited.
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.requests += 1
+            self._recent.append(now)
+            if self._first_request is None:
+                self._first_request = now
+            if self.rate is None:
+                return 0.0
+            # reserve a token, going into debt if needed, then wait it off.
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+            self.wait_seconds += wait
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def observed_rate(self):
+        """Calls per second over the recent requests."""
+        if len(self._recent) < 2:
+            return self.max_rate
+        elapsed = self._recent[-1] - self._recent[0]
+        if elapsed <= 0:
+            return self.max_rate
+        return (len(self._recent) - 1) / elapsed
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill(self.clock())
+            self.throttles += 1
+            rate = self.observed_rate() if self.rate is None else self.rate
+            self.rate = max(self.min_rate, min(self.max_rate, rate) * self.decrease)
+            self.tokens = min(self.tokens, 0)
+            logger.debug("Throttled, limiting to %.2f calls/s", self.rate)
+
+    @property
+    def stats(self):
+        """dict: counters to tune the limits with."""
+        with self._lock:
+            elapsed = (
+                (self._last_refill - self._first_request) if self._first_request else 0
+            )
+            return {
+                "requests": self.requests,
+                "throttles": self.throttles,
+                "throttle_rate": (
+                    float(self.throttles) / self.requests if self.requests else 0.0
+                ),
+                "wait_seconds": round(self.wait_seconds, 3),
+                "effective_qps": (
+                    round(self.requests / elapsed, 2) if elapsed > 0 else None
+                ),
+                "rate": None if self.rate is None else round(self.rate, 2),
+            }
+
+
+class RetryBudget(object):
+    """Allow retries only as a fraction of all calls.
+
+    Every call deposits `ratio` of a token, every retry withdraws a whole
+    one. `min_tokens` lets a quiet process retry a little anyway.
+    """
+
+    def __init__(self, ratio=0.1, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self.retries = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_retry(self):
+        """Returns True and spends a token if a retry is allowed."""
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+                "tokens": round(self.tokens, 2),
+            }
+
+
+_buckets = {}
+_bucket_options = {}
+_budget = RetryBudget()
+_limited_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_bucket(region, family):
+    """Returns the TokenBucket shared by every client of `region` and `family`."""
+    with _lock:
+        bucket = _buckets.get((region, family))
+        if bucket is None:
+            bucket = _buckets[(region, family)] = TokenBucket(**_bucket_options)
+        return bucket
+
+
+def get_retry_budget():
+    return _budget
+
+
+def reset_rate_limits(budget=None, **bucket_options):
+    """Forget every bucket and start a fresh retry budget.
+
+    Args:
+        budget (RetryBudget): the new budget, default a RetryBudget().
+        bucket_options: TokenBucket arguments of the buckets made from now on.
+    """
+    global _budget
+    with _lock:
+        _buckets.clear()
+        _bucket_options.clear()
+        _bucket_options.update(bucket_options)
+        _budget = budget or RetryBudget()
+
+
+def rate_limit_stats():
+    """dict: stats of every bucket keyed "<region>/<family>", and the budget."""
+    with _lock:
+        buckets = dict(_buckets)
+    stats = {"{}/{}".format(*key): b.stats for key, b in sorted(buckets.items())}
+    stats["retry_budget"] = get_retry_budget().stats
+    return stats
+
+
+def is_connection_error(error):
+    """True for the connection errors and timeouts botocore itself retries."""
+    # imported here, botocore is not loaded until the first client is built.
+    from botocore.exceptions import (
+        ConnectionClosedError,
+        ConnectionError,
+        ReadTimeoutError,
+    )
+
+    # ConnectionError covers EndpointConnectionError and ConnectTimeoutError.
+    return isinstance(error, (ConnectionError, ConnectionClosedError, ReadTimeoutError))
+
+
+def is_retryable_error(error):
+    if is_throttle_error(error) or get_error_code(error) in TRANSIENT_ERROR_CODES:
+        return True
+    return is_connection_error(error)
+
+
+class LimitedClient(object):
+    """A boto3 client whose api calls are rate limited and budget retried.
+
+    Attributes which are not api calls, like `exceptions` and `meta`, are
+    the wrapped client's own.
+    """
+
+    def __init__(
+        self,
+        client,
+        region=None,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_delay=0.5,
+        max_delay=20,
+        sleep=time.sleep,
+    ):
+        self.client = client
+        if region is None:
+            region = getattr(getattr(client, "meta", None), "region_name", None)
+        self.region = region
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith("_") or name in LOCAL_ATTRIBUTES or not callable(attr):
+            return attr
+        return self._limited(name, attr)
+
+    def _limited(self, operation, method):
+        bucket = get_bucket(self.region, api_family(operation))
+
+        def call(*args, **kwargs):
+            budget = get_retry_budget()
+            for attempt in range(self.max_attempts):
+                bucket.acquire()
+                budget.deposit()
+                try:
+                    return method(*args, **kwargs)
+                except Exception as e:
+                    if not is_retryable_error(e):
+                        raise
+                    if is_throttle_error(e):
+                        bucket.on_throttle()
+                    if attempt == self.max_attempts - 1 or not budget.try_retry():
+                        raise
+                    delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                    logger.debug("Retrying %s in %.2fs: %r", operation, delay, e)
+                    self.sleep(delay)
+
+        call.__name__ = operation
+        return call
+
+
+def limit_client(client, region=None):
+    """Returns the LimitedClient of `client`, the same one on every call.
+
+    Caches keyed by session (tags, identifier kinds) keep working because
+    everyone using `client` gets the same wrapper.
+    """
+    with _lock:
+        limited = _limited_clients.get(client)
+        if limited is None:
+            limited = _limited_clients[client] = LimitedClient(client, region)
+        return limited
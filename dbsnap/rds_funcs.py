@@ -11,75 +11,132 @@ except ImportError:
 
 from .snapshot import Snapshot
 from .database import Database
+from .identifier_index import get_identifier_index, INSTANCE, CLUSTER
+from .utils import paginate, prefetch_tags
 
 VALID_SNAPSHOT_TYPES = ["automated", "manual"]
 
+# the largest page size the RDS describe calls accept.
+DESCRIBE_MAX_RECORDS = 100
+
 SAFETY_TAG_KEY = "dbsnap-verify"
 SAFETY_TAG_VAL = "true"
 
 
-def get_available_snapshots(session, identifier, snapshot_type=None):
-    """Returns snapshots in the available state for a given DB or Cluster `identifier`.
+def iter_snapshot_descriptions(session, identifier, snapshot_type=None):
+    """Yields raw snapshot descriptions for a given DB or Cluster `identifier`.
     Args:
         session (:class:`boto.rds2.layer1.RDSConnection`): The RDS api connection
             where the database is located.
         identifier (str): The database instance or cluster identifier whose snapshots
             you would like to examine.
         snapshot_type (str): The type of snapshot to look for. One of:
-            'automated', 'manual'. If not provided will return snapshots of
+            'automated', 'manual'. If not provided will yield snapshots of
             both types.
     Returns:
-        list: A list of dbsnap.Snapshot objects.
+        generator: snapshot description dictionaries, one page at a time.
     """
-    args = {}
+    args = {"MaxRecords": DESCRIBE_MAX_RECORDS}
 
     if snapshot_type:
         if snapshot_type not in VALID_SNAPSHOT_TYPES:
             raise ValueError("Invalid snapshot_type: {}".format(snapshot_type))
+        # let RDS filter by type instead of downloading everything.
         args["SnapshotType"] = snapshot_type
 
     # assume identifier is for a regular RDS database.
-    snapshots = session.describe_db_snapshots(DBInstanceIdentifier=identifier, **args)[
-        "DBSnapshots"
-    ]
-
-    if not snapshots:
+    found = False
+    for description in paginate(
+        session.describe_db_snapshots,
+        "DBSnapshots",
+        DBInstanceIdentifier=identifier,
+        **args
+    ):
+        found = True
+        yield description
+
+    if not found:
         # assume identifier is for a cluster RDS database.
-        snapshots = session.describe_db_cluster_snapshots(
-            DBClusterIdentifier=identifier, **args
-        )["DBClusterSnapshots"]
+        for description in paginate(
+            session.describe_db_cluster_snapshots,
+            "DBClusterSnapshots",
+            DBClusterIdentifier=identifier,
+            **args
+        ):
+            yield description
 
-    # convert snapshot descriptions into normalized Snapshot objects.
-    snapshots = [Snapshot(snapshot, session) for snapshot in snapshots]
 
-    # filter first because only available snapshots have a SnapshotCreateTime.
-    snapshots = [snapshot for snapshot in snapshots if snapshot.status == "available"]
+def iter_available_snapshots(session, identifier, snapshot_type=None):
+    """Yields snapshots in the available state for a given DB or Cluster `identifier`.
 
-    # sort snapshots list of Snapshots by created_time.
-    snapshots.sort(key=attrgetter("created_time"))
+    Snapshots are yielded lazily in the order RDS returns them (not sorted),
+    and only available snapshots are turned into Snapshot objects.
 
-    return snapshots
+    Args:
+        session (:class:`boto.rds2.layer1.RDSConnection`): The RDS api connection
+            where the database is located.
+        identifier (str): The database instance or cluster identifier whose snapshots
+            you would like to examine.
+        snapshot_type (str): The type of snapshot to look for. One of:
+            'automated', 'manual'. If not provided will yield snapshots of
+            both types.
+    Returns:
+        generator: dbsnap.Snapshot objects.
+    """
+    for description in iter_snapshot_descriptions(session, identifier, snapshot_type):
+        # filter first because only available snapshots have a SnapshotCreateTime.
+        if description.get("Status") == "available":
+            yield Snapshot(description, session)
+
+
+def get_available_snapshots(session, identifier, snapshot_type=None):
+    """Returns snapshots in the available state for a given DB or Cluster `identifier`.
+    Args:
+        session (:class:`boto.rds2.layer1.RDSConnection`): The RDS api connection
+            where the database is located.
+        identifier (str): The database instance or cluster identifier whose snapshots
+            you would like to examine.
+        snapshot_type (str): The type of snapshot to look for. One of:
+            'automated', 'manual'. If not provided will return snapshots of
+            both types.
+    Returns:
+        list: A list of dbsnap.Snapshot objects sorted by created_time.
+    """
+    return sorted(
+        iter_available_snapshots(session, identifier, snapshot_type),
+        key=attrgetter("created_time"),
+    )
 
 
-def get_available_dbsnap_snapshots(session, identifier):
+def get_available_dbsnap_snapshots(session, identifier, index=None):
     """Returns DB snapshots in the available state for a given db id.
     Args:
         session (:class:`boto.rds2.layer1.RDSConnection`): The RDS api connection
             where the database is located.
         identifier (str): The database instance or cluster identifier whose snapshots
             you would like to examine.
+        index (:class:`dbsnap.snapshot_index.SnapshotIndex`): answer from
+            this index, within its staleness bound, instead of listing.
     Returns:
-        list: A list of dictionaries representing the resulting snapshots.
+        list: A list of dbsnap.Snapshot objects sorted by created_time.
     """
-    dbsnap_snapshots = []
-    snapshots = get_available_snapshots(session, identifier, snapshot_type="manual")
-    for snapshot in snapshots:
-        if snapshot.tags.get("created_by") == "dbsnap-copy":
-            dbsnap_snapshots.append(snapshot)
+    if index is not None:
+        snapshots = index.get_snapshots(session, identifier, "manual")
+    else:
+        snapshots = iter_available_snapshots(
+            session, identifier, snapshot_type="manual"
+        )
+    snapshots = prefetch_tags(snapshots)
+    dbsnap_snapshots = [
+        snapshot
+        for snapshot in snapshots
+        if snapshot.tags.get("created_by") == "dbsnap-copy"
+    ]
+    dbsnap_snapshots.sort(key=attrgetter("created_time"))
     return dbsnap_snapshots
 
 
-def get_old_dbsnap_snapshots(session, identifier, keep_count):
+def get_old_dbsnap_snapshots(session, identifier, keep_count, index=None):
     """Returns the latest snapshots for a given database identifier.
 
     Args:
@@ -88,32 +145,44 @@ def get_old_dbsnap_snapshots(session, identifier, keep_count):
         identifier (str): The database instance identifier whose snapshots you
             want to examine.
         keep_count(int): The # of most recent snapshots to ignore.
+        index (:class:`dbsnap.snapshot_index.SnapshotIndex`): answer from
+            this index, within its staleness bound, instead of listing.
 
     Returns:
         list: A list of old snapshot IDs.
     """
-    snapshots = get_available_dbsnap_snapshots(session, identifier)
+    snapshots = get_available_dbsnap_snapshots(session, identifier, index)
     trim_index = len(snapshots) - keep_count
     # trim off the keepers from the list of old snapshots.
     return snapshots[:trim_index]
 
 
-def get_latest_snapshot(session, identifier, snapshot_type=None):
+def get_latest_snapshot(session, identifier, snapshot_type=None, index=None):
     """Returns the latest snapshot for a given database identifier.
     Args:
         session (:class:`boto.rds2.layer1.RDSConnection`): The RDS api connection
             where the database is located.
         identifier (str): The database instance or cluster identifier whose snapshots
             you would like to examine.
+        index (:class:`dbsnap.snapshot_index.SnapshotIndex`): answer from
+            this index, within its staleness bound, instead of listing.
     Returns:
         dict: The snapshot description document for the latest snapshot.
     """
-    snapshots = get_available_snapshots(session, identifier, snapshot_type)
-    if not snapshots:
+    if index is not None:
+        snapshots = index.get_snapshots(session, identifier, snapshot_type)
+    else:
+        snapshots = iter_available_snapshots(session, identifier, snapshot_type)
+    latest = None
+    for snapshot in snapshots:
+        # `>=` keeps the last of equally old snapshots, like a stable sort would.
+        if latest is None or snapshot.created_time >= latest.created_time:
+            latest = snapshot
+    if latest is None:
         raise ValueError(
             "No available snapshots found for identifier: {}".format(identifier)
         )
-    return snapshots[-1]
+    return latest
 
 
 def generate_password(size=9, pool=letters + digits):
@@ -183,6 +252,8 @@ def restore_from_latest_snapshot(session, identifier, sn_ids):
             connection where the database is located.
         identifier (str): The database instance identifier whose snapshots you
             want to examine.
+    Returns:
+        :class:`dbsnap.Snapshot`: the snapshot which is being restored.
     """
     snapshot = get_latest_snapshot(session, identifier)
 
@@ -202,6 +273,7 @@ def restore_from_latest_snapshot(session, identifier, sn_ids):
                 {"Key": SAFETY_TAG_KEY, "Value": SAFETY_TAG_VAL},
             ],
         )
+        get_identifier_index(session).set(new_identifier, CLUSTER)
 
     else:
         session.restore_db_instance_from_db_snapshot(
@@ -215,6 +287,9 @@ def restore_from_latest_snapshot(session, identifier, sn_ids):
                 {"Key": SAFETY_TAG_KEY, "Value": SAFETY_TAG_VAL},
             ],
         )
+        get_identifier_index(session).set(new_identifier, INSTANCE)
+
+    return snapshot
 
 
 def create_cluster_instance(cluster, instance_identifier):
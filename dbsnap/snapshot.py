@@ -1,64 +1,103 @@
-from .utils import get_tags_for_rds_arn
+from .tag_cache import get_tag_cache
+from .utils import get_tags_for_rds_arn, make_tag_dict
 
 
-class Snapshot(object):
-    """Normalise DB Instance and Cluster Snapshots into a single type."""
+def description_is_cluster(description):
+    """True for a DB Cluster Snapshot description, False for a DB Snapshot."""
+    if "DBClusterSnapshotIdentifier" in description:
+        return True
+    elif "DBSnapshotIdentifier" in description:
+        return False
+    raise LookupError(
+        "invalid snapshot_description: missing 'DBClusterSnapshotIdentifier' "
+        "or 'DBSnapshotIdentifier'"
+    )
 
-    def __init__(self, description, session=None):
 
-        self.description = description
+class Snapshot(object):
+    """Normalise DB Instance and Cluster Snapshots into a single type.
+
+    Only the fields dbsnap uses are kept, in slots, so listing thousands of
+    snapshots stays cheap. Pass `keep_description=True` to also keep the
+    raw describe dict in `description`, otherwise it is None.
+    """
+
+    __slots__ = (
+        "id",
+        "arn",
+        "type",
+        "status",
+        "created_time",
+        "kms_key_id",
+        "engine",
+        "engine_version",
+        "allocated_storage",
+        "is_cluster",
+        "session",
+        "description",
+    )
+
+    def __init__(self, description, session=None, keep_description=False):
+
+        self.description = description if keep_description else None
         self.session = session
 
-        self.setattrs_from_description()
+        self.setattrs_from_description(description)
 
-    def setattrs_from_description(self):
+    def setattrs_from_description(self, description):
+        self.is_cluster = description_is_cluster(description)
         if self.is_cluster:
-            self.compose_cluster()
+            self.compose_cluster(description)
         else:
-            self.compose_instance()
-
-    @property
-    def is_cluster(self):
-        if "DBClusterSnapshotIdentifier" in self.description:
-            return True
-        elif "DBSnapshotIdentifier" in self.description:
-            return False
-        raise LookupError(
-            "invalid snapshot_description: missing 'DBClusterSnapshotIdentifier' or 'DBSnapshotIdentifier'"
-        )
+            self.compose_instance(description)
+        self._compose_tags(description)
 
     @property
     def tags(self):
         return get_tags_for_rds_arn(self.session, self.arn)
 
+    def invalidate_tags(self):
+        """Forget cached tags, for example after tagging this resource."""
+        get_tag_cache(self.session).invalidate(self.arn)
+
+    def _compose_tags(self, description):
+        # newer describe responses include the tags, saving a lookup.
+        tag_list = description.get("TagList")
+        if tag_list is not None and self.session is not None:
+            get_tag_cache(self.session).set(self.arn, make_tag_dict(tag_list))
+
     @property
     def region(self):
         return self.arn.split(":")[3]
 
-    def _compose_common(self):
-        self.type = self.description["SnapshotType"]
-        self.status = self.description["Status"]
-        # only snapshots in available status have this key.
-        self.created_time = self.description.get("SnapshotCreateTime")
-        self.kms_key_id = self.description.get("KmsKeyId")
-        self.engine = self.description["Engine"]
-        self.engine_version = self.description["EngineVersion"]
-
-    def compose_cluster(self):
-        self._compose_common()
-        self.arn = self.description["DBClusterSnapshotArn"]
-        self.id = self.description["DBClusterSnapshotIdentifier"]
-
-    def compose_instance(self):
-        self._compose_common()
-        self.arn = self.description["DBSnapshotArn"]
-        self.id = self.description["DBSnapshotIdentifier"]
+    def _compose_common(self, description):
+        self.type = description["SnapshotType"]
+        self.status = description["Status"]
+        # only snapshots in available status have this key, botocore has
+        # already parsed it into a datetime.
+        self.created_time = description.get("SnapshotCreateTime")
+        self.kms_key_id = description.get("KmsKeyId")
+        self.engine = description["Engine"]
+        self.engine_version = description["EngineVersion"]
+        # GB, used to report copy throughput.
+        self.allocated_storage = description.get("AllocatedStorage")
+
+    def compose_cluster(self, description):
+        self._compose_common(description)
+        self.arn = description["DBClusterSnapshotArn"]
+        self.id = description["DBClusterSnapshotIdentifier"]
+
+    def compose_instance(self, description):
+        self._compose_common(description)
+        self.arn = description["DBSnapshotArn"]
+        self.id = description["DBSnapshotIdentifier"]
 
     def delete(self):
         if self.is_cluster:
             self.session.delete_db_cluster_snapshot(DBClusterSnapshotIdentifier=self.id)
         else:
             self.session.delete_db_snapshot(DBSnapshotIdentifier=self.id)
+        self.invalidate_tags()
 
     def copy(self, target_snapshot_name, dest_session=None, tags=None, kms_key=None):
 
@@ -78,8 +117,16 @@ class Snapshot(object):
         if self.is_cluster:
             copy_args["SourceDBClusterSnapshotIdentifier"] = self.arn
             copy_args["TargetDBClusterSnapshotIdentifier"] = target_snapshot_name
-            dest_session.copy_db_cluster_snapshot(**copy_args)
+            response = dest_session.copy_db_cluster_snapshot(**copy_args)
+            description = response["DBClusterSnapshot"]
+            target_arn = description["DBClusterSnapshotArn"]
         else:
             copy_args["SourceDBSnapshotIdentifier"] = self.arn
             copy_args["TargetDBSnapshotIdentifier"] = target_snapshot_name
-            dest_session.copy_db_snapshot(**copy_args)
+            response = dest_session.copy_db_snapshot(**copy_args)
+            description = response["DBSnapshot"]
+            target_arn = description["DBSnapshotArn"]
+        # the copy was just tagged, don't trust tags cached for an older
+        # snapshot which had the same name.
+        get_tag_cache(dest_session).invalidate(target_arn)
+        return Snapshot(description, dest_session)
@@ -0,0 +1,280 @@
+"""Remember the available snapshots of databases between runs.
+
+A SnapshotIndex holds an entry per (region, identifier, snapshot type)
+with the available snapshots, their tags once known and when the entry
+was last refreshed.
+
+RDS can not list only the snapshots created after a point in time, so a
+refresh still pages through the describe call once. What the index saves:
+
+* entries younger than `max_age` seconds answer without any api call,
+* snapshots already in the index keep their tags, so only new snapshots
+  need a tag lookup, which used to be one call per snapshot,
+* snapshots missing from a refresh are dropped, reconciling deletions
+  without extra calls.
+
+`force=True` (a full resync) throws an entry away and starts over.
+
+The index persists as JSON in a local file or in S3::
+
+    index = load_snapshot_index("s3://my-bucket/dbsnap-copy-index.json")
+    latest = get_latest_snapshot(session, "prod-db", index=index)
+    index.save()
+"""
+import json
+import threading
+import time
+
+from .clients import get_client
+from .snapshot import Snapshot
+from .tag_cache import get_tag_cache
+from .utils import datetime_to_timestamp, timestamp_to_datetime
+
+# seconds an entry may answer without asking RDS again.
+DEFAULT_MAX_AGE = 3600
+
+INDEX_VERSION = 1
+
+
+def session_region(session):
+    """Returns the region name of a boto3 client (or a fake), or None."""
+    return getattr(getattr(session, "meta", None), "region_name", None)
+
+
+def snapshot_to_record(snapshot, tags=None):
+    """Returns a JSON serializable dict of a dbsnap.Snapshot."""
+    return {
+        "id": snapshot.id,
+        "arn": snapshot.arn,
+        "type": snapshot.type,
+        "status": snapshot.status,
+        # None until the snapshot is available.
+        "created_time": snapshot.created_time
+        and datetime_to_timestamp(snapshot.created_time),
+        "kms_key_id": snapshot.kms_key_id,
+        "engine": snapshot.engine,
+        "engine_version": snapshot.engine_version,
+        "allocated_storage": snapshot.allocated_storage,
+        "is_cluster": snapshot.is_cluster,
+        "tags": tags,
+    }
+
+
+def record_to_snapshot(record, session=None):
+    """Returns a dbsnap.Snapshot of a record, seeding the tag cache."""
+    if record["is_cluster"]:
+        description = {
+            "DBClusterSnapshotIdentifier": record["id"],
+            "DBClusterSnapshotArn": record["arn"],
+        }
+    else:
+        description = {
+            "DBSnapshotIdentifier": record["id"],
+            "DBSnapshotArn": record["arn"],
+        }
+    description.update(
+        {
+            "SnapshotType": record["type"],
+            "Status": record["status"],
+            "Engine": record["engine"],
+            "EngineVersion": record["engine_version"],
+        }
+    )
+    if record["created_time"] is not None:
+        description["SnapshotCreateTime"] = timestamp_to_datetime(
+            record["created_time"]
+        )
+    if record.get("allocated_storage") is not None:
+        description["AllocatedStorage"] = record["allocated_storage"]
+    if record["kms_key_id"] is not None:
+        description["KmsKeyId"] = record["kms_key_id"]
+    if record["tags"] is not None:
+        description["TagList"] = [
+            {"Key": k, "Value": v} for k, v in record["tags"].items()
+        ]
+    return Snapshot(description, session)
+
+
+class SnapshotIndex(object):
+    """Available snapshots by region and identifier, see the module docstring.
+
+    Args:
+        entries (dict): previously saved entries, see `to_dict`.
+        location (str): a file path or s3://bucket/key to save to.
+        max_age (int): seconds an entry answers without a refresh.
+        clock (callable): returns the current time in seconds.
+    """
+
+    def __init__(
+        self, entries=None, location=None, max_age=DEFAULT_MAX_AGE, clock=time.time
+    ):
+        self.entries = entries or {}
+        self.location = location
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.refreshes = 0
+        self.tags_reused = 0
+        self.deletions_reconciled = 0
+        # sessions of entries touched in this run, to collect their tags.
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(session, identifier, snapshot_type=None):
+        return "{}/{}/{}".format(
+            session_region(session), identifier, snapshot_type or "all"
+        )
+
+    def get_snapshots(
+        self, session, identifier, snapshot_type=None, max_age=None, force=False
+    ):
+        """Returns available dbsnap.Snapshot objects sorted by created_time.
+
+        Args:
+            session: The RDS api connection where the database is located.
+            identifier (str): The database instance or cluster identifier.
+            snapshot_type (str): 'automated', 'manual' or None for both.
+            max_age (int): override the index `max_age` for this lookup.
+            force (bool): ignore the entry and list everything again.
+        """
+        key = self.key(session, identifier, snapshot_type)
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            entry = None if force else self.entries.get(key)
+            self._sessions[key] = session
+        if entry is not None and self.clock() - entry["refreshed_at"] < max_age:
+            with self._lock:
+                self.hits += 1
+        else:
+            entry = self._refresh(key, session, identifier, snapshot_type, entry)
+        records = sorted(entry["snapshots"].values(), key=lambda r: r["created_time"])
+        return [record_to_snapshot(r, session) for r in records]
+
+    def _refresh(self, key, session, identifier, snapshot_type, entry):
+        # avoid a circular import, rds_funcs accepts an index argument.
+        from .rds_funcs import iter_available_snapshots
+
+        old = entry["snapshots"] if entry else {}
+        refreshed_at = self.clock()
+        records = {}
+        tags_reused = 0
+        for snapshot in iter_available_snapshots(session, identifier, snapshot_type):
+            previous = old.get(snapshot.id)
+            tags = previous["tags"] if previous else None
+            if tags is not None:
+                tags_reused += 1
+            records[snapshot.id] = snapshot_to_record(snapshot, tags)
+        entry = {"refreshed_at": refreshed_at, "snapshots": records}
+        with self._lock:
+            self.entries[key] = entry
+            self.refreshes += 1
+            self.tags_reused += tags_reused
+            self.deletions_reconciled += len(set(old) - set(records))
+        return entry
+
+    def forget(self, session, snapshots):
+        """Drop deleted snapshots from every entry of their region."""
+        region = "{}/".format(session_region(session))
+        ids = set(s.id for s in snapshots)
+        with self._lock:
+            for key, entry in self.entries.items():
+                if key.startswith(region):
+                    for snapshot_id in ids:
+                        entry["snapshots"].pop(snapshot_id, None)
+
+    def invalidate(self, session=None, identifier=None):
+        """Force a refresh of an identifier's entries, or of everything."""
+        with self._lock:
+            if session is None:
+                self.entries.clear()
+                return
+            prefix = "{}/{}/".format(session_region(session), identifier)
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                del self.entries[key]
+
+    def _collect_tags(self):
+        """Copy tags looked up during this run into the entries."""
+        with self._lock:
+            for key, session in self._sessions.items():
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                cache = get_tag_cache(session)
+                for record in entry["snapshots"].values():
+                    if record["tags"] is None:
+                        record["tags"] = cache.get(record["arn"])
+
+    @property
+    def stats(self):
+        """dict: counters to log at the end of a run."""
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "tags_reused": self.tags_reused,
+            "deletions_reconciled": self.deletions_reconciled,
+        }
+
+    def to_dict(self):
+        self._collect_tags()
+        with self._lock:
+            return {"version": INDEX_VERSION, "entries": self.entries}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def save(self, location=None):
+        """Write the index to a file path or s3://bucket/key."""
+        write_location(location or self.location, self.to_json())
+
+
+def parse_s3_location(location):
+    """Returns (bucket, key) of an s3://bucket/key location."""
+    bucket, _, key = location[len("s3://") :].partition("/")
+    if not bucket or not key:
+        raise ValueError(
+            "S3 location {} not in s3://<bucket>/<key> form.".format(location)
+        )
+    return bucket, key
+
+
+def read_location(location):
+    """Returns the text saved at a file path or s3://bucket/key, or None."""
+    if location.startswith("s3://"):
+        bucket, key = parse_s3_location(location)
+        s3 = get_client("s3")
+        try:
+            return s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+        except s3.exceptions.NoSuchKey:
+            return None
+    try:
+        with open(location, "r") as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def write_location(location, body):
+    """Save the text `body` to a file path or s3://bucket/key."""
+    if location.startswith("s3://"):
+        bucket, key = parse_s3_location(location)
+        get_client("s3").put_object(Bucket=bucket, Key=key, Body=body)
+    else:
+        with open(location, "w") as f:
+            f.write(body)
+
+
+def load_snapshot_index(location, max_age=DEFAULT_MAX_AGE, clock=time.time):
+    """Returns the SnapshotIndex saved at `location`, or an empty one.
+
+    Args:
+        location (str): a file path or s3://bucket/key.
+    """
+    body = read_location(location)
+    entries = None
+    if body:
+        document = json.loads(body)
+        if document.get("version") == INDEX_VERSION:
+            entries = document["entries"]
+    return SnapshotIndex(entries, location=location, max_age=max_age, clock=clock)
@@ -0,0 +1,71 @@
+import threading
+import time
+import weakref
+
+# seconds a resolved tag dictionary is trusted before asking RDS again.
+DEFAULT_TAG_TTL = 300
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+class TagCache(object):
+    """Remember RDS resource tags by ARN for a limited time."""
+
+    def __init__(self, ttl=DEFAULT_TAG_TTL, clock=time.time):
+        """
+        ttl (int): seconds to keep an entry before it expires.
+        clock (callable): returns the current time in seconds.
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, arn):
+        """Return the cached tag dictionary for `arn` or None."""
+        with self._lock:
+            entry = self._entries.get(arn)
+            if entry is not None and entry[0] > self.clock():
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(arn, None)
+            self.misses += 1
+            return None
+
+    def set(self, arn, tags):
+        with self._lock:
+            self._entries[arn] = (self.clock() + self.ttl, tags)
+
+    def invalidate(self, arn=None):
+        """Forget the tags of `arn`, or every entry when `arn` is None."""
+        with self._lock:
+            if arn is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(arn, None)
+
+    @property
+    def stats(self):
+        """dict: hit and miss counters, for example to log at exit."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+            "size": len(self),
+        }
+
+
+def get_tag_cache(session):
+    """Returns the TagCache shared by everything using this RDS `session`."""
+    with _caches_lock:
+        cache = _caches.get(session)
+        if cache is None:
+            cache = _caches[session] = TagCache()
+        return cache
@@ -0,0 +1,5 @@
+"""Test helpers for dbsnap, see `dbsnap.testing.fake_aws`.
+
+This package is left out of the dbsnap distribution (and so out of the
+Lambda bundle), use it from a checkout of the repository.
+"""
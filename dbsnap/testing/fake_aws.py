@@ -0,0 +1,1031 @@
+"""An in-process stand-in for the RDS and S3 apis used by dbsnap.
+
+Use it to run dbsnap-copy and the dbsnap-verify state machine offline,
+in tests or benchmarks. Every fake client quacks like the boto3 client
+it replaces, so pass it anywhere a `session` is expected, or install
+the whole fake account into the shared client pool::
+
+    aws = FakeAWS()
+    aws.rds("us-east-1").add_instance("prod-db")
+    aws.rds("us-east-1").add_snapshot("prod-db", count=40)
+    aws.install()  # dbsnap.clients.get_client now returns fakes.
+
+The fakes model snapshots, instances, clusters, restores and copies
+which take (simulated) time, tags, events, subnet groups, Marker based
+pagination and throttling. Time is read from `FakeAWS.clock`, which is
+a :class:`SimulatedClock` starting at the current time unless you pass
+another clock, so state transitions happen when the test advances it.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc
+
+from ..clients import set_client_factory
+
+DEFAULT_ACCOUNT_ID = "123456789012"
+
+# pass SimulatedClock(EPOCH) for repeatable generated names and timestamps.
+EPOCH = 1514764800.0  # 2018-01-01T00:00:00Z
+
+
+class SimulatedClock(object):
+    """A clock which only moves when told to.
+
+    It starts at the current time unless told otherwise, code under test
+    which reads the wall clock itself (dbsnap_verify's `now_timestamp`)
+    then agrees with the fake about what is recent.
+    """
+
+    def __init__(self, now=None):
+        self.now = time.time() if now is None else now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def _error_class(name, code=None):
+    code = code or name
+
+    def __init__(self, message="", operation_name="Fake"):
+        ClientError.__init__(
+            self, {"Error": {"Code": code, "Message": message}}, operation_name
+        )
+
+    return type(name, (ClientError,), {"__init__": __init__})
+
+
+class FakeExceptions(object):
+    """Modeled exceptions, like a boto3 client's `exceptions` attribute."""
+
+    ClientError = ClientError
+    DBInstanceNotFoundFault = _error_class(
+        "DBInstanceNotFoundFault", "DBInstanceNotFound"
+    )
+    DBClusterNotFoundFault = _error_class("DBClusterNotFoundFault")
+    DBSnapshotNotFoundFault = _error_class(
+        "DBSnapshotNotFoundFault", "DBSnapshotNotFound"
+    )
+    DBClusterSnapshotNotFoundFault = _error_class("DBClusterSnapshotNotFoundFault")
+    DBSnapshotAlreadyExistsFault = _error_class(
+        "DBSnapshotAlreadyExistsFault", "DBSnapshotAlreadyExists"
+    )
+    DBSubnetGroupNotFoundFault = _error_class("DBSubnetGroupNotFoundFault")
+    InvalidDBInstanceStateFault = _error_class(
+        "InvalidDBInstanceStateFault", "InvalidDBInstanceState"
+    )
+    InvalidParameterValueException = _error_class(
+        "InvalidParameterValueException", "InvalidParameterValue"
+    )
+    SnapshotQuotaExceededFault = _error_class(
+        "SnapshotQuotaExceededFault", "SnapshotQuotaExceeded"
+    )
+    ThrottlingException = _error_class("ThrottlingException", "Throttling")
+    NoSuchKey = _error_class("NoSuchKey")
+    PreconditionFailed = _error_class("PreconditionFailed")
+
+
+def _to_datetime(ts):
+    return datetime.fromtimestamp(ts, tzutc())
+
+
+def _matches_filters(record, filters, fields):
+    """True if `record` passes every RDS style {"Name", "Values"} filter."""
+    for f in filters or []:
+        field = fields.get(f["Name"])
+        if field is None:
+            raise FakeExceptions.InvalidParameterValueException(
+                "Unrecognized filter name: {}".format(f["Name"])
+            )
+        if record.get(field) not in f["Values"]:
+            return False
+    return True
+
+
+ClientMeta = namedtuple("ClientMeta", "region_name")
+
+
+class FakeService(object):
+    """Shared plumbing: call counting, latency, throttling and paging."""
+
+    exceptions = FakeExceptions
+
+    def __init__(self, aws, region):
+        self.aws = aws
+        self.region = region
+        self.meta = ClientMeta(region)
+        self.calls = Counter()
+        self.throttle_rate = 0.0
+        self._throttle_next = 0
+        self._random = random.Random(0)
+        self.lock = threading.RLock()
+
+    def _call(self, operation):
+        """Account for an api call, maybe raising an injected throttle."""
+        with self.lock:
+            self.calls[operation] += 1
+            throttle = self._throttle_next > 0 or (
+                self.throttle_rate and self._random.random() < self.throttle_rate
+            )
+            if self._throttle_next > 0:
+                self._throttle_next -= 1
+        if self.aws.latency:
+            time.sleep(self.aws.latency)
+        if throttle:
+            with self.lock:
+                self.calls["throttled"] += 1
+            raise FakeExceptions.ThrottlingException("Rate exceeded", operation)
+        self.aws.run_due()
+
+    def throttle(self, count=1):
+        """Throttle the next `count` calls."""
+        with self.lock:
+            self._throttle_next += count
+
+    def _page(self, records, result_key, MaxRecords=None, Marker=None):
+        page_size = MaxRecords or 100
+        if not 20 <= page_size <= 100:
+            raise FakeExceptions.InvalidParameterValueException(
+                "MaxRecords must be between 20 and 100"
+            )
+        start = int(Marker or 0)
+        response = {result_key: records[start : start + page_size]}
+        if start + page_size < len(records):
+            response["Marker"] = str(start + page_size)
+        return response
+
+    @property
+    def call_count(self):
+        return sum(v for k, v in self.calls.items() if k != "throttled")
+
+
+class FakeRDS(FakeService):
+    """A fake boto3 RDS client for one region."""
+
+    def __init__(self, aws, region):
+        super(FakeRDS, self).__init__(aws, region)
+        self.instances = {}
+        self.clusters = {}
+        self.snapshots = {}
+        self.cluster_snapshots = {}
+        self.subnet_groups = {}
+        self.tags = {}
+        self.events = []
+
+    # -- helpers to build a fake account -------------------------------
+
+    def arn(self, resource_type, identifier):
+        return "arn:aws:rds:{}:{}:{}:{}".format(
+            self.region, self.aws.account_id, resource_type, identifier
+        )
+
+    def add_instance(
+        self,
+        identifier,
+        engine="postgres",
+        engine_version="9.6.6",
+        status="available",
+        allocated_storage=100,
+        cluster=None,
+        tags=None,
+    ):
+        """Add an RDS DB instance and return its record."""
+        arn = self.arn("db", identifier)
+        record = {
+            "DBInstanceIdentifier": identifier,
+            "DBInstanceArn": arn,
+            "DBInstanceStatus": status,
+            "Engine": engine,
+            "EngineVersion": engine_version,
+            "AllocatedStorage": allocated_storage,
+            "MasterUsername": "root",
+            "Endpoint": {
+                "Address": "{}.fake.{}.rds.amazonaws.com".format(
+                    identifier, self.region
+                ),
+                "Port": 5432,
+            },
+            "InstanceCreateTime": _to_datetime(self.aws.clock()),
+        }
+        if cluster is not None:
+            record["DBClusterIdentifier"] = cluster
+            self.clusters[cluster]["DBClusterMembers"].append(
+                {"DBInstanceIdentifier": identifier, "IsClusterWriter": True}
+            )
+        self.instances[identifier] = record
+        self.tags[arn] = dict(tags or {})
+        return record
+
+    def add_cluster(
+        self,
+        identifier,
+        engine="aurora-postgresql",
+        engine_version="9.6.6",
+        status="available",
+        members=1,
+        tags=None,
+    ):
+        """Add an Aurora cluster with `members` instances, return its record."""
+        arn = self.arn("cluster", identifier)
+        self.clusters[identifier] = {
+            "DBClusterIdentifier": identifier,
+            "DBClusterArn": arn,
+            "Status": status,
+            "Engine": engine,
+            "EngineVersion": engine_version,
+            "AllocatedStorage": 1,
+            "MasterUsername": "root",
+            "Endpoint": "{}.cluster-fake.{}.rds.amazonaws.com".format(
+                identifier, self.region
+            ),
+            "Port": 5432,
+            "DBClusterMembers": [],
+        }
+        self.tags[arn] = dict(tags or {})
+        for i in range(members):
+            self.add_instance(
+                "{}-{}".format(identifier, i),
+                engine=engine,
+                engine_version=engine_version,
+                cluster=identifier,
+            )
+        return self.clusters[identifier]
+
+    def add_snapshot(
+        self,
+        identifier,
+        snapshot_id=None,
+        snapshot_type="automated",
+        status="available",
+        created=None,
+        count=1,
+        interval=86400,
+        tags=None,
+    ):
+        """Add `count` snapshots of a database or cluster, one per `interval`.
+
+        The newest snapshot is taken at `created` (default: now) and older
+        ones `interval` seconds apart, like daily automated snapshots.
+        Snapshots outlive their database, so `identifier` need not exist
+        in this region, it is then taken to be a postgres instance.
+
+        Returns:
+            list: the snapshot records, oldest first.
+        """
+        is_cluster = identifier in self.clusters
+        source = (
+            self.clusters[identifier] if is_cluster else self.instances.get(identifier)
+        )
+        if source is None:
+            source = {
+                "DBInstanceIdentifier": identifier,
+                "Engine": "postgres",
+                "EngineVersion": "9.6.6",
+            }
+        created = self.aws.clock() if created is None else created
+        records = []
+        for i in reversed(range(count)):
+            ts = created - i * interval
+            name = snapshot_id or "rds:{}-{}".format(
+                identifier, _to_datetime(ts).strftime("%Y-%m-%d-%H-%M")
+            )
+            if count > 1 and snapshot_id:
+                name = "{}-{}".format(snapshot_id, i)
+            records.append(
+                self._put_snapshot(
+                    name,
+                    source,
+                    is_cluster,
+                    snapshot_type,
+                    status,
+                    ts,
+                    tags,
+                )
+            )
+        return records
+
+    def _put_snapshot(
+        self, name, source, is_cluster, snapshot_type, status, created, tags
+    ):
+        if is_cluster:
+            record = {
+                "DBClusterSnapshotIdentifier": name,
+                "DBClusterSnapshotArn": self.arn("cluster-snapshot", name),
+                "DBClusterIdentifier": source["DBClusterIdentifier"],
+            }
+            arn = record["DBClusterSnapshotArn"]
+            self.cluster_snapshots[name] = record
+        else:
+            record = {
+                "DBSnapshotIdentifier": name,
+                "DBSnapshotArn": self.arn("snapshot", name),
+                "DBInstanceIdentifier": source["DBInstanceIdentifier"],
+            }
+            arn = record["DBSnapshotArn"]
+            self.snapshots[name] = record
+        record.update(
+            {
+                "Engine": source["Engine"],
+                "EngineVersion": source["EngineVersion"],
+                "SnapshotType": snapshot_type,
+                "Status": status,
+                "AllocatedStorage": source.get("AllocatedStorage", 100),
+                "PercentProgress": 100 if status == "available" else 0,
+            }
+        )
+        if status == "available":
+            record["SnapshotCreateTime"] = _to_datetime(created)
+        self.tags[arn] = dict(tags or {})
+        return record
+
+    def fail_snapshot(self, snapshot_id):
+        """Make a snapshot (copy) in progress fail."""
+        with self.lock:
+            record = (
+                self.snapshots.get(snapshot_id) or self.cluster_snapshots[snapshot_id]
+            )
+            record["Status"] = "failed"
+            record.pop("_progress", None)
+
+    def add_event(self, source_id, source_type, message):
+        self.events.append(
+            {
+                "SourceIdentifier": source_id,
+                "SourceType": source_type,
+                "Message": message,
+                "EventCategories": [],
+                "Date": _to_datetime(self.aws.clock()),
+            }
+        )
+
+    # -- describe calls ------------------------------------------------
+
+    def _describe(
+        self, table, result_key, id_field, identifier, not_found, fields, kwargs
+    ):
+        records = sorted(table.values(), key=lambda r: r[id_field])
+        if identifier is not None:
+            records = [r for r in records if r[id_field] == identifier]
+            if not records and not_found is not None:
+                raise not_found(identifier)
+        records = [
+            (
+                dict(self._public(r), TagList=self._tag_list(r))
+                if self.aws.describe_tags
+                else self._public(r)
+            )
+            for r in records
+            if _matches_filters(r, kwargs.get("Filters"), fields)
+        ]
+        return self._page(
+            records, result_key, kwargs.get("MaxRecords"), kwargs.get("Marker")
+        )
+
+    def _tag_list(self, record):
+        arn = [v for k, v in record.items() if k.endswith("Arn")][0]
+        return [{"Key": k, "Value": v} for k, v in sorted(self.tags[arn].items())]
+
+    def describe_db_instances(self, DBInstanceIdentifier=None, **kwargs):
+        self._call("describe_db_instances")
+        with self.lock:
+            return self._describe(
+                self.instances,
+                "DBInstances",
+                "DBInstanceIdentifier",
+                DBInstanceIdentifier,
+                FakeExceptions.DBInstanceNotFoundFault,
+                {
+                    "db-instance-id": "DBInstanceIdentifier",
+                    "db-cluster-id": "DBClusterIdentifier",
+                },
+                kwargs,
+            )
+
+    def describe_db_clusters(self, DBClusterIdentifier=None, **kwargs):
+        self._call("describe_db_clusters")
+        with self.lock:
+            return self._describe(
+                self.clusters,
+                "DBClusters",
+                "DBClusterIdentifier",
+                DBClusterIdentifier,
+                FakeExceptions.DBClusterNotFoundFault,
+                {"db-cluster-id": "DBClusterIdentifier"},
+                kwargs,
+            )
+
+    def _snapshot_records(self, table, source_field, identifier, kwargs):
+        records = list(table.values())
+        if identifier is not None:
+            records = [r for r in records if r[source_field] == identifier]
+        snapshot_type = kwargs.pop("SnapshotType", None)
+        if snapshot_type:
+            records = [r for r in records if r["SnapshotType"] == snapshot_type]
+        return records
+
+    def describe_db_snapshots(self, DBInstanceIdentifier=None, **kwargs):
+        self._call("describe_db_snapshots")
+        with self.lock:
+            records = self._snapshot_records(
+                self.snapshots, "DBInstanceIdentifier", DBInstanceIdentifier, kwargs
+            )
+            return self._describe(
+                {r["DBSnapshotIdentifier"]: r for r in records},
+                "DBSnapshots",
+                "DBSnapshotIdentifier",
+                kwargs.pop("DBSnapshotIdentifier", None),
+                FakeExceptions.DBSnapshotNotFoundFault,
+                {
+                    "db-instance-id": "DBInstanceIdentifier",
+                    "db-snapshot-id": "DBSnapshotIdentifier",
+                    "snapshot-type": "SnapshotType",
+                },
+                kwargs,
+            )
+
+    def describe_db_cluster_snapshots(self, DBClusterIdentifier=None, **kwargs):
+        self._call("describe_db_cluster_snapshots")
+        with self.lock:
+            records = self._snapshot_records(
+                self.cluster_snapshots,
+                "DBClusterIdentifier",
+                DBClusterIdentifier,
+                kwargs,
+            )
+            return self._describe(
+                {r["DBClusterSnapshotIdentifier"]: r for r in records},
+                "DBClusterSnapshots",
+                "DBClusterSnapshotIdentifier",
+                kwargs.pop("DBClusterSnapshotIdentifier", None),
+                FakeExceptions.DBClusterSnapshotNotFoundFault,
+                {
+                    "db-cluster-id": "DBClusterIdentifier",
+                    "db-cluster-snapshot-id": "DBClusterSnapshotIdentifier",
+                    "snapshot-type": "SnapshotType",
+                },
+                kwargs,
+            )
+
+    def describe_events(
+        self,
+        SourceIdentifier=None,
+        SourceType=None,
+        StartTime=None,
+        Duration=60,
+        EventCategories=None,
+        **kwargs
+    ):
+        self._call("describe_events")
+        with self.lock:
+            if StartTime is None:
+                start = _to_datetime(self.aws.clock() - Duration * 60)
+            elif StartTime.tzinfo is None:
+                start = StartTime.replace(tzinfo=tzutc())
+            else:
+                start = StartTime
+            events = [
+                e
+                for e in self.events
+                if (
+                    SourceIdentifier is None
+                    or e["SourceIdentifier"] == SourceIdentifier
+                )
+                and (SourceType is None or e["SourceType"] == SourceType)
+                and e["Date"] >= start
+            ]
+            return self._page(
+                events, "Events", kwargs.get("MaxRecords"), kwargs.get("Marker")
+            )
+
+    def list_tags_for_resource(self, ResourceName):
+        self._call("list_tags_for_resource")
+        with self.lock:
+            tags = self.tags.get(ResourceName, {})
+            return {
+                "TagList": [{"Key": k, "Value": v} for k, v in sorted(tags.items())]
+            }
+
+    def add_tags_to_resource(self, ResourceName, Tags):
+        self._call("add_tags_to_resource")
+        with self.lock:
+            self.tags.setdefault(ResourceName, {}).update(
+                {t["Key"]: t["Value"] for t in Tags}
+            )
+        return {}
+
+    # -- snapshots -----------------------------------------------------
+
+    def _source_snapshot(self, identifier, is_cluster):
+        """Find a snapshot by name or ARN, in any region of the account."""
+        if identifier.startswith("arn:"):
+            region = identifier.split(":")[3]
+            rds = self.aws.rds(region)
+            identifier = identifier.split(":", 6)[6]
+        else:
+            rds = self
+        table = rds.cluster_snapshots if is_cluster else rds.snapshots
+        record = table.get(identifier)
+        if record is None or record["Status"] != "available":
+            if is_cluster:
+                raise FakeExceptions.DBClusterSnapshotNotFoundFault(identifier)
+            raise FakeExceptions.DBSnapshotNotFoundFault(identifier)
+        return record
+
+    def _copy(self, source, target_name, is_cluster, tags):
+        if is_cluster:
+            if target_name in self.cluster_snapshots:
+                raise FakeExceptions.DBSnapshotAlreadyExistsFault(target_name)
+            db = {
+                "DBClusterIdentifier": source["DBClusterIdentifier"],
+                "Engine": source["Engine"],
+                "EngineVersion": source["EngineVersion"],
+                "AllocatedStorage": source["AllocatedStorage"],
+            }
+        else:
+            if target_name in self.snapshots:
+                raise FakeExceptions.DBSnapshotAlreadyExistsFault(target_name)
+            db = {
+                "DBInstanceIdentifier": source["DBInstanceIdentifier"],
+                "Engine": source["Engine"],
+                "EngineVersion": source["EngineVersion"],
+                "AllocatedStorage": source["AllocatedStorage"],
+            }
+        in_flight = len(
+            [
+                r
+                for r in list(self.snapshots.values())
+                + list(self.cluster_snapshots.values())
+                if r["Status"] == "creating"
+            ]
+        )
+        if in_flight >= self.aws.copy_quota:
+            raise FakeExceptions.SnapshotQuotaExceededFault(
+                "Cannot have more than {} snapshot copies in progress".format(
+                    self.aws.copy_quota
+                )
+            )
+        tag_dict = {t["Key"]: t["Value"] for t in tags or []}
+        record = self._put_snapshot(
+            target_name, db, is_cluster, "manual", "creating", None, tag_dict
+        )
+        started = self.aws.clock()
+        duration = self.aws.copy_seconds(source)
+        record["_progress"] = (started, duration)
+
+        def finish():
+            if record["Status"] != "creating":
+                # failed (see fail_snapshot) or deleted meanwhile.
+                return
+            record["Status"] = "available"
+            record["PercentProgress"] = 100
+            record["SnapshotCreateTime"] = _to_datetime(started + duration)
+            record.pop("_progress", None)
+
+        self.aws.schedule(duration, finish)
+        return record
+
+    def copy_db_snapshot(
+        self,
+        SourceDBSnapshotIdentifier,
+        TargetDBSnapshotIdentifier,
+        Tags=None,
+        **kwargs
+    ):
+        self._call("copy_db_snapshot")
+        with self.lock:
+            source = self._source_snapshot(SourceDBSnapshotIdentifier, False)
+            record = self._copy(source, TargetDBSnapshotIdentifier, False, Tags)
+            return {"DBSnapshot": self._public(record)}
+
+    def copy_db_cluster_snapshot(
+        self,
+        SourceDBClusterSnapshotIdentifier,
+        TargetDBClusterSnapshotIdentifier,
+        Tags=None,
+        **kwargs
+    ):
+        self._call("copy_db_cluster_snapshot")
+        with self.lock:
+            source = self._source_snapshot(SourceDBClusterSnapshotIdentifier, True)
+            record = self._copy(source, TargetDBClusterSnapshotIdentifier, True, Tags)
+            return {"DBClusterSnapshot": self._public(record)}
+
+    def _public(self, record):
+        """A copy of a record without private bookkeeping, with progress."""
+        progress = record.get("_progress")
+        record = {k: v for k, v in record.items() if not k.startswith("_")}
+        if progress is not None:
+            started, duration = progress
+            elapsed = self.aws.clock() - started
+            record["PercentProgress"] = min(99, int(100 * elapsed / max(duration, 1)))
+        return record
+
+    def delete_db_snapshot(self, DBSnapshotIdentifier):
+        self._call("delete_db_snapshot")
+        with self.lock:
+            record = self.snapshots.pop(DBSnapshotIdentifier, None)
+            if record is None:
+                raise FakeExceptions.DBSnapshotNotFoundFault(DBSnapshotIdentifier)
+            self.tags.pop(record["DBSnapshotArn"], None)
+            return {"DBSnapshot": dict(self._public(record), Status="deleted")}
+
+    def delete_db_cluster_snapshot(self, DBClusterSnapshotIdentifier):
+        self._call("delete_db_cluster_snapshot")
+        with self.lock:
+            record = self.cluster_snapshots.pop(DBClusterSnapshotIdentifier, None)
+            if record is None:
+                raise FakeExceptions.DBClusterSnapshotNotFoundFault(
+                    DBClusterSnapshotIdentifier
+                )
+            self.tags.pop(record["DBClusterSnapshotArn"], None)
+            return {"DBClusterSnapshot": dict(self._public(record), Status="deleted")}
+
+    # -- restores, modifications and deletes ----------------------------
+
+    def _transition(self, record, status_key, status, delay, final, event=None):
+        """Set `status` now and `final` status after `delay` seconds."""
+        record[status_key] = status
+
+        def finish():
+            record[status_key] = final
+            if event is not None:
+                self.add_event(*event)
+
+        self.aws.schedule(delay, finish)
+
+    def restore_db_instance_from_db_snapshot(
+        self, DBInstanceIdentifier, DBSnapshotIdentifier, Tags=None, **kwargs
+    ):
+        self._call("restore_db_instance_from_db_snapshot")
+        with self.lock:
+            snapshot = self._source_snapshot(DBSnapshotIdentifier, False)
+            record = self.add_instance(
+                DBInstanceIdentifier,
+                engine=snapshot["Engine"],
+                engine_version=snapshot["EngineVersion"],
+                tags={t["Key"]: t["Value"] for t in Tags or []},
+            )
+            self._transition(
+                record,
+                "DBInstanceStatus",
+                "creating",
+                self.aws.restore_seconds,
+                "available",
+                (
+                    DBInstanceIdentifier,
+                    "db-instance",
+                    "Restored from snapshot {}".format(DBSnapshotIdentifier),
+                ),
+            )
+            return {"DBInstance": dict(record)}
+
+    def restore_db_cluster_from_snapshot(
+        self, DBClusterIdentifier, SnapshotIdentifier, Tags=None, **kwargs
+    ):
+        self._call("restore_db_cluster_from_snapshot")
+        with self.lock:
+            snapshot = self._source_snapshot(SnapshotIdentifier, True)
+            record = self.add_cluster(
+                DBClusterIdentifier,
+                engine=snapshot["Engine"],
+                engine_version=snapshot["EngineVersion"],
+                members=0,
+                tags={t["Key"]: t["Value"] for t in Tags or []},
+            )
+            self._transition(
+                record,
+                "Status",
+                "creating",
+                self.aws.restore_seconds,
+                "available",
+                (DBClusterIdentifier, "db-cluster", "DB cluster created"),
+            )
+            return {"DBCluster": dict(record)}
+
+    def create_db_instance(
+        self, DBInstanceIdentifier, DBClusterIdentifier=None, Tags=None, **kwargs
+    ):
+        self._call("create_db_instance")
+        with self.lock:
+            cluster = self.clusters.get(DBClusterIdentifier)
+            if DBClusterIdentifier is not None and cluster is None:
+                raise FakeExceptions.DBClusterNotFoundFault(DBClusterIdentifier)
+            record = self.add_instance(
+                DBInstanceIdentifier,
+                engine=kwargs.get(
+                    "Engine", cluster["Engine"] if cluster else "postgres"
+                ),
+                engine_version=kwargs.get("EngineVersion", "9.6.6"),
+                cluster=DBClusterIdentifier,
+                tags={t["Key"]: t["Value"] for t in Tags or []},
+            )
+            self._transition(
+                record,
+                "DBInstanceStatus",
+                "creating",
+                self.aws.create_instance_seconds,
+                "available",
+                (DBInstanceIdentifier, "db-instance", "DB instance created"),
+            )
+            return {"DBInstance": dict(record)}
+
+    def modify_db_instance(
+        self, DBInstanceIdentifier, ApplyImmediately=False, **kwargs
+    ):
+        self._call("modify_db_instance")
+        with self.lock:
+            record = self.instances.get(DBInstanceIdentifier)
+            if record is None:
+                raise FakeExceptions.DBInstanceNotFoundFault(DBInstanceIdentifier)
+            if "MasterUserPassword" in kwargs:
+                record["_password"] = kwargs["MasterUserPassword"]
+                event = (
+                    DBInstanceIdentifier,
+                    "db-instance",
+                    "Reset master credentials",
+                )
+            else:
+                event = (
+                    DBInstanceIdentifier,
+                    "db-instance",
+                    "Finished applying modification to DB instance",
+                )
+            self._transition(
+                record,
+                "DBInstanceStatus",
+                "modifying",
+                self.aws.modify_seconds,
+                "available",
+                event,
+            )
+            return {"DBInstance": self._public(record)}
+
+    def modify_db_cluster(self, DBClusterIdentifier, ApplyImmediately=False, **kwargs):
+        self._call("modify_db_cluster")
+        with self.lock:
+            record = self.clusters.get(DBClusterIdentifier)
+            if record is None:
+                raise FakeExceptions.DBClusterNotFoundFault(DBClusterIdentifier)
+            if "MasterUserPassword" in kwargs:
+                record["_password"] = kwargs["MasterUserPassword"]
+            self._transition(
+                record,
+                "Status",
+                "modifying",
+                self.aws.modify_seconds,
+                "available",
+                (DBClusterIdentifier, "db-cluster", "Reset master credentials"),
+            )
+            return {"DBCluster": self._public(record)}
+
+    def delete_db_instance(self, DBInstanceIdentifier, **kwargs):
+        self._call("delete_db_instance")
+        with self.lock:
+            record = self.instances.get(DBInstanceIdentifier)
+            if record is None:
+                raise FakeExceptions.DBInstanceNotFoundFault(DBInstanceIdentifier)
+            if record["DBInstanceStatus"] not in ("available", "stopped"):
+                raise FakeExceptions.InvalidDBInstanceStateFault(DBInstanceIdentifier)
+            record["DBInstanceStatus"] = "deleting"
+
+            def finish():
+                self.instances.pop(DBInstanceIdentifier, None)
+                self.tags.pop(record["DBInstanceArn"], None)
+                cluster = self.clusters.get(record.get("DBClusterIdentifier"))
+                if cluster is not None:
+                    cluster["DBClusterMembers"] = [
+                        m
+                        for m in cluster["DBClusterMembers"]
+                        if m["DBInstanceIdentifier"] != DBInstanceIdentifier
+                    ]
+                self.add_event(
+                    DBInstanceIdentifier, "db-instance", "DB instance deleted"
+                )
+
+            self.aws.schedule(self.aws.delete_seconds, finish)
+            return {"DBInstance": self._public(record)}
+
+    def delete_db_cluster(self, DBClusterIdentifier, **kwargs):
+        self._call("delete_db_cluster")
+        with self.lock:
+            record = self.clusters.get(DBClusterIdentifier)
+            if record is None:
+                raise FakeExceptions.DBClusterNotFoundFault(DBClusterIdentifier)
+            record["Status"] = "deleting"
+
+            def finish():
+                if record["DBClusterMembers"]:
+                    # RDS waits for the member instances to go away first.
+                    self.aws.schedule(self.aws.delete_seconds, finish)
+                    return
+                self.clusters.pop(DBClusterIdentifier, None)
+                self.tags.pop(record["DBClusterArn"], None)
+                self.add_event(DBClusterIdentifier, "db-cluster", "DB cluster deleted")
+
+            self.aws.schedule(self.aws.delete_seconds, finish)
+            return {"DBCluster": self._public(record)}
+
+    # -- subnet groups -------------------------------------------------
+
+    def describe_db_subnet_groups(self, DBSubnetGroupName=None, **kwargs):
+        self._call("describe_db_subnet_groups")
+        with self.lock:
+            groups = sorted(
+                self.subnet_groups.values(), key=lambda g: g["DBSubnetGroupName"]
+            )
+            if DBSubnetGroupName is not None:
+                groups = [
+                    g for g in groups if g["DBSubnetGroupName"] == DBSubnetGroupName
+                ]
+                if not groups:
+                    raise FakeExceptions.DBSubnetGroupNotFoundFault(DBSubnetGroupName)
+            return self._page(
+                groups, "DBSubnetGroups", kwargs.get("MaxRecords"), kwargs.get("Marker")
+            )
+
+    def create_db_subnet_group(
+        self, DBSubnetGroupName, DBSubnetGroupDescription, SubnetIds, Tags=None
+    ):
+        self._call("create_db_subnet_group")
+        with self.lock:
+            group = {
+                "DBSubnetGroupName": DBSubnetGroupName,
+                "DBSubnetGroupDescription": DBSubnetGroupDescription,
+                "Subnets": [{"SubnetIdentifier": i} for i in SubnetIds],
+            }
+            self.subnet_groups[DBSubnetGroupName] = group
+            return {"DBSubnetGroup": dict(group)}
+
+    def delete_db_subnet_group(self, DBSubnetGroupName):
+        self._call("delete_db_subnet_group")
+        with self.lock:
+            if self.subnet_groups.pop(DBSubnetGroupName, None) is None:
+                raise FakeExceptions.DBSubnetGroupNotFoundFault(DBSubnetGroupName)
+            return {}
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class FakeS3(FakeService):
+    """A fake boto3 S3 client supporting conditional writes."""
+
+    def __init__(self, aws, region=None):
+        super(FakeS3, self).__init__(aws, region)
+        self.buckets = {}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._call("put_object")
+        if not isinstance(Body, bytes):
+            Body = Body.encode("utf-8")
+        with self.lock:
+            bucket = self.buckets.setdefault(Bucket, {})
+            current = bucket.get(Key)
+            if IfNoneMatch == "*" and current is not None:
+                raise FakeExceptions.PreconditionFailed(Key, "PutObject")
+            if IfMatch is not None and (current is None or current[1] != IfMatch):
+                raise FakeExceptions.PreconditionFailed(Key, "PutObject")
+            etag = '"{}"'.format(hashlib.md5(Body).hexdigest())
+            bucket[Key] = (Body, etag)
+            return {"ETag": etag}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("get_object")
+        with self.lock:
+            current = self.buckets.get(Bucket, {}).get(Key)
+            if current is None:
+                raise FakeExceptions.NoSuchKey(Key, "GetObject")
+            return {
+                "Body": FakeBody(current[0]),
+                "ETag": current[1],
+                "ContentLength": len(current[0]),
+            }
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("delete_object")
+        with self.lock:
+            self.buckets.get(Bucket, {}).pop(Key, None)
+            return {}
+
+
+class FakeAWS(object):
+    """A fake AWS account: RDS in any region, S3, and a shared clock.
+
+    Args:
+        clock (callable): returns the current time, default a SimulatedClock.
+        latency (float): real seconds to sleep in every api call.
+        restore_seconds, modify_seconds, create_instance_seconds,
+        delete_seconds (float): how long those operations take.
+        copy_seconds_per_gb (float): how long a snapshot copy takes per GB
+            of allocated storage (at least a minute), 0 for instant copies.
+        copy_quota (int): snapshot copies which may be in progress per
+            region, more fail with SnapshotQuotaExceeded.
+        describe_tags (bool): include a TagList in describe responses.
+        account_id (str): the account in ARNs.
+    """
+
+    def __init__(
+        self,
+        clock=None,
+        latency=0,
+        restore_seconds=1200,
+        modify_seconds=120,
+        create_instance_seconds=600,
+        delete_seconds=300,
+        copy_seconds_per_gb=6,
+        copy_quota=20,
+        describe_tags=False,
+        account_id=DEFAULT_ACCOUNT_ID,
+    ):
+        self.clock = clock or SimulatedClock()
+        self.latency = latency
+        self.restore_seconds = restore_seconds
+        self.modify_seconds = modify_seconds
+        self.create_instance_seconds = create_instance_seconds
+        self.delete_seconds = delete_seconds
+        self.copy_seconds_per_gb = copy_seconds_per_gb
+        self.copy_quota = copy_quota
+        self.describe_tags = describe_tags
+        self.account_id = account_id
+        self._rds = {}
+        self._s3 = None
+        self._due = []
+        self._lock = threading.RLock()
+
+    def copy_seconds(self, snapshot):
+        if not self.copy_seconds_per_gb:
+            return 0
+        return max(60, snapshot.get("AllocatedStorage", 100) * self.copy_seconds_per_gb)
+
+    def rds(self, region="us-east-1"):
+        with self._lock:
+            if region not in self._rds:
+                self._rds[region] = FakeRDS(self, region)
+            return self._rds[region]
+
+    @property
+    def s3(self):
+        with self._lock:
+            if self._s3 is None:
+                self._s3 = FakeS3(self)
+            return self._s3
+
+    def client(self, service, region_name=None, **kwargs):
+        """A boto3.client lookalike, usable as a client factory."""
+        if service == "rds":
+            return self.rds(region_name or "us-east-1")
+        if service == "s3":
+            return self.s3
+        raise ValueError("FakeAWS has no {} service".format(service))
+
+    def install(self):
+        """Make dbsnap.clients.get_client return clients of this account."""
+        set_client_factory(self.client)
+
+    @staticmethod
+    def uninstall():
+        set_client_factory(None)
+
+    @property
+    def calls(self):
+        """Counter: api calls made to every fake service, by operation."""
+        total = Counter()
+        for service in list(self._rds.values()) + [self._s3]:
+            if service is not None:
+                total.update(service.calls)
+        return total
+
+    def schedule(self, delay, callback):
+        with self._lock:
+            self._due.append((self.clock() + delay, len(self._due), callback))
+
+    def run_due(self):
+        """Run every scheduled state change whose time has come."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                due = [d for d in self._due if d[0] <= now]
+                if not due:
+                    return
+                self._due = [d for d in self._due if d[0] > now]
+            for _, _, callback in sorted(due, key=lambda d: d[:2]):
+                with self._lock:
+                    callback()
+
+    def advance(self, seconds):
+        """Move a SimulatedClock forward and apply due state changes."""
+        self.clock.advance(seconds)
+        self.run_due()
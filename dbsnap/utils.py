@@ -1,3 +1,21 @@
+import calendar
+import random
+from datetime import datetime
+
+from .tag_cache import get_tag_cache
+
+# how many list_tags_for_resource calls may be in flight at once.
+DEFAULT_TAG_WORKERS = 8
+
+# error codes RDS (and the AWS apis in general) answer with when throttling.
+THROTTLE_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+}
+
+
 def make_tag_dict(tag_list):
     """Returns a dictionary of existing tags.
     Args:
@@ -10,11 +28,127 @@ def make_tag_dict(tag_list):
 
 def get_tags_for_rds_arn(session, rds_arn):
     """Returns a dictionary of existing tags.
+
+    Tags are remembered in the session's TagCache, see `dbsnap.tag_cache`.
+
     Args:
         rds_arn (str): an RDS resource ARN.
     Returns:
         dict: A dictionary where tag names are keys and tag values are values.
     """
-    return make_tag_dict(
+    tags = get_tag_cache(session).get(rds_arn)
+    if tags is None:
+        tags = _fetch_tags_for_rds_arn(session, rds_arn)
+    return tags
+
+
+def _fetch_tags_for_rds_arn(session, rds_arn):
+    tags = make_tag_dict(
         session.list_tags_for_resource(ResourceName=rds_arn)["TagList"]
     )
+    get_tag_cache(session).set(rds_arn, tags)
+    return tags
+
+
+def get_tags_for_rds_arns(session, rds_arns, max_workers=DEFAULT_TAG_WORKERS):
+    """Returns the tags of many RDS resources, looked up concurrently.
+    Args:
+        session (:class:`boto.rds2.layer1.RDSConnection`): The RDS api connection
+            where the resources are located.
+        rds_arns (list): RDS resource ARNs.
+        max_workers (int): The most lookups to run at the same time.
+    Returns:
+        dict: A dictionary where ARNs are keys and tag dictionaries are values.
+    """
+    cache = get_tag_cache(session)
+    tags_by_arn = {}
+    missing = []
+    for arn in set(rds_arns):
+        tags = cache.get(arn)
+        if tags is None:
+            missing.append(arn)
+        else:
+            tags_by_arn[arn] = tags
+
+    if len(missing) <= 1 or max_workers <= 1:
+        for arn in missing:
+            tags_by_arn[arn] = _fetch_tags_for_rds_arn(session, arn)
+    else:
+        # imported here to keep threads out of the import time of dbsnap.
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+            tag_dicts = pool.map(
+                lambda arn: _fetch_tags_for_rds_arn(session, arn), missing
+            )
+            tags_by_arn.update(zip(missing, tag_dicts))
+    return tags_by_arn
+
+
+def prefetch_tags(resources, max_workers=DEFAULT_TAG_WORKERS):
+    """Resolve the tags of many Snapshot or Database objects in bulk.
+
+    Tags are looked up concurrently and stored in the session's TagCache,
+    so the `tags` property of each resource reads them from there instead
+    of calling the RDS api again.
+
+    Args:
+        resources (list): dbsnap.Snapshot or dbsnap.Database objects which
+            share the same session.
+        max_workers (int): The most lookups to run at the same time.
+    Returns:
+        list: the given resources.
+    """
+    resources = list(resources)
+    if resources:
+        get_tags_for_rds_arns(
+            resources[0].session, [r.arn for r in resources], max_workers
+        )
+    return resources
+
+
+def paginate(method, result_key, **kwargs):
+    """Yields records from every page of a Marker based RDS describe call.
+    Args:
+        method (callable): an RDS describe method, like
+            `session.describe_db_snapshots`.
+        result_key (str): the response key which holds the page of records.
+        kwargs: arguments passed along to every call of `method`.
+    Returns:
+        generator: the records of each page, in order.
+    """
+    while True:
+        response = method(**kwargs)
+        for record in response[result_key]:
+            yield record
+        marker = response.get("Marker")
+        if not marker:
+            break
+        kwargs["Marker"] = marker
+
+
+def datetime_to_timestamp(dt):
+    """Returns the POSIX timestamp of a naive UTC or timezone aware datetime."""
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def timestamp_to_datetime(ts):
+    """Returns a naive UTC datetime for a POSIX timestamp."""
+    return datetime.utcfromtimestamp(ts)
+
+
+def get_error_code(error):
+    """Returns the AWS error code of a botocore ClientError or None."""
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+def is_throttle_error(error):
+    return get_error_code(error) in THROTTLE_ERROR_CODES
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Returns a "full jitter" exponential backoff delay in seconds."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
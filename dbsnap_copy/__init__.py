@@ -1,6 +1,10 @@
 from collections import namedtuple
 import string
 import re
+import threading
+import time
+
+from dbsnap.clients import get_client
 
 Source = namedtuple("Source", ["region", "id"])
 Dest = namedtuple("Dest", ["region", "name"])
@@ -8,6 +12,11 @@ Dest = namedtuple("Dest", ["region", "name"])
 RE_UNSAFE = re.compile(r"[^a-zA-Z0-9-]")
 RE_DEDUPE = re.compile(r"-+")
 
+_account_id_cache = {}
+_account_id_lock = threading.Lock()
+# account id requests, GetCallerIdentity calls made and seconds they took.
+_account_id_stats = {"requests": 0, "lookups": 0, "lookup_seconds": 0.0}
+
 
 def parse_source(source):
     """Parse a source in the format <region>:<db-identifier>
@@ -50,13 +59,76 @@ def parse_destination(source_region, d=":"):
     return Dest(region, snapshot_name)
 
 
-def get_account_id():
-    """Returns the AWS Account ID for the provided credentials."""
-    import boto3
+def parse_manifest(lines, default_dest=":"):
+    """Parse a manifest of sources and optional destinations.
+
+    Each non blank line holds a source and an optional destination
+    separated by whitespace, lines starting with `#` are comments::
+
+        us-east-1:my-db
+        us-east-1:my-other-db us-west-2:
 
-    session = boto3.client("iam", region_name="us-east-1")
-    first_arn = session.list_users()["Users"][0]["Arn"]
-    return first_arn.split(":")[4]
+    Args:
+        lines (iterable): The lines of the manifest.
+        default_dest (str): The destination of lines which do not name one.
+
+    Returns:
+        list: A list of (:class:`Source`, :class:`Dest`) tuples.
+    """
+    pairs = []
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        if len(fields) > 2:
+            raise ValueError(
+                "Manifest line `{}` not in <source> [<dest>] form.".format(line)
+            )
+        source = parse_source(fields[0])
+        dest = parse_destination(
+            source.region, fields[1] if len(fields) == 2 else default_dest
+        )
+        pairs.append((source, dest))
+    return pairs
+
+
+def get_account_id(sts=None):
+    """Returns the AWS Account ID for the provided credentials.
+
+    The lookup is a single STS GetCallerIdentity call made the first time
+    an account id is needed, the result is remembered for the process.
+
+    Args:
+        sts: An object with a `get_caller_identity` method, like a boto3
+            STS client. Defaults to the shared STS client of dbsnap.clients.
+    """
+    with _account_id_lock:
+        _account_id_stats["requests"] += 1
+        if "account_id" not in _account_id_cache:
+            if sts is None:
+                sts = get_client("sts")
+            started = time.time()
+            _account_id_cache["account_id"] = sts.get_caller_identity()["Account"]
+            _account_id_stats["lookups"] += 1
+            _account_id_stats["lookup_seconds"] += time.time() - started
+        return _account_id_cache["account_id"]
+
+
+def account_id_stats():
+    """Returns a dict of account id requests, the GetCallerIdentity lookups
+    they made and the seconds those took, to report at the end of a run."""
+    with _account_id_lock:
+        stats = dict(_account_id_stats)
+    stats["lookup_seconds"] = round(stats["lookup_seconds"], 3)
+    return stats
+
+
+def forget_account_id():
+    """Clear the remembered account id and its stats, for example between tests."""
+    with _account_id_lock:
+        _account_id_cache.clear()
+        _account_id_stats.update(requests=0, lookups=0, lookup_seconds=0.0)
 
 
 def sanitize_snapshot_name(*args):
@@ -6,26 +6,55 @@ longer than the maximum of 35 days that RDS allows.
 """
 
 import argparse
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import boto3
-
 from dbsnap import get_latest_snapshot, get_old_dbsnap_snapshots
+from dbsnap.clients import get_client
+from dbsnap.copy_job import wait_for_copies
+from dbsnap.copy_scheduler import (
+    DEFAULT_COPY_QUOTA,
+    PRIORITIES,
+    CopyRequest,
+    CopyScheduler,
+    load_copy_scheduler,
+)
+from dbsnap.prune import prune_snapshots
+from dbsnap.rate_limit import NO_BOTOCORE_RETRIES, limit_client, rate_limit_stats
+from dbsnap.snapshot_index import (
+    DEFAULT_MAX_AGE,
+    SnapshotIndex,
+    load_snapshot_index,
+)
+from dbsnap.tag_cache import get_tag_cache
 
 from dbsnap_copy import (
+    account_id_stats,
     parse_source,
     parse_destination,
-    get_account_id,
+    parse_manifest,
     get_snapshot_target_name,
 )
 
+CopyResult = namedtuple(
+    "CopyResult",
+    ["source", "dest", "target", "prune", "error", "duration", "copy", "queued"],
+)
+
+# seconds to wait for a new copy to become available before pruning.
+DEFAULT_COPY_TIMEOUT = 3600
+
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument(
         "source",
+        nargs="*",
         help="The source of the snapshot in the format: "
-        "<region>:<db-instance-identifier>",
+        "<region>:<db-instance-identifier>. May be repeated.",
     )
     parser.add_argument(
         "-d",
@@ -35,6 +64,21 @@ def parse_args():
         "[<region>]:[<new-snapshot-name>]). "
         "Defaults to the same region as source.",
     )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=argparse.FileType("r"),
+        help="A file listing one source per line, optionally followed by "
+        "a destination: <region>:<db-instance-identifier> [<dest>]. "
+        "Lines without a destination use --dest.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="How many sources to copy at the same time (default 8).",
+    )
     parser.add_argument(
         "--prune-old",
         type=int,
@@ -42,6 +86,40 @@ def parse_args():
         "old snapshots, keeping around as many copies (the most recent) "
         "as you specify with this flag.",
     )
+    parser.add_argument(
+        "--copy-timeout",
+        type=int,
+        default=DEFAULT_COPY_TIMEOUT,
+        help="Seconds to wait for queued copies to start and, with "
+        "--prune-old, for the new copies to become available. Old copies are "
+        "only pruned once the new one is (default {}).".format(DEFAULT_COPY_TIMEOUT),
+    )
+    parser.add_argument(
+        "--copy-quota",
+        type=int,
+        default=DEFAULT_COPY_QUOTA,
+        help="How many copies may be in progress per destination region, "
+        "more wait in a queue (default {}).".format(DEFAULT_COPY_QUOTA),
+    )
+    parser.add_argument(
+        "--copy-priority",
+        choices=PRIORITIES,
+        default="age",
+        help="Which queued copies start first: the databases whose last copy "
+        "is the oldest (age, the default) or the largest databases (size).",
+    )
+    parser.add_argument(
+        "--copy-queue",
+        help="A file path or s3://<bucket>/<key> where copies still queued or "
+        "in progress are remembered, and resumed by the next run.",
+    )
+    parser.add_argument(
+        "--prune-workers",
+        type=int,
+        default=4,
+        help="How many old snapshots of a source to delete at the same time "
+        "(default 4).",
+    )
     parser.add_argument(
         "-n",
         "--dry-run",
@@ -57,24 +135,68 @@ def parse_args():
         "for most use-cases. See: http://docs.aws.amazon.com/AmazonRDS"
         "/latest/APIReference/API_CopyDBSnapshot.html",
     )
+    parser.add_argument(
+        "--snapshot-index",
+        help="A file path or s3://<bucket>/<key> where the snapshots seen "
+        "are remembered between runs, to save describe and tag calls.",
+    )
+    parser.add_argument(
+        "--index-max-age",
+        type=int,
+        default=DEFAULT_MAX_AGE,
+        help="Seconds the --snapshot-index may answer for a database without "
+        "asking RDS again (default {}).".format(DEFAULT_MAX_AGE),
+    )
+    parser.add_argument(
+        "--full-resync",
+        action="store_true",
+        default=False,
+        help="Ignore what the --snapshot-index remembers and rebuild it.",
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if not args.source and not args.manifest:
+        parser.error("pass at least one source or a --manifest")
     return args
 
 
-def main():
-    args = parse_args()
+def get_copy_pairs(args):
+    """Returns a list of (Source, Dest) tuples from the CLI arguments."""
+    pairs = []
+    for s in args.source:
+        source = parse_source(s)
+        pairs.append((source, parse_destination(source.region, args.dest)))
+    if args.manifest:
+        with args.manifest as manifest:
+            pairs.extend(parse_manifest(manifest, args.dest))
+    return pairs
+
+
+def log(source, msg, *fmt_args):
+    print("[{}] {}: {}".format(datetime.utcnow(), source.id, msg.format(*fmt_args)))
+
+
+def copy_key(source, dest):
+    """The CopyScheduler key of copies of `source` to the region of `dest`."""
+    return "{}:{}>{}".format(source.region, source.id, dest.region)
 
-    source = parse_source(args.source)
-    dest = parse_destination(source.region, args.dest)
 
-    source_session = boto3.client("rds", region_name=source.region)
-    dest_session = boto3.client("rds", region_name=dest.region)
+def plan_copy(source, dest, clients, args, index=None):
+    """Find the latest automated snapshot of `source` and name its copy.
 
-    account_id = get_account_id()
+    Args:
+        source (:class:`dbsnap_copy.Source`): the database to copy.
+        dest (:class:`dbsnap_copy.Dest`): where to copy it.
+        clients (dict): RDS clients keyed by region name.
+        args (:class:`argparse.Namespace`): the parsed CLI arguments.
+        index (:class:`dbsnap.snapshot_index.SnapshotIndex`): answers
+            snapshot listings when set.
 
+    Returns:
+        :class:`dbsnap.copy_scheduler.CopyRequest`: to submit to the scheduler.
+    """
     source_snapshot = get_latest_snapshot(
-        source_session, source.id, snapshot_type="automated"
+        clients[source.region], source.id, snapshot_type="automated", index=index
     )
 
     now = datetime.utcnow()
@@ -82,8 +204,13 @@ def main():
         dest, source_snapshot.id, source.region, now
     )
 
-    msg = "[{}] Copying {} to {} in {}"
-    print(msg.format(now, source_snapshot.arn, target_snapshot_name, dest.region))
+    log(
+        source,
+        "Copying {} to {} in {}",
+        source_snapshot.arn,
+        target_snapshot_name,
+        dest.region,
+    )
 
     tags = {
         "source_snapshot_arn": source_snapshot.arn,
@@ -91,27 +218,290 @@ def main():
         "source_db_identifier": source_snapshot.id,
         "created_by": "dbsnap-copy",
     }
+    return CopyRequest(
+        copy_key(source, dest),
+        source_snapshot,
+        dest.region,
+        target_snapshot_name,
+        tags=tags,
+        kms_key=args.kms_key,
+    )
+
 
-    if not args.dry_run:
-        source_snapshot.copy(
-            target_snapshot_name,
-            dest_session=dest_session,
-            tags=tags,
-            kms_key=args.kms_key,
+def prune_source(source, dest, copy_job, clients, args, index=None):
+    """Prune old copies of `source` once its new copy is available.
+
+    Returns:
+        :class:`dbsnap.prune.PruneResult`: or None if the copy is not done.
+    Raises:
+        RuntimeError: if the copy failed.
+    """
+    if not wait_for_copy(source, copy_job, 0):
+        return None
+    dest_session = clients[dest.region]
+    old_snapshots = get_old_dbsnap_snapshots(
+        dest_session, source.id, args.prune_old, index
+    )
+    log(
+        source,
+        "Pruning {} old snapshots while keeping the most recent {}.",
+        len(old_snapshots),
+        args.prune_old,
+    )
+    for snapshot in old_snapshots:
+        log(source, "Deleting old snapshot: {}.", snapshot.id)
+    prune = prune_snapshots(
+        old_snapshots, max_workers=args.prune_workers, dry_run=args.dry_run
+    )
+    if index is not None:
+        index.forget(dest_session, prune.deleted)
+    for snapshot, error in prune.failed:
+        log(source, "Failed to delete old snapshot {}: {!r}", snapshot.id, error)
+    log(source, "Prune stats: {}", prune.stats)
+    return prune
+
+
+def wait_for_copy(source, copy_job, timeout):
+    """Wait for the new copy before pruning old ones.
+
+    Returns:
+        bool: True if old copies may be pruned.
+    Raises:
+        RuntimeError: if the copy failed.
+    """
+    if copy_job is None:
+        # a dry run, nothing was copied.
+        return True
+    log(source, "Waiting for {} to become available.", copy_job.id)
+    copy_job.wait(timeout=timeout)
+    log(source, "Copy stats: {}", copy_job.stats)
+    if copy_job.failed:
+        raise RuntimeError(
+            "Copy {} is {}, not pruning.".format(copy_job.id, copy_job.status)
+        )
+    if not copy_job.done:
+        log(
+            source,
+            "Not pruning, {} is still {} after {}s.",
+            copy_job.id,
+            copy_job.status,
+            timeout,
         )
+    return copy_job.done
 
-    if args.prune_old:
-        old_snapshots = get_old_dbsnap_snapshots(
-            dest_session, source.id, args.prune_old
+
+def copy_sources(pairs, clients, args, index=None, scheduler=None):
+    """Copy the latest snapshot of every (Source, Dest) pair and prune old copies.
+
+    Sources are looked up on a thread pool, then the scheduler starts the
+    copies within the copy quota of each destination region. With
+    --prune-old the new copies are awaited together, then each source is
+    pruned on the thread pool.
+
+    Returns:
+        list: :class:`CopyResult` tuples in the same order as `pairs`,
+        errors are captured not raised.
+    """
+    started = time.time()
+    scheduler = scheduler or CopyScheduler(
+        quota=args.copy_quota, priority=args.copy_priority
+    )
+    workers = max(1, min(args.workers, len(pairs)))
+    requests = [None] * len(pairs)
+    errors = [None] * len(pairs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(plan_copy, source, dest, clients, args, index)
+            for source, dest in pairs
+        ]
+        for i, future in enumerate(futures):
+            try:
+                requests[i] = future.result()
+            except Exception as e:
+                log(pairs[i][0], "Failed: {!r}", e)
+                errors[i] = e
+
+        if not args.dry_run:
+            for (source, dest), request in zip(pairs, requests):
+                if request is not None and not scheduler.submit(request):
+                    log(
+                        source,
+                        "Not copying, {} is being copied already.",
+                        request.source.id,
+                    )
+            scheduler.run(clients, timeout=args.copy_timeout)
+            for queued in scheduler.queued():
+                print(
+                    "[{}] {}: Still queued, the copy quota is full.".format(
+                        datetime.utcnow(), queued.key
+                    )
+                )
+
+        jobs = [None] * len(pairs)
+        for i, request in enumerate(requests):
+            if request is None or args.dry_run:
+                continue
+            jobs[i] = scheduler.jobs.get(request.key)
+            if request.key in scheduler.errors:
+                errors[i] = scheduler.errors[request.key]
+                log(pairs[i][0], "Failed: {!r}", errors[i])
+
+        prunes = [None] * len(pairs)
+        if args.prune_old:
+            remaining = max(0, args.copy_timeout - (time.time() - started))
+            wait_for_copies([j for j in jobs if j is not None], timeout=remaining)
+            futures = {}
+            for i, (source, dest) in enumerate(pairs):
+                if requests[i] is None or errors[i] is not None:
+                    continue
+                if jobs[i] is None and not args.dry_run:
+                    # still queued or copied by an earlier run.
+                    continue
+                futures[i] = pool.submit(
+                    prune_source, source, dest, jobs[i], clients, args, index
+                )
+            for i, future in futures.items():
+                try:
+                    prunes[i] = future.result()
+                except Exception as e:
+                    log(pairs[i][0], "Failed: {!r}", e)
+                    errors[i] = e
+
+    duration = time.time() - started
+    return [
+        CopyResult(
+            source,
+            dest,
+            requests[i] and requests[i].target_name,
+            prunes[i],
+            errors[i],
+            duration,
+            jobs[i],
+            bool(requests[i]) and requests[i].key in scheduler.queue,
+        )
+        for i, (source, dest) in enumerate(pairs)
+    ]
+
+
+def print_summary(results, duration):
+    failed = [r for r in results if r.error is not None]
+    print(
+        "[{}] Summary: {} sources, {} copied, {} failed in {:.1f}s.".format(
+            datetime.utcnow(),
+            len(results),
+            len(results) - len(failed),
+            len(failed),
+            duration,
+        )
+    )
+    for r in results:
+        status = "FAILED ({!r})".format(r.error) if r.error else "OK"
+        copied = "-"
+        if r.queued:
+            copied = "queued"
+        elif r.copy is not None:
+            copied = r.copy.status
+            if r.copy.throughput is not None:
+                copied += " {:.1f}GB/min".format(r.copy.throughput)
+        if r.prune is None:
+            pruned = "-"
+        else:
+            pruned = "{deleted}/{failed}/{skipped}".format(**r.prune.stats)
+        print(
+            "  {}:{} -> {}:{} copy={} "
+            "pruned(deleted/failed/skipped)={} {:.1f}s {}".format(
+                r.source.region,
+                r.source.id,
+                r.dest.region,
+                r.target,
+                copied,
+                pruned,
+                r.duration,
+                status,
+            )
         )
-        msg = "[{}] Pruning {} old snapshots while keeping the most recent {}."
-        print(msg.format(datetime.utcnow(), len(old_snapshots), args.prune_old))
-        for snapshot in old_snapshots:
+
+
+def main(argv=None):
+    started = time.time()
+    args = parse_args(argv)
+
+    pairs = get_copy_pairs(args)
+
+    if args.copy_queue:
+        scheduler = load_copy_scheduler(
+            args.copy_queue, quota=args.copy_quota, priority=args.copy_priority
+        )
+    else:
+        scheduler = CopyScheduler(quota=args.copy_quota, priority=args.copy_priority)
+
+    # one client per region, shared by every copy running in this process.
+    regions = scheduler.regions()
+    for source, dest in pairs:
+        regions.update((source.region, dest.region))
+    # each copy can have a tag lookup or prune pool of its own in flight.
+    pool_size = max(10, args.workers * max(args.prune_workers, 8))
+    # throttled calls are retried by the rate limited client, within one
+    # retry budget for the whole run.
+    clients = {
+        region: limit_client(
+            get_client(
+                "rds", region, max_pool_connections=pool_size, **NO_BOTOCORE_RETRIES
+            ),
+            region,
+        )
+        for region in regions
+    }
+
+    # nothing dbsnap-copy does needs the account id, so it is not looked
+    # up at startup any more, see the account id stats at the end.
+    msg = "[{}] Started {} sources in {:.3f}s."
+    print(msg.format(datetime.utcnow(), len(pairs), time.time() - started))
+
+    index = None
+    if args.snapshot_index:
+        if args.full_resync:
+            index = SnapshotIndex(
+                location=args.snapshot_index, max_age=args.index_max_age
+            )
+        else:
+            index = load_snapshot_index(args.snapshot_index, args.index_max_age)
+
+    results = copy_sources(pairs, clients, args, index, scheduler)
+
+    if args.copy_queue and not args.dry_run:
+        # wait_for_copies updates the jobs, not the scheduler, record the
+        # copies which finished meanwhile before saving.
+        scheduler.poll()
+        scheduler.save()
+    msg = "[{}] Copy scheduler stats: {}"
+    print(msg.format(datetime.utcnow(), scheduler.stats))
+
+    if index is not None:
+        if not args.dry_run:
+            index.save()
+        msg = "[{}] Snapshot index stats: {}"
+        print(msg.format(datetime.utcnow(), index.stats))
+
+    if args.prune_old:
+        for region in sorted(regions):
+            msg = "[{}] Tag cache stats for {}: {}"
             print(
-                "[{}] Deleting old snapshot: {}.".format(datetime.utcnow(), snapshot.id)
+                msg.format(
+                    datetime.utcnow(), region, get_tag_cache(clients[region]).stats
+                )
             )
-            if not args.dry_run:
-                snapshot.delete()
+
+    msg = "[{}] Rate limit stats: {}"
+    print(msg.format(datetime.utcnow(), rate_limit_stats()))
+
+    msg = "[{}] Account id stats: {}"
+    print(msg.format(datetime.utcnow(), account_id_stats()))
+
+    print_summary(results, time.time() - started)
+
+    if any(r.error is not None for r in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -8,21 +8,44 @@ from dbsnap.rds_funcs import (
 )
 
 from dbsnap.database import Database
+from dbsnap.identifier_index import INSTANCE, CLUSTER
 
-from .state_doc import get_or_create_state_doc
+from .state_doc import StateDocConflict, get_or_create_state_doc, now_timestamp
+
+from .events import get_event_action
+
+from .checks import (
+    DEFAULT_MAX_WORKERS as DEFAULT_CHECK_WORKERS,
+    DEFAULT_QUERY_TIMEOUT,
+    CheckError,
+    VerifyConnectionError,
+    verify_database,
+)
+from .table_checksum import checkpoint_checksums
 
 from .datadog_output import (
     datadog_lambda_check_output,
     datadog_lambda_metric_output,
 )
 
+from dbsnap.clients import get_client
+from dbsnap.rate_limit import NO_BOTOCORE_RETRIES, limit_client, rate_limit_stats
+
+# seconds RDS event timestamps may trail our own clock.
+EVENT_CLOCK_SKEW = 60
 
-import boto3
+# connection failures to the temporary database before we alarm.
+MAX_VERIFY_ATTEMPTS = 3
 
-# retry 3 times on errors.
-from botocore.config import Config
+# seconds of a wakeup spent running checks, the rest of a large
+# table_checksum is hashed by the next wakeups.
+DEFAULT_VERIFY_SECONDS = 600
 
-BOTO3_CONFIG = Config(retries={"max_attempts": 3})
+# seconds before the Lambda timeout kept to save the verify checkpoint.
+DEADLINE_MARGIN = 15
+
+# the rate limited client retries throttled calls within the retry budget.
+BOTO3_CONFIG_OPTIONS = NO_BOTOCORE_RETRIES
 
 import logging
 
@@ -46,8 +69,41 @@ def datadog_dbsnap_verify_set_count(state_doc, metric_name):
     )
 
 
-def wait(state_doc, rds_session):
-    """wait: currently waiting for the next snapshot to appear."""
+def datadog_dbsnap_verify_gauge(state_doc, metric_name, metric_value):
+    return datadog_lambda_metric_output(
+        metric_name=metric_name,
+        metric_value=metric_value,
+        metric_type="gauge",
+        metric_tags={"database": state_doc.database},
+    )
+
+
+def cycle_seconds(state_doc):
+    """Seconds since the current verify cycle entered `restore`, or None."""
+    for state in reversed(state_doc.states):
+        if state["state"] == "restore":
+            return now_timestamp() - state["timestamp"]
+        if state["state"] == "wait":
+            return None
+
+
+def get_tmp_database(state_doc, rds_session):
+    """Describe the temporary database, remembering if it is a cluster."""
+    tmp_database = Database(
+        session=rds_session,
+        identifier=state_doc.tmp_database,
+        kind=state_doc.tmp_database_kind,
+    )
+    if tmp_database:
+        state_doc.tmp_database_kind = tmp_database.kind
+    return tmp_database
+
+
+def wait(state_doc, rds_session, restore_slots=None):
+    """wait: currently waiting for the next snapshot to appear.
+
+    `restore_slots` (dbsnap_verify.fleet.RestoreSlots) caps how many
+    temporary databases a fleet may have restored at the same time."""
     logger.info(
         "Looking for a snapshot of %s (newer than %s)",
         state_doc.database,
@@ -57,6 +113,12 @@ def wait(state_doc, rds_session):
     if snapshot.id != state_doc.snapshot_verified:
         # if the latest snapshot is not equal to the most recently
         # verified snapshot, restore and verify it.
+        if restore_slots is not None and not restore_slots.acquire():
+            logger.info(
+                "Postponing restore of %s, too many temporary restores.",
+                state_doc.database,
+            )
+            return
         state_doc.snapshot_verifying = snapshot.id
         state_doc.transition_state("restore")
         restore(state_doc, rds_session)
@@ -72,14 +134,16 @@ def wait(state_doc, rds_session):
 def restore(state_doc, rds_session):
     """restore: currently restoring a copy of the latest
     snapshot into a temporary RDS db instance."""
-    tmp_database = Database(session=rds_session, identifier=state_doc.tmp_database)
+    tmp_database = get_tmp_database(state_doc, rds_session)
     if not tmp_database:
         logger.info(
             "Restoring snapshot of %s to %s", state_doc.database, state_doc.tmp_database
         )
-        restore_from_latest_snapshot(
+        snapshot = restore_from_latest_snapshot(
             rds_session, state_doc.database, state_doc.subnet_ids
         )
+        state_doc.tmp_database_kind = CLUSTER if snapshot.is_cluster else INSTANCE
+        state_doc.save()
     elif tmp_database.status == "available":
         if tmp_database.is_cluster:
             if not tmp_database.cluster_member_ids:
@@ -112,38 +176,158 @@ def restore(state_doc, rds_session):
         )
 
 
-def modify(state_doc, rds_session):
+def is_credentials_reset_event(event):
+    return event["Message"].startswith("Reset master credentials")
+
+
+def modify(state_doc, rds_session, deadline=None):
     """modify: currently modifying the temporary RDS db instance
     settings to allow the dbsnap-verify tool to access it."""
-    tmp_database = Database(session=rds_session, identifier=state_doc.tmp_database)
+    tmp_database = get_tmp_database(state_doc, rds_session)
     if state_doc.tmp_password is None:
         logger.info(
             "Modifying %s master password and security groups", state_doc.tmp_database
         )
+        # only credential resets from now on count, not one from a previous
+        # verify of a temporary database with the same name.
+        state_doc.events_seen_until = now_timestamp() - EVENT_CLOCK_SKEW
         state_doc.tmp_password = modify_instance_or_cluster_for_verify(
             tmp_database, state_doc.security_group_ids
         )
         state_doc.save()
-    elif (
-        tmp_database
-        and tmp_database.status == "available"
-        and "Reset master credentials" in tmp_database.event_messages
-    ):
-        state_doc.transition_state("verify")
-        verify(state_doc, rds_session)
+    elif tmp_database and tmp_database.status == "available":
+        event = tmp_database.wait_for_event(
+            is_credentials_reset_event, since=state_doc.events_seen_until
+        )
+        if tmp_database.events_seen_until is not None:
+            state_doc.events_seen_until = tmp_database.events_seen_until
+        if event is not None:
+            state_doc.transition_state("verify")
+            verify(state_doc, rds_session, deadline)
+        else:
+            logger.info(
+                "Waiting for master credentials reset for %s", state_doc.tmp_database
+            )
     else:
         logger.info(
             "Waiting for master credentials reset for %s", state_doc.tmp_database
         )
 
 
-def verify(state_doc, rds_session):
+def verify_deadline(state_doc, deadline=None):
+    """Returns the POSIX time the checks of this wakeup must end by."""
+    verify_seconds = getattr(state_doc, "verify_max_seconds", DEFAULT_VERIFY_SECONDS)
+    verify_by = now_timestamp() + verify_seconds
+    if deadline is not None:
+        verify_by = min(verify_by, deadline)
+    return verify_by
+
+
+def log_check_timings(state_doc, checkpoint):
+    """Report the seconds each check took over every wakeup of this verify."""
+    for name, check in sorted(checkpoint.get("checks", {}).items()):
+        logger.info(
+            datadog_lambda_metric_output(
+                metric_name="dbsnap_verify.check_seconds",
+                metric_value=check.get("elapsed", 0),
+                metric_type="gauge",
+                metric_tags={"database": state_doc.database, "check": name},
+            )
+        )
+
+
+def verify(state_doc, rds_session, deadline=None):
     """verify: currently verifying the temporary RDS db instance
-    using the supplied checks. (not implemented)"""
-    # TODO: this is currently not implemented so we move to cleanup.
-    # in the future this code block will actually connect to the endpoint
-    # and run SQL query checks defined by the configuration.
-    logger.info("Skipping verify of %s, not implemented", state_doc.tmp_database)
+    using the supplied checks (see dbsnap_verify.checks).
+
+    Progress is kept in the "verify" checkpoint of the state_doc, checks
+    still running at `deadline` (POSIX time, the Lambda timeout less a
+    margin to save) are pending and continue on the next wakeup."""
+    checks = getattr(state_doc, "checks", None)
+    if not checks:
+        logger.info(
+            "No checks configured, skipping verify of %s", state_doc.tmp_database
+        )
+        verify_passed(state_doc, rds_session)
+        return
+    tmp_database = get_tmp_database(state_doc, rds_session)
+    checkpoint = state_doc.checkpoint("verify")
+    checkpoint["wakeups"] = checkpoint.get("wakeups", 0) + 1
+    logger.info(
+        "Running %d checks on %s (wakeup %d)",
+        len(checks),
+        state_doc.tmp_database,
+        checkpoint["wakeups"],
+    )
+    started = now_timestamp()
+    try:
+        results = verify_database(
+            tmp_database,
+            state_doc.tmp_password,
+            checks,
+            engine=getattr(state_doc, "verify_engine", None),
+            database_name=getattr(state_doc, "verify_database_name", None),
+            max_workers=getattr(state_doc, "verify_max_workers", DEFAULT_CHECK_WORKERS),
+            query_timeout=getattr(
+                state_doc, "verify_query_timeout", DEFAULT_QUERY_TIMEOUT
+            ),
+            checkpoints=checkpoint.setdefault("checks", {}),
+            previous=state_doc.verified_checksums,
+            deadline=verify_deadline(state_doc, deadline),
+        )
+    except VerifyConnectionError as e:
+        # security group and password changes take a moment to apply.
+        state_doc.verify_attempts = getattr(state_doc, "verify_attempts", 0) + 1
+        logger.info(
+            "Could not connect to %s (attempt %d): %s",
+            state_doc.tmp_database,
+            state_doc.verify_attempts,
+            e,
+        )
+        if state_doc.verify_attempts >= MAX_VERIFY_ATTEMPTS:
+            state_doc.transition_state("alarm")
+            alarm(state_doc, rds_session)
+        else:
+            state_doc.save()
+        return
+    except CheckError as e:
+        # a bad check config (or engine) fails every wakeup the same way.
+        logger.error("Can not verify %s: %s", state_doc.tmp_database, e)
+        state_doc.transition_state("alarm")
+        alarm(state_doc, rds_session)
+        return
+    checkpoint["elapsed"] = round(
+        checkpoint.get("elapsed", 0) + now_timestamp() - started, 3
+    )
+    state_doc.check_results = [r._asdict() for r in results]
+    for result in results:
+        logger.info(
+            "Check %s %s: %s (%ss, %ss over %d wakeups)",
+            result.name,
+            {True: "passed", False: "FAILED", None: "pending"}[result.ok],
+            result.message,
+            result.duration,
+            checkpoint["checks"][result.name]["elapsed"],
+            checkpoint["checks"][result.name]["runs"],
+        )
+    if any(r.ok is False for r in results):
+        # keep the temporary database around to look into the failure.
+        log_check_timings(state_doc, checkpoint)
+        state_doc.transition_state("alarm")
+        alarm(state_doc, rds_session)
+    elif any(r.ok is None for r in results):
+        # save the checkpoint, the next wakeup runs only what is pending.
+        logger.info("Verify of %s continues next wakeup", state_doc.tmp_database)
+        state_doc.save()
+    else:
+        log_check_timings(state_doc, checkpoint)
+        state_doc.verified_checksums = checkpoint_checksums(checkpoint["checks"])
+        # the chunk checksums now live in verified_checksums only.
+        state_doc.clear_checkpoint("verify")
+        verify_passed(state_doc, rds_session)
+
+
+def verify_passed(state_doc, rds_session):
     logger.info(datadog_dbsnap_verify_status_check(state_doc, "OK"))
     logger.info(datadog_dbsnap_verify_set_count(state_doc, "dbsnap_verify.ok"))
     state_doc.transition_state("cleanup")
@@ -153,15 +337,9 @@ def verify(state_doc, rds_session):
 def cleanup(state_doc, rds_session):
     """clean: currently tearing down the temporary RDS db instance
     and anything else we created or modified."""
-    tmp_database = Database(session=rds_session, identifier=state_doc.tmp_database)
+    tmp_database = get_tmp_database(state_doc, rds_session)
     if not tmp_database:
-        # cleanup of db subnet group, tmp_password, and transition to wait.
-        logger.info("cleaning %s subnet group and tmp_password", state_doc.tmp_database)
-        destroy_database_subnet_group(rds_session, state_doc.tmp_database)
-        # remove tmp_password, clear old states.
-        state_doc.clean()
-        # wait for next snapshot (which could appear tomorrow).
-        state_doc.transition_state("wait")
+        finish_cleanup(state_doc, rds_session)
     elif tmp_database.status == "available":
         logger.info("cleaning / destroying %s", state_doc.tmp_database)
         delete_verified_database(tmp_database)
@@ -169,6 +347,53 @@ def cleanup(state_doc, rds_session):
         logger.info("still cleaning / destroying %s", state_doc.tmp_database)
 
 
+def finish_cleanup(state_doc, rds_session):
+    """The temporary database is gone, tidy up and wait for the next snapshot."""
+    # cleanup of db subnet group, tmp_password, and transition to wait.
+    logger.info("cleaning %s subnet group and tmp_password", state_doc.tmp_database)
+    destroy_database_subnet_group(rds_session, state_doc.tmp_database)
+    seconds = cycle_seconds(state_doc)
+    if seconds is not None:
+        # how long this database took from restore to cleaned up.
+        state_doc.last_cycle_seconds = seconds
+        logger.info(
+            datadog_dbsnap_verify_gauge(
+                state_doc, "dbsnap_verify.cycle_seconds", seconds
+            )
+        )
+    # remove tmp_password, clear old states.
+    state_doc.clean()
+    # wait for next snapshot (which could appear tomorrow).
+    state_doc.transition_state("wait")
+
+
+def handle_rds_event(state_doc, rds_session, deadline=None):
+    """Advance straight from an unambiguous RDS event notification.
+
+    Returns:
+        bool: True if the event was handled, False if the regular state
+            handler should describe the temporary database and decide.
+    """
+    action = get_event_action(state_doc)
+    if action is None:
+        return False
+    logger.info(
+        "RDS event `%s` in state %s: %s",
+        state_doc.rds_event["message"],
+        state_doc.current_state,
+        action,
+    )
+    if action == "modify":
+        state_doc.transition_state("modify")
+        modify(state_doc, rds_session, deadline)
+    elif action == "verify":
+        state_doc.transition_state("verify")
+        verify(state_doc, rds_session, deadline)
+    elif action == "cleaned":
+        finish_cleanup(state_doc, rds_session)
+    return True
+
+
 def alarm(state_doc, rds_session):
     """"alarm: something went wrong we are going to scream about it."""
     logger.error(datadog_dbsnap_verify_status_check(state_doc, "CRITICAL"))
@@ -185,18 +410,63 @@ state_handlers = {
 }
 
 
-def handler(event):
-    """The main entrypoint called from CLI or when our AWS Lambda wakes up."""
+def deadline_from_context(context):
+    """Returns the POSIX time to save checkpoints by, None outside of Lambda."""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return (
+        now_timestamp()
+        + context.get_remaining_time_in_millis() / 1000.0
+        - DEADLINE_MARGIN
+    )
+
+
+def handler(event, context=None):
+    """The main entrypoint called from CLI or when our AWS Lambda wakes up.
+
+    `context` is the Lambda context, its remaining time bounds the checks
+    of a verify."""
     logger.debug("%s", event)
+    from .fleet import is_fleet_event, fleet_handler
+
+    deadline = deadline_from_context(context)
+    if is_fleet_event(event):
+        return fleet_handler(event, deadline)
     state_doc = get_or_create_state_doc(event)
     if state_doc is None:
         # A state_doc is None if we receive an invalid or unrelated event
         # from from Cloudwatch or SNS, like an unrelated RDS db instance.
         logger.info("Ignoring unrelated RDS event.")
     else:
-        logger.info(datadog_dbsnap_verify_set_count(state_doc, "dbsnap_verify.wakeup"))
-        state_handler = state_handlers[state_doc.current_state]
-        rds_session = boto3.client(
-            "rds", region_name=state_doc.snapshot_region, config=BOTO3_CONFIG
-        )
-        state_handler(state_doc, rds_session)
+        try:
+            advance(state_doc, deadline=deadline)
+        except StateDocConflict as e:
+            # another wakeup advanced this database meanwhile, it wins.
+            logger.warning(
+                "Skipping %s, its state doc changed: %s", state_doc.database, e
+            )
+
+
+def advance(state_doc, restore_slots=None, deadline=None):
+    """Run the handler of the current state of a loaded state_doc.
+
+    `deadline` (POSIX time) is when the wakeup must have saved its work."""
+    logger.info(datadog_dbsnap_verify_set_count(state_doc, "dbsnap_verify.wakeup"))
+    state_handler = state_handlers[state_doc.current_state]
+    rds_session = limit_client(
+        get_client("rds", state_doc.snapshot_region, **BOTO3_CONFIG_OPTIONS),
+        state_doc.snapshot_region,
+    )
+    try:
+        if state_doc.event_driven and handle_rds_event(
+            state_doc, rds_session, deadline
+        ):
+            return
+        if state_handler is wait:
+            wait(state_doc, rds_session, restore_slots)
+        elif state_handler in (modify, verify):
+            state_handler(state_doc, rds_session, deadline)
+        else:
+            state_handler(state_doc, rds_session)
+    finally:
+        logger.debug("Rate limit stats: %s", rate_limit_stats())
@@ -0,0 +1,652 @@
+"""SQL checks of the restored temporary database.
+
+The `checks` of a config are a list of dicts, each with a `type`:
+
+query:
+ run `query`, passes if a returned row matches the `regex` (or, without a
+ regex, if any row is returned).
+
+row_count:
+ `table` holds at least `min_rows` rows (default 1).
+
+freshness:
+ the newest `column` (default updated_at) of `table` is at most `max_age`
+ seconds old (default two days), proving the snapshot holds recent data.
+
+checksum:
+ md5 of the first `sample` rows (default 1000) of `table` ordered by `key`
+ (default id), passes if it equals `expected` or when no `expected` is set.
+
+table_checksum:
+ md5 of every `chunk_size` range of the integer `key` of `table`, hashed
+ across as many wakeups as it takes, see dbsnap_verify.table_checksum.
+
+Every check may also set a `name` and a `timeout` in seconds. Checks are
+independent, so they run concurrently over a small pool of connections::
+
+    "checks": [
+      {"type": "row_count", "table": "users", "min_rows": 1000},
+      {"type": "freshness", "table": "events", "max_age": 86400},
+      {"type": "checksum", "table": "plans", "key": "id", "sample": 500}
+    ]
+
+The database driver depends on the engine: psycopg2 for postgres, pymysql
+for mysql, neither is a dependency of dbsnap so install the one you need.
+The sqlite engine (`verify_engine: sqlite`, `verify_database_name` a path)
+stands in for a restored database in tests.
+"""
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from itertools import islice
+from datetime import date, datetime
+
+from dbsnap.utils import datetime_to_timestamp
+
+from .table_checksum import CHUNKS_PER_WORKER, TableChecksum, hash_rows
+
+logger = logging.getLogger("dbsnap")
+
+DEFAULT_QUERY_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_AGE = 2 * 24 * 3600
+DEFAULT_SAMPLE = 1000
+
+CheckResult = namedtuple(
+    "CheckResult", ["name", "type", "ok", "value", "message", "duration"]
+)
+
+# the checkpoint status of a CheckResult by its `ok`.
+CHECK_STATUSES = {True: "passed", False: "failed", None: "pending"}
+
+
+class CheckError(Exception):
+    """A check config is invalid."""
+
+
+class VerifyConnectionError(Exception):
+    """The temporary database could not be connected to, worth a retry."""
+
+
+class Dialect(object):
+    """How to connect to and talk to one kind of database."""
+
+    name = None
+    default_database = None
+
+    def connect(self, host, port, user, password, database, connect_timeout):
+        raise NotImplementedError
+
+    def set_timeout(self, connection, seconds):
+        """Limit the run time of the next statements of `connection`."""
+        raise NotImplementedError
+
+    def chunk_checksum_sql(self, table, key, start, end):
+        """SQL returning (row count, md5) of a key range, None to hash the
+        rows ourselves."""
+        return None
+
+    def quote(self, identifier):
+        """Quote a table or column name, keeping schema.table apart."""
+        return ".".join(
+            self.quote_char
+            + part.replace(self.quote_char, self.quote_char * 2)
+            + self.quote_char
+            for part in identifier.split(".")
+        )
+
+
+class PostgresDialect(Dialect):
+    name = "postgres"
+    default_database = "postgres"
+    quote_char = '"'
+
+    def connect(self, host, port, user, password, database, connect_timeout):
+        try:
+            import psycopg2
+        except ImportError:
+            raise ImportError("verifying postgres databases needs psycopg2 installed")
+        connection = psycopg2.connect(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            dbname=database,
+            connect_timeout=connect_timeout,
+        )
+        connection.autocommit = True
+        return connection
+
+    def chunk_checksum_sql(self, table, key, start, end):
+        return (
+            "SELECT COUNT(*), md5(string_agg(md5(t::text), '' ORDER BY t.{0})) "
+            "FROM {1} AS t WHERE t.{0} >= {2:d} AND t.{0} < {3:d}".format(
+                self.quote(key), self.quote(table), start, end
+            )
+        )
+
+    def set_timeout(self, connection, seconds):
+        cursor = connection.cursor()
+        cursor.execute("SET statement_timeout = {:d}".format(int(seconds * 1000)))
+        cursor.close()
+
+
+class MySQLDialect(Dialect):
+    name = "mysql"
+    quote_char = "`"
+
+    def connect(self, host, port, user, password, database, connect_timeout):
+        try:
+            import pymysql
+        except ImportError:
+            raise ImportError("verifying mysql databases needs pymysql installed")
+        return pymysql.connect(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=database,
+            connect_timeout=connect_timeout,
+            autocommit=True,
+        )
+
+    def set_timeout(self, connection, seconds):
+        cursor = connection.cursor()
+        # only SELECT statements, which is all a check runs.
+        cursor.execute(
+            "SET SESSION max_execution_time = {:d}".format(int(seconds * 1000))
+        )
+        cursor.close()
+
+
+class SQLiteDialect(Dialect):
+    name = "sqlite"
+    quote_char = '"'
+
+    def connect(self, host, port, user, password, database, connect_timeout):
+        import sqlite3
+
+        # the pool hands a connection to one thread at a time.
+        return sqlite3.connect(
+            database, timeout=connect_timeout, check_same_thread=False
+        )
+
+    def set_timeout(self, connection, seconds):
+        deadline = time.time() + seconds
+        # a non zero return interrupts the running statement.
+        connection.set_progress_handler(lambda: int(time.time() > deadline), 1000)
+
+
+DIALECTS = {
+    "postgres": PostgresDialect,
+    "aurora-postgresql": PostgresDialect,
+    "mysql": MySQLDialect,
+    "mariadb": MySQLDialect,
+    "aurora": MySQLDialect,
+    "aurora-mysql": MySQLDialect,
+    "sqlite": SQLiteDialect,
+}
+
+
+def get_dialect(engine):
+    try:
+        return DIALECTS[engine]()
+    except KeyError:
+        raise CheckError("Can not verify databases of engine {}.".format(engine))
+
+
+class ConnectionPool(object):
+    """Up to `size` connections made by `connect`, reused between checks."""
+
+    def __init__(self, connect, size=DEFAULT_MAX_WORKERS):
+        self.connect = connect
+        self.size = size
+        self.created = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        try:
+            return self.connect()
+        except Exception as e:
+            raise VerifyConnectionError("Could not connect: {!r}".format(e))
+
+    def put(self, connection, broken=False):
+        """Give `connection` back, a broken one is closed instead."""
+        if broken:
+            close_quietly(connection)
+        else:
+            with self._lock:
+                self._idle.append(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            close_quietly(connection)
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def fetch(connection, sql):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def value_to_timestamp(value):
+    """Returns the POSIX timestamp of a datetime, date, number or ISO string."""
+    if isinstance(value, datetime):
+        return datetime_to_timestamp(value)
+    if isinstance(value, date):
+        return datetime_to_timestamp(datetime(value.year, value.month, value.day))
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace("T", " ").rstrip("Z")
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime_to_timestamp(datetime.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise CheckError("Can not read {!r} as a time.".format(value))
+
+
+def require(config, key):
+    if not config.get(key):
+        raise CheckError("A {} check needs a `{}`.".format(config.get("type"), key))
+    return config[key]
+
+
+def check_query(connection, dialect, config):
+    rows = fetch(connection, require(config, "query"))
+    regex = config.get("regex")
+    if regex is None:
+        return bool(rows), len(rows), "{} rows".format(len(rows))
+    pattern = re.compile(regex)
+    matches = [row for row in rows if pattern.search(" ".join(str(v) for v in row))]
+    return (
+        bool(matches),
+        len(matches),
+        "{} of {} rows match {}".format(len(matches), len(rows), regex),
+    )
+
+
+def check_row_count(connection, dialect, config):
+    table = require(config, "table")
+    min_rows = config.get("min_rows", 1)
+    count = fetch(connection, "SELECT COUNT(*) FROM {}".format(dialect.quote(table)))[
+        0
+    ][0]
+    return (
+        count >= min_rows,
+        count,
+        "{} rows, expected at least {}".format(count, min_rows),
+    )
+
+
+def check_freshness(connection, dialect, config, now=time.time):
+    table = require(config, "table")
+    column = config.get("column", "updated_at")
+    max_age = config.get("max_age", DEFAULT_MAX_AGE)
+    newest = fetch(
+        connection,
+        "SELECT MAX({}) FROM {}".format(dialect.quote(column), dialect.quote(table)),
+    )[0][0]
+    if newest is None:
+        return False, None, "{} is empty".format(table)
+    age = now() - value_to_timestamp(newest)
+    return (
+        age <= max_age,
+        round(age, 1),
+        "newest {} is {:.0f}s old, at most {}".format(column, age, max_age),
+    )
+
+
+def check_checksum(connection, dialect, config):
+    table = require(config, "table")
+    key = config.get("key", "id")
+    sample = config.get("sample", DEFAULT_SAMPLE)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT * FROM {} ORDER BY {} LIMIT {:d}".format(
+                dialect.quote(table), dialect.quote(key), sample
+            )
+        )
+        rows, checksum = hash_rows(cursor)
+    finally:
+        cursor.close()
+    expected = config.get("expected")
+    ok = expected is None or checksum == expected
+    return ok, checksum, "md5 of {} rows ordered by {}".format(rows, key)
+
+
+CHECK_TYPES = {
+    "query": check_query,
+    "row_count": check_row_count,
+    "freshness": check_freshness,
+    "checksum": check_checksum,
+}
+
+# hashed in chunks across wakeups, see dbsnap_verify.table_checksum.
+TABLE_CHECKSUM = "table_checksum"
+
+
+def check_name(config):
+    return config.get("name") or "{}:{}".format(
+        config.get("type"), config.get("table") or config.get("query")
+    )
+
+
+def validate_checks(checks):
+    """Raises CheckError if a check config is unknown."""
+    for config in checks:
+        if config.get("type") == TABLE_CHECKSUM:
+            require(config, "table")
+        elif config.get("type") not in CHECK_TYPES:
+            raise CheckError(
+                "Unknown check type {!r}, use one of {}.".format(
+                    config.get("type"),
+                    ", ".join(sorted(CHECK_TYPES) + [TABLE_CHECKSUM]),
+                )
+            )
+
+
+def with_connection(pool, dialect, timeout, func, *args):
+    """Returns func(connection, dialect, *args) run on a pooled connection."""
+    connection = pool.get()
+    broken = False
+    try:
+        dialect.set_timeout(connection, timeout)
+        return func(connection, dialect, *args)
+    except Exception:
+        # an error may leave the connection in a failed transaction.
+        broken = True
+        raise
+    finally:
+        pool.put(connection, broken)
+
+
+def time_left(deadline, timeout):
+    """Returns `timeout` cut to the seconds left until `deadline`."""
+    if deadline is None:
+        return timeout
+    return min(timeout, deadline - time.time())
+
+
+def out_of_time(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def run_check(
+    pool, dialect, config, default_timeout=DEFAULT_QUERY_TIMEOUT, deadline=None
+):
+    """Run one check on a pooled connection.
+
+    Returns:
+        CheckResult: a failed one if the query failed or timed out, a
+        pending one (ok None) if `deadline` passed before it finished.
+    Raises:
+        VerifyConnectionError: if no connection could be made.
+    """
+    name = check_name(config)
+    started = time.time()
+    timeout = config.get("timeout", default_timeout)
+    budget = time_left(deadline, timeout)
+    if budget <= 0:
+        return CheckResult(name, config["type"], None, None, "out of time", 0.0)
+    try:
+        ok, value, message = with_connection(
+            pool, dialect, budget, CHECK_TYPES[config["type"]], config
+        )
+    except VerifyConnectionError:
+        raise
+    except Exception as e:
+        if budget < timeout and out_of_time(deadline):
+            # cut short by the deadline, not by its own timeout.
+            ok, value, message = None, None, "out of time"
+        else:
+            ok, value, message = False, None, "{!r}".format(e)
+    return CheckResult(
+        name, config["type"], ok, value, message, round(time.time() - started, 3)
+    )
+
+
+def run_chunk(pool, dialect, timeout, table, start, end, deadline=None):
+    """Hash one chunk of a TableChecksum, unless `deadline` passed."""
+    budget = time_left(deadline, timeout)
+    if budget <= 0:
+        return
+    started = time.time()
+    try:
+        with_connection(pool, dialect, budget, table.checksum_chunk, start, end)
+    except VerifyConnectionError:
+        raise
+    except Exception as e:
+        # a chunk cut short by the deadline is hashed again next wakeup.
+        if not (budget < timeout and out_of_time(deadline)):
+            table.errors.append(e)
+    finally:
+        table.add_seconds(time.time() - started)
+
+
+def run_chunk_plan(pool, dialect, timeout, table, deadline=None):
+    """Plan the next chunks of a TableChecksum, unless `deadline` passed."""
+    budget = time_left(deadline, timeout)
+    if table.complete or budget <= 0:
+        return
+    started = time.time()
+    try:
+        with_connection(pool, dialect, budget, table.plan)
+    except VerifyConnectionError:
+        raise
+    except Exception as e:
+        if not (budget < timeout and out_of_time(deadline)):
+            table.errors.append(e)
+    finally:
+        table.add_seconds(time.time() - started)
+
+
+def record_checkpoint(checkpoint, result):
+    """Keep `result` in the checkpoint dict of its check."""
+    checkpoint["status"] = CHECK_STATUSES[result.ok]
+    checkpoint["elapsed"] = round(checkpoint.get("elapsed", 0) + result.duration, 3)
+    checkpoint["runs"] = checkpoint.get("runs", 0) + 1
+    checkpoint["value"] = result.value
+    checkpoint["message"] = result.message
+
+
+def checkpoint_result(name, config, checkpoint):
+    """Returns the CheckResult of a check which passed in an earlier wakeup."""
+    return CheckResult(
+        name,
+        config["type"],
+        True,
+        checkpoint.get("value"),
+        checkpoint.get("message"),
+        0.0,
+    )
+
+
+def run_checks(
+    checks,
+    connect,
+    dialect,
+    max_workers=DEFAULT_MAX_WORKERS,
+    default_timeout=DEFAULT_QUERY_TIMEOUT,
+    checkpoints=None,
+    previous=None,
+    deadline=None,
+):
+    """Run every check concurrently over at most `max_workers` connections.
+
+    Args:
+        checks (list): check config dicts, see the module docstring.
+        connect (callable): returns a new DB-API connection.
+        dialect (Dialect): of the database `connect` connects to.
+        checkpoints (dict): a checkpoint dict by check name, updated in
+            place, pass the one saved by the previous wakeup to continue:
+            checks which passed are not run again and table_checksum
+            checks continue from their `cursor`.
+        previous (dict): table_checksum chunk checksums of the previous
+            verified snapshot by check name.
+        deadline (float): POSIX time by which every query ends, checks
+            not finished by then are pending.
+    Returns:
+        list: CheckResult tuples in the order of `checks`, the `ok` of a
+        pending check is None and its `duration` the seconds it ran in
+        this wakeup.
+    """
+    validate_checks(checks)
+    checkpoints = {} if checkpoints is None else checkpoints
+    previous = previous or {}
+    workers = max(1, min(max_workers, len(checks)))
+    pool = ConnectionPool(connect, workers)
+    # imported here to keep threads out of the Lambda cold start.
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            tables = {}
+            done = {}
+            for i, config in enumerate(checks):
+                name = check_name(config)
+                checkpoint = checkpoints.setdefault(name, {})
+                if checkpoint.get("status") == "passed":
+                    done[i] = checkpoint_result(name, config, checkpoint)
+                elif config["type"] == TABLE_CHECKSUM:
+                    tables[i] = TableChecksum(
+                        name,
+                        config,
+                        checkpoint.setdefault("cursor", {}),
+                        previous.get(name),
+                    )
+                else:
+                    futures[i] = executor.submit(
+                        run_check, pool, dialect, config, default_timeout, deadline
+                    )
+            # hash a window of chunks of every table at a time, planning all
+            # tables first so their chunks share the pool, until the tables
+            # are hashed, a chunk failed or time ran out.
+            window = workers * CHUNKS_PER_WORKER
+            hashing = dict(tables)
+            while hashing:
+                plans = {
+                    i: executor.submit(
+                        run_chunk_plan, pool, dialect, default_timeout, table, deadline
+                    )
+                    for i, table in hashing.items()
+                }
+                chunks = []
+                for i, plan in plans.items():
+                    table = tables[i]
+                    plan.result()
+                    timeout = checks[i].get("timeout", default_timeout)
+                    for start, end in islice(table.pending_ranges(), window):
+                        chunks.append(
+                            executor.submit(
+                                run_chunk,
+                                pool,
+                                dialect,
+                                timeout,
+                                table,
+                                start,
+                                end,
+                                deadline,
+                            )
+                        )
+                for chunk in chunks:
+                    chunk.result()
+                if out_of_time(deadline):
+                    break
+                hashing = {
+                    i: table
+                    for i, table in hashing.items()
+                    if table.planned and not table.complete and not table.errors
+                }
+
+            results = []
+            for i, config in enumerate(checks):
+                if i in done:
+                    results.append(done[i])
+                    continue
+                if i in futures:
+                    result = futures[i].result()
+                else:
+                    ok, value, message = tables[i].result()
+                    result = CheckResult(
+                        tables[i].name,
+                        config["type"],
+                        ok,
+                        value,
+                        message,
+                        round(tables[i].seconds, 3),
+                    )
+                record_checkpoint(checkpoints[result.name], result)
+                results.append(result)
+            return results
+    finally:
+        pool.close()
+
+
+def endpoint_of(database):
+    """Returns (host, port) of a dbsnap.Database description."""
+    endpoint = database.description.get("Endpoint")
+    if isinstance(endpoint, dict):
+        return endpoint.get("Address"), endpoint.get("Port")
+    return endpoint, database.description.get("Port")
+
+
+def verify_database(
+    database, password, checks, engine=None, database_name=None, **options
+):
+    """Connect to the restored `database` and run `checks`.
+
+    Args:
+        database (dbsnap.Database): the temporary database.
+        password (str): its master password (the state doc's tmp_password).
+        checks (list): check config dicts.
+        engine (str): talk to the database as this engine, default its own.
+        database_name (str): the database (or sqlite path) to connect to.
+        options: `max_workers`, `query_timeout`, `connect_timeout`, and the
+            `checkpoints`, `previous` and `deadline` of run_checks.
+    Returns:
+        list: CheckResult tuples.
+    """
+    dialect = get_dialect(engine or database.engine)
+    host, port = endpoint_of(database)
+    user = database.description.get("MasterUsername")
+    database_name = database_name or dialect.default_database
+    connect_timeout = options.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+
+    def connect():
+        return dialect.connect(
+            host, port, user, password, database_name, connect_timeout
+        )
+
+    return run_checks(
+        checks,
+        connect,
+        dialect,
+        max_workers=options.get("max_workers", DEFAULT_MAX_WORKERS),
+        default_timeout=options.get("query_timeout", DEFAULT_QUERY_TIMEOUT),
+        checkpoints=options.get("checkpoints"),
+        previous=options.get("previous"),
+        deadline=options.get("deadline"),
+    )
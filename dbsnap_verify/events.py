@@ -0,0 +1,98 @@
+"""Map RDS event notifications onto dbsnap-verify state transitions.
+
+RDS publishes an event (through SNS) when the temporary database changes.
+Some of these messages tell us everything we need to advance the state
+machine, so we can skip describing the temporary database again.
+Anything else is "ambiguous" and the regular state handler decides,
+using describe calls like a cron wakeup would.
+"""
+import json
+
+from dbsnap.identifier_index import CLUSTER, INSTANCE
+
+# kinds of RDS events, keyed by the start of the RDS "Event Message".
+RESTORED = "restored"
+CREDENTIALS_RESET = "credentials_reset"
+INSTANCE_CREATED = "instance_created"
+DELETED = "deleted"
+
+EVENT_MESSAGE_PREFIXES = [
+    ("Restored from snapshot", RESTORED),
+    ("Reset master credentials", CREDENTIALS_RESET),
+    ("DB instance created", INSTANCE_CREATED),
+    ("DB instance deleted", DELETED),
+    ("DB cluster deleted", DELETED),
+]
+
+
+def classify_event_message(message):
+    """Returns the kind of an RDS event message or None if unknown."""
+    if not message:
+        return None
+    for prefix, kind in EVENT_MESSAGE_PREFIXES:
+        if message.startswith(prefix):
+            return kind
+    return None
+
+
+def parse_sns_rds_event(event):
+    """Returns a dict describing the RDS event in an SNS Lambda event.
+
+    Raises:
+        KeyError: if `event` is not an SNS RDS event notification.
+    """
+    payload = json.loads(event["Records"][0]["Sns"]["Message"])
+    return {
+        "source_id": payload["Source ID"],
+        "source_type": payload.get("Event Source"),
+        "message": payload["Event Message"],
+        "time": payload.get("Event Time"),
+    }
+
+
+def is_tmp_database_event(state_doc, rds_event):
+    """True if the event is about the temporary database itself, not a
+    member instance of a temporary cluster."""
+    return rds_event["source_id"] == state_doc.tmp_database
+
+
+def is_restore_finished_event(state_doc, rds_event, kind):
+    """True if the event says the temporary database can be modified: the
+    restored instance, or the member instance of a restored cluster, is up."""
+    source_id = rds_event["source_id"]
+    if kind == RESTORED and state_doc.tmp_database_kind == INSTANCE:
+        return source_id == state_doc.tmp_database
+    if kind == INSTANCE_CREATED and state_doc.tmp_database_kind == CLUSTER:
+        return source_id == "i-{}".format(state_doc.tmp_database)
+    return False
+
+
+def get_event_action(state_doc):
+    """Decide what the RDS event carried by `state_doc` means for it.
+
+    Returns:
+        str: one of
+            "ignore" - the event can not move the current state forward,
+            "modify" - the restore of the temporary database finished,
+            "verify" - the master credentials reset finished,
+            "cleaned" - the temporary database is gone,
+            None - ambiguous, run the regular state handler.
+    """
+    rds_event = getattr(state_doc, "rds_event", None)
+    if not rds_event:
+        return None
+    state = state_doc.current_state
+    kind = classify_event_message(rds_event["message"])
+
+    if state == "wait":
+        # nothing about the temporary database matters until a new snapshot.
+        return "ignore"
+    if state == "restore" and is_restore_finished_event(state_doc, rds_event, kind):
+        return "modify"
+    if state == "modify" and kind == CREDENTIALS_RESET:
+        if state_doc.tmp_password is not None:
+            return "verify"
+    if state == "cleanup" and kind == DELETED:
+        if is_tmp_database_event(state_doc, rds_event):
+            return "cleaned"
+    return None
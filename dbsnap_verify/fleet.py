@@ -0,0 +1,173 @@
+"""Verify the snapshots of many databases from a single wakeup.
+
+A fleet event looks like a regular config event with a `databases` list.
+Keys outside of the list are defaults shared by every database::
+
+    {
+      "state_doc_bucket": "bucket-to-hold-state-documents",
+      "snapshot_region": "us-east-1",
+      "database_subnet_ids": "subnet-1111,subnet-2222",
+      "database_security_group_ids": "sg-0123456789",
+      "max_concurrent_restores": 5,
+      "databases": [
+        "prod-api-db",
+        {"database": "prod-search-db", "snapshot_region": "us-west-2"}
+      ]
+    }
+
+With a `state_store` (see dbsnap_verify.state_store) shared by the fleet,
+every state document is loaded in one load_many and the documents saved
+during the wakeup are written together in one save_many at its end.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+from .state_doc import (
+    StateDocConflict,
+    get_or_create_state_doc,
+    state_doc_from_document,
+)
+from .state_store import get_state_store
+
+logger = logging.getLogger("dbsnap")
+
+# how many temporary databases may exist at once unless configured.
+DEFAULT_MAX_CONCURRENT_RESTORES = 5
+
+# how many state machines to advance at the same time.
+DEFAULT_MAX_WORKERS = 8
+
+# fleet settings which are not part of a database config.
+FLEET_KEYS = ("databases", "max_concurrent_restores", "max_workers")
+
+# states in which a temporary database may exist.
+RESTORE_STATES = ("restore", "modify", "verify", "cleanup", "alarm")
+
+
+class RestoreSlots(object):
+    """A thread safe count of temporary restores we may still start."""
+
+    def __init__(self, limit, in_use=0):
+        self.limit = limit
+        self.in_use = in_use
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns True and takes a slot if one is free."""
+        with self._lock:
+            if self.in_use >= self.limit:
+                return False
+            self.in_use += 1
+            return True
+
+
+def is_fleet_event(event):
+    return "databases" in event
+
+
+def get_database_configs(event):
+    """Returns a config event for each database of a fleet event."""
+    defaults = {k: v for k, v in event.items() if k not in FLEET_KEYS}
+    configs = []
+    for database in event["databases"]:
+        if not isinstance(database, dict):
+            database = {"database": database}
+        config = dict(defaults)
+        config.update(database)
+        configs.append(config)
+    return configs
+
+
+def fleet_state_store(configs):
+    """Returns the StateStore shared by every database config, or None."""
+    locations = set(environ.get("STATE_STORE", c.get("state_store")) for c in configs)
+    if len(locations) != 1 or None in locations:
+        return None
+    return get_state_store(locations.pop())
+
+
+def load_state_docs(configs, max_workers=DEFAULT_MAX_WORKERS, state_store=None):
+    """Load (or create) the state_doc of every database config at once."""
+    if state_store is not None:
+        documents = state_store.load_many([c["database"] for c in configs])
+        return [
+            state_doc_from_document(c, documents.get(c["database"])) for c in configs
+        ]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        return list(pool.map(get_or_create_state_doc, configs))
+
+
+def advance_fleet(state_docs, max_concurrent_restores, max_workers, deadline=None):
+    """Advance every state machine concurrently.
+
+    `deadline` (POSIX time) is when every wakeup must have saved its work.
+
+    Returns:
+        list: a result dict per state_doc, errors are captured not raised.
+    """
+    from . import advance
+
+    in_use = len([d for d in state_docs if d.current_state in RESTORE_STATES])
+    restore_slots = RestoreSlots(max_concurrent_restores, in_use)
+
+    def advance_one(state_doc):
+        before = state_doc.current_state
+        try:
+            advance(state_doc, restore_slots, deadline)
+        except StateDocConflict as e:
+            # another wakeup advanced this database meanwhile, it wins.
+            logger.warning(
+                "Skipping %s, its state doc changed: %s", state_doc.database, e
+            )
+            return {
+                "database": state_doc.database,
+                "before": before,
+                "after": before,
+                "error": None,
+            }
+        except Exception as e:
+            logger.exception("Failed to advance %s", state_doc.database)
+            error = repr(e)
+        else:
+            error = None
+        return {
+            "database": state_doc.database,
+            "before": before,
+            "after": state_doc.current_state,
+            "error": error,
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        return list(pool.map(advance_one, state_docs))
+
+
+def fleet_handler(event, deadline=None):
+    """Load every state_doc of the fleet and advance them all."""
+    max_workers = event.get("max_workers", DEFAULT_MAX_WORKERS)
+    configs = get_database_configs(event)
+    state_store = fleet_state_store(configs)
+
+    def load_and_advance():
+        state_docs = load_state_docs(configs, max_workers, state_store)
+        return advance_fleet(
+            state_docs,
+            event.get("max_concurrent_restores", DEFAULT_MAX_CONCURRENT_RESTORES),
+            max_workers,
+            deadline,
+        )
+
+    if state_store is None:
+        results = load_and_advance()
+    else:
+        # every save of the wakeup is written by one save_many.
+        try:
+            with state_store.batch():
+                results = load_and_advance()
+        except StateDocConflict as e:
+            # the other documents are saved, another wakeup won these.
+            logger.warning("Not saved, the state docs changed: %s", e)
+    for result in results:
+        logger.info("%(database)s: %(before)s -> %(after)s error=%(error)s", result)
+    return results
@@ -1,12 +1,26 @@
 from os import environ
 
+import fcntl
+import hashlib
 import json
-
+import logging
+import os
+import stat
+import tempfile
 import time
 
-import boto3
-
+from dbsnap.clients import get_client
 from dbsnap.rds_funcs import dbsnap_verify_identifier
+from dbsnap.utils import get_error_code
+
+from .datadog_output import datadog_lambda_metric_output
+from .events import parse_sns_rds_event
+from .state_store import CONFLICT_ERROR_CODES, StateDocConflict, get_state_store
+
+logger = logging.getLogger("dbsnap")
+
+# mode of a new state document file, mkstemp would leave it 0600.
+DEFAULT_FILE_MODE = 0o644
 
 
 try:
@@ -19,6 +33,11 @@ def now_timestamp():
     return time.time()
 
 
+def body_version(body):
+    """Returns the version of a state document saved in a file."""
+    return hashlib.md5(body.encode("utf-8")).hexdigest()
+
+
 def timestamp_to_isoformat(ts):
     from datetime import datetime
 
@@ -31,6 +50,9 @@ class DocToObject(object):
     Make document keys is accessible as object attributes.
     """
 
+    # attributes of a single wakeup, left out of the saved document.
+    unsaved_attributes = ()
+
     def setattrs_from_dict(self, dictionary):
         for key, value in dictionary.items():
             try:
@@ -55,9 +77,22 @@ class DocToObject(object):
                 )
             )
 
+    @property
+    def document(self):
+        """dict: the attributes which are persisted, all but _private ones."""
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
     @property
     def to_json(self):
-        return json.dumps(self.__dict__, indent=2)
+        return json.dumps(self.document, indent=2)
+
+    @property
+    def to_compact_json(self):
+        """The document as it is saved, without whitespace and sorted."""
+        document = self.document
+        for name in self.unsaved_attributes:
+            document.pop(name, None)
+        return json.dumps(document, separators=(",", ":"), sort_keys=True)
 
 
 class StateDoc(DocToObject):
@@ -72,6 +107,11 @@ class StateDoc(DocToObject):
         self.state_doc_name = name
         self.state_doc_path = state_doc_path
         self.state_doc_bucket = state_doc_bucket
+        # the ETag (S3) or body_version (file) of the saved document, and
+        # the body last saved or loaded, so unchanged documents are not
+        # written again.
+        self._version = None
+        self._saved_body = None
         super(StateDoc, self).__init__(kwargs)
 
     @property
@@ -82,6 +122,15 @@ class StateDoc(DocToObject):
     def state_doc_file_path(self):
         return environ.get("STATE_DOC_PATH", self.state_doc_path)
 
+    @property
+    def state_store_location(self):
+        return environ.get("STATE_STORE", getattr(self, "state_store", None))
+
+    @property
+    def state_doc_store(self):
+        """The shared dbsnap_verify.state_store.StateStore, see `state_store`."""
+        return get_state_store(self.state_store_location)
+
     @property
     def current_state(self):
         if self.states:
@@ -98,10 +147,17 @@ class StateDoc(DocToObject):
 
     @property
     def persistence(self):
-        """str: "state_doc_bucket" or "state_doc_path" or raises exception."""
-        if self.state_doc_bucket_name and self.state_doc_file_path:
-            msg = "Choose either `state_doc_bucket` or `state_doc_path` not both."
+        """str: "state_store", "state_doc_bucket" or "state_doc_path", or raises."""
+        locations = [
+            self.state_store_location,
+            self.state_doc_bucket_name,
+            self.state_doc_file_path,
+        ]
+        if len([location for location in locations if location]) > 1:
+            msg = "Choose one of `state_store`, `state_doc_bucket` or `state_doc_path`."
             raise Exception(msg)
+        elif self.state_store_location:
+            return "state_store"
         elif self.state_doc_bucket_name:
             return "state_doc_bucket"
         elif self.state_doc_file_path:
@@ -111,31 +167,93 @@ class StateDoc(DocToObject):
     def state_doc_s3_key(self):
         return "state-doc-{}.json".format(self.state_doc_name)
 
-    def _save_state_doc_in_s3(self):
-        if self.state_doc_bucket_name:
-            s3 = boto3.client("s3")
-            s3.put_object(
+    def _save_state_doc_in_s3(self, body):
+        """Put `body` unless the object changed since we loaded it."""
+        if self._version is None:
+            # we never loaded it, so it must not exist yet.
+            conditions = {"IfNoneMatch": "*"}
+        else:
+            conditions = {"IfMatch": self._version}
+        try:
+            response = get_client("s3").put_object(
                 Bucket=self.state_doc_bucket_name,
                 Key=self.state_doc_s3_key,
-                Body=self.to_json,
+                Body=body,
+                **conditions
             )
+        except Exception as e:
+            if get_error_code(e) in CONFLICT_ERROR_CODES:
+                raise StateDocConflict(self.state_doc_s3_key)
+            raise
+        self._version = response.get("ETag")
 
     def _load_state_doc_from_s3(self):
         """Returns a JSON String State Document."""
-        s3 = boto3.client("s3")
+        s3 = get_client("s3")
         s3_object = s3.get_object(
             Bucket=self.state_doc_bucket_name, Key=self.state_doc_s3_key
         )
+        self._version = s3_object.get("ETag")
         return s3_object["Body"].read().decode("utf-8")
 
-    def _save_state_doc_in_path(self):
-        with open(self.state_doc_file_path, "w") as json_file:
-            json_file.write(self.to_json)
+    def _save_state_doc_in_path(self, body):
+        """Write `body` to a temporary file renamed over the document, so a
+        crash never leaves half a document, unless the file changed since we
+        loaded it. A lock file keeps other processes out between the
+        check and the rename."""
+        path = self.state_doc_file_path
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._replace_state_doc_file(path, body)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._version = body_version(body)
+
+    def _replace_state_doc_file(self, path, body):
+        try:
+            with open(path, "r") as json_file:
+                current = body_version(json_file.read())
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except (IOError, OSError):
+            current = None
+            mode = DEFAULT_FILE_MODE
+        if current != self._version:
+            raise StateDocConflict(path)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".state-doc-", dir=os.path.dirname(os.path.abspath(path))
+        )
+        try:
+            with os.fdopen(fd, "w") as json_file:
+                json_file.write(body)
+            os.chmod(tmp_path, mode)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
 
     def _load_state_doc_from_path(self):
         """Returns a JSON String State Document."""
         with open(self.state_doc_file_path, "r") as json_file:
-            return json_file.read()
+            body = json_file.read()
+        self._version = body_version(body)
+        return body
+
+    def checkpoint(self, name):
+        """Returns the checkpoint dict of sub-state `name`, created empty.
+
+        A state which takes more than one wakeup keeps its progress (status,
+        cursors, elapsed seconds) in a checkpoint, saved with the document,
+        so the next wakeup continues where the last one stopped.
+        """
+        if getattr(self, "checkpoints", None) is None:
+            self.checkpoints = {}
+        return self.checkpoints.setdefault(name, {})
+
+    def clear_checkpoint(self, name):
+        """Forget the checkpoint of sub-state `name`."""
+        if getattr(self, "checkpoints", None):
+            self.checkpoints.pop(name, None)
 
     def is_valid_transition(self, new_state):
         return new_state in self.valid_transitions
@@ -167,16 +285,63 @@ class StateDoc(DocToObject):
         self.states = self.states[trim_index:]
 
     def save(self):
-        if self.persistence == "state_doc_bucket":
-            self._save_state_doc_in_s3()
-        elif self.persistence == "state_doc_path":
-            self._save_state_doc_in_path()
+        """Write the document as compact JSON, unless nothing changed.
+
+        Returns:
+            bool: True if the document was written.
+        Raises:
+            StateDocConflict: if another wakeup saved it since we loaded it.
+        """
+        persistence = self.persistence
+        if persistence is None:
+            return False
+        body = self.to_compact_json
+        if body == self._saved_body:
+            logger.debug("State doc %s is unchanged, not saving.", self.state_doc_name)
+            return False
+        started = time.time()
+        if persistence == "state_store":
+            # staged while the store is in a batch, see fleet_handler.
+            self.state_doc_store.save(self.state_doc_name, json.loads(body))
+        elif persistence == "state_doc_bucket":
+            self._save_state_doc_in_s3(body)
+        else:
+            self._save_state_doc_in_path(body)
+        self._saved_body = body
+        tags = {"state_doc": self.state_doc_name, "persistence": persistence}
+        logger.info(
+            datadog_lambda_metric_output(
+                "dbsnap_verify.state_doc.save_bytes", len(body), "gauge", tags
+            )
+        )
+        logger.info(
+            datadog_lambda_metric_output(
+                "dbsnap_verify.state_doc.save_seconds",
+                round(time.time() - started, 3),
+                "gauge",
+                tags,
+            )
+        )
+        return True
 
     def load(self):
-        if self.persistence == "state_doc_bucket":
-            self.from_json(self._load_state_doc_from_s3())
+        if self.persistence == "state_store":
+            document = self.state_doc_store.load(self.state_doc_name)
+        elif self.persistence == "state_doc_bucket":
+            document = self._load_state_doc_from_s3()
         elif self.persistence == "state_doc_path":
-            self.from_json(self._load_state_doc_from_path())
+            document = self._load_state_doc_from_path()
+        else:
+            return
+        self.loaded(document)
+
+    def loaded(self, document):
+        """Take the attributes of the saved `document` (dict or JSON)."""
+        self.from_json(document)
+        if not isinstance(document, dict):
+            document = json.loads(document)
+        # what is saved now, attributes the document lacks are not.
+        self._saved_body = json.dumps(document, separators=(",", ":"), sort_keys=True)
 
 
 class DbsnapVerifyStateDoc(StateDoc):
@@ -185,6 +350,8 @@ class DbsnapVerifyStateDoc(StateDoc):
     It can persist it's state in a file path or s3.
     """
 
+    unsaved_attributes = ("rds_event",)
+
     def __init__(
         self,
         database,
@@ -197,6 +364,15 @@ class DbsnapVerifyStateDoc(StateDoc):
         snapshot_verifying=None,
         snapshot_verified=None,
         tmp_password=None,
+        tmp_database_kind=None,
+        events_seen_until=None,
+        event_driven=False,
+        rds_event=None,
+        checks=None,
+        check_results=None,
+        verify_attempts=0,
+        checkpoints=None,
+        verified_checksums=None,
         **kwargs
     ):
         """
@@ -221,16 +397,60 @@ class DbsnapVerifyStateDoc(StateDoc):
             The S3 bucket to store the state document.
             If you choose this, do not set state_doc_path.
 
+        state_store (string):
+            A store shared by the state documents of many databases,
+            s3://bucket/prefix or sqlite:///path (see
+            dbsnap_verify.state_store), instead of state_doc_bucket or
+            state_doc_path.
+
         tmp_password (string):
             The temporary randomly generated RDS master password.
             This is used for data verification.
 
+        tmp_database_kind (string):
+            "instance" or "cluster" once the temporary database was restored,
+            so we only ever describe the right kind of resource.
+
+        events_seen_until (float):
+            POSIX timestamp of the newest RDS event of the temporary database
+            we have looked at, so each wakeup only fetches newer events.
+
         snapshot_verifying (string):
             The current AWS RDS Snapshot ID under verification.
 
         snapshot_verified (string):
             The most recently verified AWS RDS Snapshot ID.
 
+        event_driven (bool):
+            Advance the state machine straight from unambiguous RDS event
+            notifications, skipping describe calls (see dbsnap_verify.events).
+
+        rds_event (dict):
+            The RDS event notification which woke us up, if any.
+            This is never saved to or loaded from persistence.
+
+        checks (list):
+            SQL checks to run on the temporary database, see
+            dbsnap_verify.checks. Without checks verify passes right away.
+            `verify_engine`, `verify_database_name`, `verify_max_workers`
+            and `verify_query_timeout` tune how they run.
+
+        check_results (list):
+            The results of the checks of the last verify.
+
+        verify_attempts (int):
+            Failed connections to the temporary database in this verify.
+
+        checkpoints (dict):
+            Progress of states which take more than one wakeup, by name.
+            The "verify" checkpoint keeps the status, elapsed seconds and
+            cursor of every check, so a verify cut short by the Lambda
+            timeout continues where it stopped.
+
+        verified_checksums (dict):
+            The chunk checksums of the last verified snapshot, to tell which
+            key ranges changed since.
+
         states (list):
             A list of recent state transitions.
         """
@@ -246,6 +466,15 @@ class DbsnapVerifyStateDoc(StateDoc):
             snapshot_verifying=snapshot_verifying,
             snapshot_verified=snapshot_verified,
             tmp_password=tmp_password,
+            tmp_database_kind=tmp_database_kind,
+            events_seen_until=events_seen_until,
+            event_driven=event_driven,
+            rds_event=rds_event,
+            checks=checks,
+            check_results=check_results,
+            verify_attempts=verify_attempts,
+            checkpoints=checkpoints,
+            verified_checksums=verified_checksums,
             **kwargs
         )
 
@@ -255,6 +484,10 @@ class DbsnapVerifyStateDoc(StateDoc):
 
     def clean(self, state_count_to_keep=100):
         self.tmp_password = None
+        self.tmp_database_kind = None
+        self.events_seen_until = None
+        self.verify_attempts = 0
+        self.clear_checkpoint("verify")
         self.snapshot_verified = self.snapshot_verifying
         self.snapshot_verifying = None
         self.trim_states(state_count_to_keep)
@@ -302,20 +535,27 @@ def create_dbsnap_verify_state_doc(
     return state_doc
 
 
+def state_doc_from_document(config, document):
+    """Returns the state_doc of config event `config` from its saved
+    `document`, or a new one if `document` is None."""
+    if document is None:
+        return create_dbsnap_verify_state_doc(**config)
+    state_doc = DbsnapVerifyStateDoc(**config)
+    state_doc.loaded(document)
+    return state_doc
+
+
 def get_state_doc_from_sns_event(event):
     """Return state_doc (or None) for a RDS event, instead of config event."""
     try:
-        event_payload = json.loads(event["Records"][0]["Sns"]["Message"])
-        # split tmp_database name by "dbsv-" and grab the half.
-        database_id = event_payload["Source ID"].split("dbsv-")[-1]
-        rds_event_message = event_payload["Event Message"]
-
+        rds_event = parse_sns_rds_event(event)
     except KeyError:
         return None
 
-    state_doc = DbsnapVerifyStateDoc(
-        database_id, rds_event_latest_message=rds_event_message
-    )
+    # split tmp_database name by "dbsv-" and grab the half.
+    database_id = rds_event["source_id"].split("dbsv-")[-1]
+
+    state_doc = DbsnapVerifyStateDoc(database_id, rds_event=rds_event)
 
     return state_doc
 
@@ -335,10 +575,13 @@ def get_or_create_state_doc(event):
         state_doc = get_state_doc_from_sns_event(event)
 
     if state_doc:
+        # the event which woke us up, not whatever a previous wakeup saved.
+        rds_event = state_doc.rds_event
         try:
             # try to load the state_doc.
             state_doc.load()
-        except (boto3.client("s3").exceptions.NoSuchKey, IOError):
+            state_doc.rds_event = rds_event
+        except (get_client("s3").exceptions.NoSuchKey, IOError):
             if is_config_event(event):
                 # create the state_doc if it doesn't exist.
                 state_doc = create_dbsnap_verify_state_doc(**event)
@@ -0,0 +1,412 @@
+"""Keep the state documents of many databases in one shared store.
+
+With `state_doc_bucket` every database has its own S3 object, so a fleet
+wakeup costs a GET and a PUT per database. A state store holds every
+state document of a fleet and loads or saves any number of them in a
+constant number of round trips:
+
+s3://bucket/prefix:
+ the documents are spread over `shards` JSON objects (16 by default) by
+ a hash of the database name, `load_many` GETs at most every shard and
+ `save_many` PUTs only the shards it changed. Shards are written with a
+ conditional put, a shard saved by another wakeup meanwhile is read
+ again and our documents applied on top of its other documents.
+
+sqlite:///path/to/state.db (or a path ending in .db / .sqlite):
+ a key-value table in a local SQLite file, for dbsnap-verify run from
+ cron or the CLI, and a stand-in for a key-value table in tests.
+
+Every document has a version, the md5 of its JSON. A store remembers the
+version of each document it loaded (or saved), and `save_many` raises
+StateDocConflict for documents another wakeup changed since, after
+saving the others.
+
+Set `state_store` in the config (or the STATE_STORE environment variable)
+instead of `state_doc_bucket` / `state_doc_path`. A fleet wakeup loads
+every document at once and saves them all at the end (see `batch`)::
+
+    store = get_state_store("s3://my-bucket/dbsnap-verify")
+    documents = store.load_many(["prod-api-db", "prod-search-db"])
+    with store.batch():
+        store.save("prod-api-db", documents["prod-api-db"])
+"""
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from dbsnap.clients import get_client
+from dbsnap.utils import get_error_code
+
+from .datadog_output import datadog_lambda_metric_output
+
+logger = logging.getLogger("dbsnap")
+
+DEFAULT_SHARDS = 16
+
+# times a shard is read again after another wakeup saved it first.
+MAX_SHARD_ATTEMPTS = 5
+
+# S3 answers a conditional put whose condition no longer holds with these.
+CONFLICT_ERROR_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+# SQLite allows 999 bound parameters per statement.
+SQLITE_BATCH = 500
+
+
+class StateDocNotFound(IOError):
+    """No state document of this name is in the store."""
+
+
+class StateDocConflict(Exception):
+    """The state document was saved by someone else since we loaded it."""
+
+
+def document_json(document):
+    return json.dumps(document, separators=(",", ":"), sort_keys=True)
+
+
+def text_version(text):
+    """Returns the version of a document saved as JSON `text`."""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def document_version(document):
+    """Returns the version of a document (dict), None if there is none."""
+    return None if document is None else text_version(document_json(document))
+
+
+class StateStore(object):
+    """Loads and saves state documents (dicts) by name.
+
+    Subclasses implement `load_many` and `save_many`, and keep `versions`
+    up to date with `remember`. While in `batch`, `save` only stages
+    documents and they are written together at the end.
+    """
+
+    def __init__(self):
+        self.staged = {}
+        self.batching = 0
+        # version by name of the documents as we last loaded or saved them.
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def remember(self, versions):
+        """Record the {name: version} of documents loaded or saved."""
+        with self._lock:
+            self.versions.update(versions)
+
+    def conflicts(self, versions):
+        """Returns the names whose current {name: version} is not ours."""
+        with self._lock:
+            return sorted(
+                name
+                for name, version in versions.items()
+                if self.versions.get(name) != version
+            )
+
+    def load_many(self, names):
+        """Returns {name: document} of the `names` in the store."""
+        raise NotImplementedError
+
+    def save_many(self, documents):
+        """Write every {name: document} of `documents`.
+
+        Raises:
+            StateDocConflict: naming the documents which changed since we
+                loaded them, those are not written, the others are.
+        """
+        raise NotImplementedError
+
+    def load(self, name):
+        """Returns the document of `name`, or raises StateDocNotFound."""
+        documents = self.load_many([name])
+        if name not in documents:
+            raise StateDocNotFound(name)
+        return documents[name]
+
+    def save(self, name, document):
+        """Write (or, in a batch, stage) the document of `name`."""
+        with self._lock:
+            if self.batching:
+                self.staged[name] = document
+                return
+        self.save_many({name: document})
+
+    @contextmanager
+    def batch(self):
+        """Stage every save until the outermost batch exits, then flush."""
+        with self._lock:
+            self.batching += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.batching -= 1
+                last = not self.batching
+            if last:
+                self.flush()
+
+    def flush(self):
+        """Write the staged documents in one save_many."""
+        with self._lock:
+            documents, self.staged = self.staged, {}
+        if not documents:
+            return
+        started = time.time()
+        self.save_many(documents)
+        logger.info(
+            datadog_lambda_metric_output(
+                "dbsnap_verify.state_store.save_seconds",
+                round(time.time() - started, 3),
+                "gauge",
+                {"documents": len(documents)},
+            )
+        )
+
+
+def shard_of(name, shards):
+    """Returns the shard number of `name`, the same in every process."""
+    return int(hashlib.md5(name.encode("utf-8")).hexdigest(), 16) % shards
+
+
+class ShardedS3StateStore(StateStore):
+    """State documents in `shards` JSON objects under s3://bucket/prefix.
+
+    Args:
+        bucket (str): the S3 bucket.
+        prefix (str): key prefix of the shard objects.
+        shards (int): how many objects to spread the documents over, do
+            not change it once documents are saved.
+    """
+
+    def __init__(self, bucket, prefix="", shards=DEFAULT_SHARDS):
+        super(ShardedS3StateStore, self).__init__()
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.shards = shards
+        # (etag, documents) of the shards read so far by number.
+        self.cache = {}
+
+    def shard_key(self, shard):
+        key = "state-docs-{:03d}.json".format(shard)
+        return "{}/{}".format(self.prefix, key) if self.prefix else key
+
+    def read_shard(self, shard):
+        """Returns (etag, documents) of `shard`, (None, {}) if not saved yet."""
+        s3 = get_client("s3")
+        try:
+            s3_object = s3.get_object(Bucket=self.bucket, Key=self.shard_key(shard))
+        except s3.exceptions.NoSuchKey:
+            entry = (None, {})
+        else:
+            body = s3_object["Body"].read().decode("utf-8")
+            entry = (s3_object.get("ETag"), json.loads(body))
+        with self._lock:
+            self.cache[shard] = entry
+        return entry
+
+    def write_shard(self, shard, etag, documents):
+        """Put `documents` as `shard` if it is still at `etag`, returns False if not."""
+        if etag is None:
+            conditions = {"IfNoneMatch": "*"}
+        else:
+            conditions = {"IfMatch": etag}
+        body = document_json(documents)
+        try:
+            response = get_client("s3").put_object(
+                Bucket=self.bucket, Key=self.shard_key(shard), Body=body, **conditions
+            )
+        except Exception as e:
+            if get_error_code(e) in CONFLICT_ERROR_CODES:
+                return False
+            raise
+        with self._lock:
+            self.cache[shard] = (response.get("ETag"), documents)
+        return True
+
+    def load_many(self, names):
+        shards = sorted(set(shard_of(name, self.shards) for name in names))
+        documents = {}
+        for shard in shards:
+            documents.update(self.read_shard(shard)[1])
+        self.remember({name: document_version(documents.get(name)) for name in names})
+        # copies, the cached shard must stay as it was saved.
+        return {
+            name: copy.deepcopy(documents[name]) for name in names if name in documents
+        }
+
+    def save_many(self, documents):
+        by_shard = {}
+        for name, document in documents.items():
+            by_shard.setdefault(shard_of(name, self.shards), {})[name] = document
+        conflicts = []
+        for shard, changes in sorted(by_shard.items()):
+            with self._lock:
+                entry = self.cache.get(shard)
+            for _ in range(MAX_SHARD_ATTEMPTS):
+                if entry is None:
+                    entry = self.read_shard(shard)
+                etag, saved = entry
+                # only the documents nobody else changed are ours to write.
+                changed = self.conflicts(
+                    {name: document_version(saved.get(name)) for name in changes}
+                )
+                merged = dict(saved)
+                merged.update(
+                    (name, document)
+                    for name, document in changes.items()
+                    if name not in changed
+                )
+                if len(changed) == len(changes) or self.write_shard(
+                    shard, etag, merged
+                ):
+                    break
+                logger.info("Shard %s changed since we read it, merging.", shard)
+                entry = None
+            else:
+                raise IOError(
+                    "Could not save {}, it kept changing.".format(self.shard_key(shard))
+                )
+            conflicts.extend(changed)
+            self.remember(
+                {
+                    name: document_version(document)
+                    for name, document in changes.items()
+                    if name not in changed
+                }
+            )
+        if conflicts:
+            raise StateDocConflict(", ".join(sorted(conflicts)))
+
+
+class SQLiteStateStore(StateStore):
+    """State documents in a key-value table of a local SQLite file.
+
+    Args:
+        path (str): the SQLite database file, created if missing.
+    """
+
+    def __init__(self, path):
+        super(SQLiteStateStore, self).__init__()
+        self.path = path
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state_docs "
+                "(name TEXT PRIMARY KEY, document TEXT NOT NULL, updated REAL)"
+            )
+
+    def connect(self):
+        # imported here, the Lambda keeps its state in S3 and never needs it.
+        import sqlite3
+
+        # a connection per call, the fleet saves from many threads.
+        return sqlite3.connect(self.path, timeout=30)
+
+    def select(self, connection, names):
+        """Returns {name: JSON text} of the `names` in the table."""
+        names = list(names)
+        texts = {}
+        for i in range(0, len(names), SQLITE_BATCH):
+            batch = names[i : i + SQLITE_BATCH]
+            rows = connection.execute(
+                "SELECT name, document FROM state_docs WHERE name IN ({})".format(
+                    ",".join("?" * len(batch))
+                ),
+                batch,
+            )
+            texts.update(rows)
+        return texts
+
+    def load_many(self, names):
+        names = list(names)
+        connection = self.connect()
+        try:
+            texts = self.select(connection, names)
+        finally:
+            connection.close()
+        self.remember(
+            {
+                name: text_version(texts[name]) if name in texts else None
+                for name in names
+            }
+        )
+        return {name: json.loads(text) for name, text in texts.items()}
+
+    def save_many(self, documents):
+        now = time.time()
+        texts = {name: document_json(document) for name, document in documents.items()}
+        connection = self.connect()
+        # transactions by hand, the version check and the writes are one.
+        connection.isolation_level = None
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                saved = self.select(connection, texts)
+                conflicts = self.conflicts(
+                    {
+                        name: text_version(saved[name]) if name in saved else None
+                        for name in texts
+                    }
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO state_docs (name, document, updated) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (name, text, now)
+                        for name, text in texts.items()
+                        if name not in conflicts
+                    ],
+                )
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        self.remember(
+            {
+                name: text_version(text)
+                for name, text in texts.items()
+                if name not in conflicts
+            }
+        )
+        if conflicts:
+            raise StateDocConflict(", ".join(conflicts))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(location):
+    """Returns the (shared) StateStore of `location`, see the module docstring.
+
+    Args:
+        location (str): s3://bucket/prefix, sqlite:///path or a .db path.
+    """
+    with _stores_lock:
+        store = _stores.get(location)
+        if store is None:
+            store = _stores[location] = make_state_store(location)
+        return store
+
+
+def make_state_store(location):
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        if not bucket:
+            raise ValueError("State store {} has no bucket.".format(location))
+        return ShardedS3StateStore(bucket, prefix)
+    if location.startswith("sqlite://"):
+        return SQLiteStateStore(location[len("sqlite://") :])
+    if location.endswith((".db", ".sqlite")):
+        return SQLiteStateStore(location)
+    raise ValueError(
+        "State store {} not in s3://bucket/prefix or sqlite:///path form.".format(
+            location
+        )
+    )
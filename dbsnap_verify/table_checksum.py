@@ -0,0 +1,275 @@
+"""Checksum large tables in primary key ranges, across many wakeups.
+
+A `table_checksum` check splits `table` into ranges of `chunk_size`
+values of its integer primary `key`, aligned to multiples of chunk_size
+so the same range covers the same keys in every snapshot. Chunks are
+hashed concurrently over the check connection pool. The `cursor` of the
+check's checkpoint, which the state doc persists, keeps the key bounds,
+the start of the first range not hashed yet and the checksums of the
+chunks hashed so far, so a table too large for one Lambda invocation
+continues where the last wakeup stopped instead of starting over::
+
+    {"type": "table_checksum", "table": "events", "key": "id", "chunk_size": 100000}
+
+Ranges are generated from `next` when needed and never saved, and ranges
+without rows are not kept. Chunks are hashed in windows of a few per
+worker, before each window a `MIN(key)` query moves `next` to the range
+of the first key not hashed yet, so the gaps of a sparse key are skipped
+instead of hashed one empty range at a time. A chunk which fails is
+hashed again by the next wakeup, the check fails after
+MAX_CHUNK_FAILURES wakeups with failed chunks.
+
+Once every chunk is hashed, the chunk checksums are compared with those
+of the previous verified snapshot, pointing to the key ranges whose rows
+changed in between.
+"""
+import hashlib
+import threading
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# rows fetched at a time when hashing a chunk on our side.
+FETCH_SIZE = 1000
+
+# wakeups with failed chunks before the check fails.
+MAX_CHUNK_FAILURES = 3
+
+# chunks per connection hashed in one window.
+CHUNKS_PER_WORKER = 8
+
+# the checksum of a range without rows.
+EMPTY_CHECKSUM = hashlib.md5().hexdigest()
+
+
+def aligned(key, chunk_size):
+    """Returns the start of the range of `chunk_size` holding `key`."""
+    return (key // chunk_size) * chunk_size
+
+
+class TableChecksum(object):
+    """The chunked checksum of one table, see the module docstring.
+
+    Args:
+        name (str): the check name.
+        config (dict): the check config.
+        progress (dict): the saved `cursor` of this check's checkpoint,
+            updated in place.
+        previous (dict): chunk checksums of the previous verified snapshot.
+    """
+
+    def __init__(self, name, config, progress, previous=None):
+        self.name = name
+        self.table = config["table"]
+        self.key = config.get("key", "id")
+        self.progress = progress
+        self.progress.setdefault("chunks", {})
+        # a verify in progress keeps the chunk size it was planned with.
+        self.chunk_size = int(
+            self.progress.get("chunk_size")
+            or config.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        )
+        self.previous = previous or {}
+        self.errors = []
+        # seconds spent querying in this wakeup, summed over connections.
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_seconds(self, seconds):
+        with self._lock:
+            self.seconds += seconds
+
+    def plan(self, connection, dialect):
+        """Find the key bounds to hash, unless an earlier wakeup did, then
+        move `next` to the range of the first key not hashed yet."""
+        if self.complete:
+            return
+        if self.planned:
+            return self.seek(connection, dialect)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT MIN({0}), MAX({0}) FROM {1}".format(
+                    dialect.quote(self.key), dialect.quote(self.table)
+                )
+            )
+            low, high = cursor.fetchone()
+        finally:
+            cursor.close()
+        first = None
+        if low is not None:
+            low, high = int(low), int(high)
+            first = aligned(low, self.chunk_size)
+        # every range below `next` is hashed.
+        self.progress.update(
+            {"low": low, "high": high, "chunk_size": self.chunk_size, "next": first}
+        )
+
+    def seek(self, connection, dialect):
+        """Skip the ranges without rows between `next` and the next key."""
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT MIN({0}) FROM {1} WHERE {0} >= {2:d}".format(
+                    dialect.quote(self.key),
+                    dialect.quote(self.table),
+                    self.progress["next"],
+                )
+            )
+            key = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        with self._lock:
+            if key is None:
+                # rows above `next` are gone since the bounds were planned.
+                key = self.progress["high"] + self.chunk_size
+            start = max(self.progress["next"], aligned(int(key), self.chunk_size))
+            chunks = self.progress["chunks"]
+            for skipped in [s for s in chunks if int(s) < start and not chunks[s][0]]:
+                del chunks[skipped]
+            self.progress["next"] = start
+            self._skip_hashed()
+
+    @property
+    def planned(self):
+        return "high" in self.progress
+
+    def count_ranges(self):
+        """Returns the number of ranges of the table."""
+        if not self.planned or self.progress["low"] is None:
+            return 0
+        low = aligned(self.progress["low"], self.chunk_size)
+        high = aligned(self.progress["high"], self.chunk_size)
+        return (high - low) // self.chunk_size + 1
+
+    def count_pending(self):
+        """Returns the number of ranges not hashed yet."""
+        if self.complete or not self.planned:
+            return 0
+        start = self.progress["next"]
+        high = aligned(self.progress["high"], self.chunk_size)
+        ranges = (high - start) // self.chunk_size + 1
+        return ranges - sum(1 for s in self.progress["chunks"] if int(s) >= start)
+
+    def pending_ranges(self):
+        """Yields the [start, end) ranges not hashed yet, from `next` on."""
+        if self.complete or not self.planned:
+            return
+        chunks = self.progress["chunks"]
+        start = self.progress["next"]
+        while start <= self.progress["high"]:
+            if str(start) not in chunks:
+                yield [start, start + self.chunk_size]
+            start += self.chunk_size
+
+    @property
+    def complete(self):
+        if not self.planned:
+            return False
+        progress = self.progress
+        return progress["low"] is None or progress["next"] > progress["high"]
+
+    def _skip_hashed(self):
+        """Move `next` past the hashed ranges, forgetting the empty ones."""
+        chunks = self.progress["chunks"]
+        while str(self.progress["next"]) in chunks:
+            key = str(self.progress["next"])
+            if not chunks[key][0]:
+                del chunks[key]
+            self.progress["next"] += self.chunk_size
+
+    def checksum_chunk(self, connection, dialect, start, end):
+        """Hash the rows with `start` <= key < `end` and record the result."""
+        sql = dialect.chunk_checksum_sql(self.table, self.key, start, end)
+        cursor = connection.cursor()
+        try:
+            if sql is not None:
+                # hashed by the database, only the checksum comes back.
+                cursor.execute(sql)
+                rows, checksum = cursor.fetchone()
+                checksum = checksum or EMPTY_CHECKSUM
+            else:
+                cursor.execute(
+                    "SELECT * FROM {1} WHERE {0} >= {2:d} AND {0} < {3:d} "
+                    "ORDER BY {0}".format(
+                        dialect.quote(self.key), dialect.quote(self.table), start, end
+                    )
+                )
+                rows, checksum = hash_rows(cursor)
+        finally:
+            cursor.close()
+        with self._lock:
+            chunks = self.progress["chunks"]
+            chunks[str(start)] = [rows, checksum]
+            self._skip_hashed()
+
+    def changed_ranges(self):
+        """Returns the [start, end) ranges whose checksum differs from previous."""
+        if not self.previous:
+            return []
+        current = {start: chunk[1] for start, chunk in self.progress["chunks"].items()}
+        starts = sorted(set(current) | set(self.previous), key=int)
+        return [
+            [int(start), int(start) + self.chunk_size]
+            for start in starts
+            if self.previous.get(start, EMPTY_CHECKSUM)
+            != current.get(start, EMPTY_CHECKSUM)
+        ]
+
+    def result(self):
+        """Returns (ok, value, message), ok is None while chunks are pending.
+
+        A wakeup with failed chunks counts towards MAX_CHUNK_FAILURES.
+        """
+        ranges = self.count_ranges()
+        done = ranges - self.count_pending()
+        if self.errors:
+            failures = self.progress["failures"] = self.progress.get("failures", 0) + 1
+            message = "chunk failed ({} of {} wakeups): {!r}".format(
+                failures, MAX_CHUNK_FAILURES, self.errors[0]
+            )
+            if failures >= MAX_CHUNK_FAILURES:
+                return False, None, message
+            return None, {"chunks": ranges, "done": done}, message
+        if not self.complete:
+            return (
+                None,
+                {"chunks": ranges, "done": done},
+                "{} of {} chunks hashed".format(done, ranges),
+            )
+        rows = sum(chunk[0] for chunk in self.progress["chunks"].values())
+        changed = self.changed_ranges()
+        value = {"chunks": ranges, "rows": rows, "changed": changed}
+        if self.previous:
+            message = (
+                "{} rows in {} chunks, {} changed since the last verified "
+                "snapshot".format(rows, ranges, len(changed))
+            )
+        else:
+            message = "{} rows in {} chunks".format(rows, ranges)
+        return True, value, message
+
+
+def checkpoint_checksums(checkpoints):
+    """Returns the chunk checksums of every table_checksum of finished `checkpoints`."""
+    return {
+        name: {
+            start: chunk[1]
+            for start, chunk in entry["cursor"].get("chunks", {}).items()
+        }
+        for name, entry in checkpoints.items()
+        if "cursor" in entry
+    }
+
+
+def hash_rows(cursor):
+    """Returns (row count, md5) of the rows of an executed cursor."""
+    digest = hashlib.md5()
+    count = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            digest.update(("|".join(str(v) for v in row) + "\n").encode("utf-8"))
+        count += len(rows)
+    return count, digest.hexdigest()
@@ -12,8 +12,14 @@ setup(
     author_email="russell@remind101.com",
     url="https://github.com/remind101/dbsnap",
     license="New BSD license",
-    packages=find_packages(),
-    install_requires=["boto3", "botocore>=1.6.0"],
+    packages=find_packages(exclude=["dbsnap.testing", "tests"]),
+    # S3 conditional writes (IfMatch/IfNoneMatch on put_object) keep the
+    # state doc and state store saves from overwriting each other.
+    install_requires=[
+        "boto3>=1.35.68",
+        "botocore>=1.35.68",
+    ],
+    python_requires=">=3.8",
     tests_require=["nose", "mock", "funcsigs", "flake8", "pytest"],
     setup_requires=["pytest-runner"],
     entry_points={
@@ -26,12 +32,8 @@ setup(
         "Intended Audience :: Developers, Operators, System Administrators",
         "Natural Language :: English",
         "License :: OSI Approved :: Apache Software License",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.8",
     ],
 )
 
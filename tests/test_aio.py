@@ -0,0 +1,93 @@
+import sys
+import threading
+import time
+import unittest
+
+from dbsnap import get_latest_snapshot
+from dbsnap.testing.fake_aws import FakeAWS
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from dbsnap.aio import AsyncRDS
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio api needs Python 3.5+")
+class TestAsyncRDS(unittest.TestCase):
+    def setUp(self):
+        self.aws = FakeAWS(copy_seconds_per_gb=6)
+        self.rds = self.aws.rds("us-east-1")
+        self.identifiers = ["db-{}".format(i) for i in range(12)]
+        for identifier in self.identifiers:
+            self.rds.add_instance(identifier)
+            self.rds.add_snapshot(identifier, count=3)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_semaphore_limits_calls_in_flight(self):
+        in_flight = [0, 0]
+        lock = threading.Lock()
+        describe = self.rds.describe_db_snapshots
+
+        def slow_describe(**kwargs):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            try:
+                return describe(**kwargs)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        self.rds.describe_db_snapshots = slow_describe
+        rds = AsyncRDS(self.rds, max_concurrency=3)
+        latest = self.run_async(
+            asyncio.gather(*[rds.get_latest_snapshot(i) for i in self.identifiers])
+        )
+        self.assertEqual(
+            [s.id for s in latest],
+            [get_latest_snapshot(self.rds, i).id for i in self.identifiers],
+        )
+        self.assertEqual(in_flight[1], 3)
+
+    def test_copy_and_wait(self):
+        rds = AsyncRDS(self.rds)
+        west = AsyncRDS(self.aws.rds("us-west-2"), semaphore=asyncio.Semaphore(2))
+
+        def advance(seconds):
+            self.aws.advance(seconds)
+            return asyncio.sleep(0)
+
+        snapshots = self.run_async(rds.get_available_snapshots("db-0"))
+        jobs = self.run_async(
+            asyncio.gather(
+                *[
+                    rds.copy_and_wait(
+                        s,
+                        s.id + "-copy",
+                        dest=west,
+                        sleep=advance,
+                        clock=self.aws.clock,
+                    )
+                    for s in snapshots
+                ]
+            )
+        )
+        self.assertEqual([j.status for j in jobs], ["available"] * 3)
+        self.assertEqual(len(self.aws.rds("us-west-2").snapshots), 3)
+
+    def test_describe_database_and_delete(self):
+        rds = AsyncRDS(self.rds)
+        self.assertIsNone(self.run_async(rds.describe_database("nope")))
+        database = self.run_async(rds.describe_database("db-0"))
+        self.assertEqual(database.status, "available")
+        snapshots = self.run_async(rds.get_available_snapshots("db-0"))
+        self.run_async(rds.delete_snapshot(snapshots[0]))
+        self.assertEqual(len(self.run_async(rds.get_available_snapshots("db-0"))), 2)
+        tags = self.run_async(rds.get_tags_many([s.arn for s in snapshots[1:]]))
+        self.assertEqual(len(tags), 2)
@@ -0,0 +1,361 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import mock
+
+from dbsnap.testing.fake_aws import FakeAWS
+from dbsnap.rds_funcs import dbsnap_verify_identifier
+
+import dbsnap_verify
+from dbsnap_verify.checks import (
+    CheckError,
+    SQLiteDialect,
+    VerifyConnectionError,
+    run_checks,
+)
+from dbsnap_verify.state_doc import DbsnapVerifyStateDoc
+from dbsnap_verify.table_checksum import (
+    CHUNKS_PER_WORKER,
+    MAX_CHUNK_FAILURES,
+    TableChecksum,
+    checkpoint_checksums,
+)
+
+SLOW_QUERY = (
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+    "SELECT COUNT(*) FROM n"
+)
+
+
+def make_database(path, rows=50, updated_at=None):
+    updated_at = updated_at or time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, updated_at TEXT)"
+    )
+    connection.executemany(
+        "INSERT INTO users VALUES (?, ?, ?)",
+        [(i, "user-{}".format(i), updated_at) for i in range(rows)],
+    )
+    connection.commit()
+    connection.close()
+
+
+class SQLiteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "restored.db")
+        make_database(self.path)
+        self.dialect = SQLiteDialect()
+        self.connections = []
+
+    def connect(self):
+        connection = self.dialect.connect(None, None, None, None, self.path, 5)
+        self.connections.append(connection)
+        return connection
+
+    def run_checks(self, checks, **kwargs):
+        return run_checks(checks, self.connect, self.dialect, **kwargs)
+
+
+class TestChecks(SQLiteTestCase):
+    def test_passing_checks(self):
+        checks = [
+            {
+                "type": "query",
+                "query": "SELECT name FROM sqlite_master",
+                "regex": "users",
+            },
+            {"type": "row_count", "table": "users", "min_rows": 50},
+            {"type": "freshness", "table": "users", "max_age": 3600},
+            {"type": "checksum", "table": "users", "sample": 10},
+            {"type": "checksum", "table": "users", "name": "all users"},
+        ]
+        results = self.run_checks(checks, max_workers=2)
+        self.assertEqual([r.ok for r in results], [True] * 5)
+        self.assertEqual(results[1].value, 50)
+        self.assertNotEqual(results[3].value, results[4].value)
+        self.assertEqual(results[4].name, "all users")
+        self.assertLessEqual(len(self.connections), 2)
+
+    def test_failing_checks(self):
+        checks = [
+            {"type": "row_count", "table": "users", "min_rows": 51},
+            {"type": "freshness", "table": "users", "max_age": -60},
+            {"type": "checksum", "table": "users", "expected": "abc"},
+            {"type": "row_count", "table": "missing"},
+            {"type": "query", "query": "SELECT 1", "regex": "2"},
+        ]
+        results = self.run_checks(checks)
+        self.assertEqual([r.ok for r in results], [False] * 5)
+        self.assertIn("no such table", results[3].message)
+
+    def test_query_timeout(self):
+        started = time.time()
+        result = self.run_checks(
+            [{"type": "query", "query": SLOW_QUERY, "timeout": 0.1}]
+        )[0]
+        self.assertFalse(result.ok)
+        self.assertIn("interrupted", result.message)
+        self.assertLess(time.time() - started, 5)
+
+    def test_checkpoints(self):
+        checkpoints = {}
+        checks = [
+            {"type": "row_count", "table": "users"},
+            {"type": "query", "query": SLOW_QUERY},
+        ]
+        # the slow query is cut short by the deadline, not failed.
+        results = self.run_checks(
+            checks, checkpoints=checkpoints, deadline=time.time() + 0.2
+        )
+        self.assertEqual([r.ok for r in results], [True, None])
+        self.assertEqual(checkpoints["query:" + SLOW_QUERY]["status"], "pending")
+        self.assertGreater(checkpoints["query:" + SLOW_QUERY]["elapsed"], 0)
+
+        # a later wakeup does not run the check which passed again.
+        checks[1] = {
+            "type": "query",
+            "query": "SELECT 1",
+            "name": "query:" + SLOW_QUERY,
+        }
+        row_count = mock.Mock()
+        with mock.patch.dict("dbsnap_verify.checks.CHECK_TYPES", row_count=row_count):
+            results = self.run_checks(checks, checkpoints=checkpoints)
+        self.assertFalse(row_count.called)
+        self.assertEqual([r.ok for r in results], [True, True])
+        self.assertEqual(results[0].value, 50)
+        self.assertEqual(checkpoints["query:" + SLOW_QUERY]["runs"], 2)
+
+    def test_invalid_checks(self):
+        with self.assertRaises(CheckError):
+            self.run_checks([{"type": "vibes"}])
+
+    def test_connection_errors(self):
+        def connect():
+            raise sqlite3.OperationalError("unable to open database file")
+
+        with self.assertRaises(VerifyConnectionError):
+            run_checks([{"type": "row_count", "table": "users"}], connect, self.dialect)
+
+
+class TestTableChecksum(SQLiteTestCase):
+    check = {"type": "table_checksum", "table": "users", "chunk_size": 10}
+
+    def run_table_checksum(self, **kwargs):
+        with mock.patch.object(
+            TableChecksum,
+            "checksum_chunk",
+            autospec=True,
+            side_effect=TableChecksum.checksum_chunk,
+        ) as checksum_chunk:
+            result = self.run_checks([self.check], max_workers=3, **kwargs)[0]
+        return result, checksum_chunk.call_count
+
+    def test_continues_across_runs(self):
+        checkpoints = {}
+        result, hashed = self.run_table_checksum(checkpoints=checkpoints, deadline=0)
+        self.assertIsNone(result.ok)
+        self.assertEqual(hashed, 0)
+        self.assertEqual(result.value, {"chunks": 0, "done": 0})
+        self.assertEqual(checkpoints["table_checksum:users"]["status"], "pending")
+
+        # once the bounds are planned, a later wakeup hashes only what is left.
+        cursor = {"low": 0, "high": 49, "chunk_size": 10, "next": 0, "chunks": {}}
+        for start in ("10", "30"):
+            cursor["chunks"][start] = [10, "abc"]
+        checkpoints["table_checksum:users"]["cursor"] = cursor
+        result, hashed = self.run_table_checksum(checkpoints=checkpoints)
+        self.assertTrue(result.ok)
+        self.assertEqual(hashed, 3)
+        self.assertEqual(result.value["chunks"], 5)
+        self.assertEqual(checkpoints["table_checksum:users"]["runs"], 2)
+        self.assertEqual(cursor["next"], 50)
+
+    def test_empty_ranges_are_not_kept(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("DELETE FROM users WHERE id >= 20 AND id < 30")
+        connection.commit()
+        connection.close()
+        checkpoints = {}
+        result, hashed = self.run_table_checksum(checkpoints=checkpoints)
+        self.assertTrue(result.ok)
+        self.assertEqual(hashed, 5)
+        self.assertEqual(result.value["rows"], 40)
+        cursor = checkpoints["table_checksum:users"]["cursor"]
+        self.assertEqual(sorted(cursor["chunks"], key=int), ["0", "10", "30", "40"])
+
+        # rows gone since the previous snapshot is a changed range.
+        previous = checkpoint_checksums(checkpoints)
+        previous["table_checksum:users"]["20"] = "abc"
+        result, _ = self.run_table_checksum(checkpoints={}, previous=previous)
+        self.assertEqual(result.value["changed"], [[20, 30]])
+
+    def test_sparse_keys(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, name TEXT)")
+        connection.executemany(
+            "INSERT INTO events VALUES (?, ?)", [(1, "first"), (10 ** 18, "last")]
+        )
+        connection.commit()
+        connection.close()
+        self.check = {"type": "table_checksum", "table": "events"}
+        checkpoints = {}
+        result, hashed = self.run_table_checksum(checkpoints=checkpoints)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.value["rows"], 2)
+        self.assertEqual(result.value["chunks"], 10 ** 13 + 1)
+        # the gap between the keys is skipped, not hashed range by range.
+        self.assertLessEqual(hashed, 2 * CHUNKS_PER_WORKER)
+        cursor = checkpoints["table_checksum:events"]["cursor"]
+        self.assertEqual(sorted(cursor["chunks"], key=int), ["0", str(10 ** 18)])
+
+    def test_failed_chunks_are_retried(self):
+        checkpoints = {}
+        failing = mock.patch.object(
+            TableChecksum, "checksum_chunk", side_effect=ValueError("boom")
+        )
+        with failing:
+            result = self.run_checks([self.check], checkpoints=checkpoints)[0]
+        self.assertIsNone(result.ok)
+        self.assertTrue(result.message.startswith("chunk failed (1 of"))
+        result, hashed = self.run_table_checksum(checkpoints=checkpoints)
+        self.assertTrue(result.ok)
+        self.assertEqual(hashed, 5)
+
+        # a chunk which keeps failing fails the check.
+        checkpoints = {}
+        for _ in range(MAX_CHUNK_FAILURES):
+            with failing:
+                result = self.run_checks([self.check], checkpoints=checkpoints)[0]
+        self.assertFalse(result.ok)
+
+    def test_changed_ranges(self):
+        checkpoints = {}
+        self.run_table_checksum(checkpoints=checkpoints)
+        previous = checkpoint_checksums(checkpoints)
+
+        connection = sqlite3.connect(self.path)
+        connection.execute("UPDATE users SET name = 'changed' WHERE id = 25")
+        connection.commit()
+        connection.close()
+
+        result, _ = self.run_table_checksum(checkpoints={}, previous=previous)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.value["changed"], [[20, 30]])
+        self.assertEqual(result.value["rows"], 50)
+
+
+class TestVerifyState(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "restored.db")
+        make_database(self.path)
+        self.aws = FakeAWS()
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+        self.rds = self.aws.rds("us-east-1")
+        self.rds.add_instance("prod-db")
+        self.rds.add_snapshot("prod-db")
+        environ = mock.patch.dict("os.environ")
+        environ.start()
+        self.addCleanup(environ.stop)
+        for name in ("STATE_STORE", "STATE_DOC_BUCKET", "STATE_DOC_PATH"):
+            os.environ.pop(name, None)
+
+    def verify(self, checks, database_name=None, deadline=None, **kwargs):
+        tmp_database = dbsnap_verify_identifier("prod-db")
+        self.rds.add_instance(tmp_database)
+        kwargs.setdefault("verify_engine", "sqlite")
+        state_doc = DbsnapVerifyStateDoc(
+            "prod-db",
+            snapshot_region="us-east-1",
+            state_doc_path=os.path.join(self.tmp, "state.json"),
+            states=[{"state": "verify"}],
+            tmp_password="secret",
+            checks=checks,
+            verify_database_name=database_name or self.path,
+            **kwargs
+        )
+        with mock.patch.object(dbsnap_verify, "cleanup") as cleanup:
+            dbsnap_verify.verify(state_doc, self.rds, deadline)
+        return state_doc, cleanup
+
+    def test_checks_pass(self):
+        state_doc, cleanup = self.verify([{"type": "row_count", "table": "users"}])
+        self.assertEqual(state_doc.current_state, "cleanup")
+        self.assertTrue(cleanup.called)
+        self.assertEqual(state_doc.check_results[0]["value"], 50)
+
+    def test_checks_fail(self):
+        state_doc, cleanup = self.verify([{"type": "row_count", "table": "nope"}])
+        self.assertEqual(state_doc.current_state, "alarm")
+        self.assertFalse(cleanup.called)
+        self.assertFalse(state_doc.check_results[0]["ok"])
+
+    def test_invalid_checks_alarm(self):
+        state_doc, cleanup = self.verify([{"type": "row_count_typo", "table": "users"}])
+        self.assertEqual(state_doc.current_state, "alarm")
+        self.assertFalse(cleanup.called)
+
+    def test_unknown_engine_alarms(self):
+        state_doc, _ = self.verify(
+            [{"type": "row_count", "table": "users"}], verify_engine="oracle"
+        )
+        self.assertEqual(state_doc.current_state, "alarm")
+
+    def test_connection_retries_then_alarm(self):
+        missing = os.path.join(self.tmp, "missing", "restored.db")
+        checks = [{"type": "row_count", "table": "users"}]
+        state_doc, _ = self.verify(checks, missing)
+        self.assertEqual(state_doc.current_state, "verify")
+        self.assertEqual(state_doc.verify_attempts, 1)
+        state_doc.verify_attempts = dbsnap_verify.MAX_VERIFY_ATTEMPTS - 1
+        dbsnap_verify.verify(state_doc, self.rds)
+        self.assertEqual(state_doc.current_state, "alarm")
+
+    def test_table_checksum_across_wakeups(self):
+        checks = [{"type": "table_checksum", "table": "users", "chunk_size": 10}]
+        # planned, but the wakeup ran out of time before hashing a chunk.
+        with mock.patch("dbsnap_verify.checks.run_chunk"), mock.patch(
+            "dbsnap_verify.checks.out_of_time", return_value=True
+        ):
+            state_doc, _ = self.verify(checks, verify_max_seconds=60)
+        self.assertEqual(state_doc.current_state, "verify")
+        checkpoint = state_doc.checkpoint("verify")
+        check = checkpoint["checks"]["table_checksum:users"]
+        self.assertEqual(check["cursor"]["high"], 49)
+        self.assertEqual(check["status"], "pending")
+
+        # the checkpoint survives a save and a load.
+        state_doc = DbsnapVerifyStateDoc(
+            "prod-db", state_doc_path=state_doc.state_doc_path
+        )
+        state_doc.load()
+        with mock.patch.object(dbsnap_verify, "cleanup"):
+            dbsnap_verify.verify(state_doc, self.rds)
+        self.assertEqual(state_doc.current_state, "cleanup")
+        self.assertEqual(len(state_doc.verified_checksums["table_checksum:users"]), 5)
+        # the checksums are not kept twice.
+        self.assertNotIn("verify", state_doc.checkpoints)
+
+    def test_lambda_deadline(self):
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 5000
+        deadline = dbsnap_verify.deadline_from_context(context)
+        self.assertLess(deadline, time.time())
+        self.assertIsNone(dbsnap_verify.deadline_from_context(None))
+
+        # no time left, every check is pending and the checkpoint is saved.
+        checks = [{"type": "row_count", "table": "users"}]
+        with mock.patch.object(DbsnapVerifyStateDoc, "save") as save:
+            state_doc, _ = self.verify(checks, deadline=deadline)
+        self.assertEqual(state_doc.current_state, "verify")
+        self.assertEqual(state_doc.check_results[0]["message"], "out of time")
+        self.assertTrue(save.called)
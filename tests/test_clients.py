@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from dbsnap.clients import get_client, clear_clients
+
+
+class TestClients(unittest.TestCase):
+    def setUp(self):
+        clear_clients()
+        self.addCleanup(clear_clients)
+
+    def test_clients_are_shared(self):
+        rds = get_client("rds", "us-east-1")
+        self.assertIs(get_client("rds", "us-east-1"), rds)
+        self.assertIsNot(get_client("rds", "us-west-2"), rds)
+        self.assertIsNot(get_client("s3", "us-east-1"), rds)
+
+    def test_clients_are_keyed_by_config(self):
+        rds = get_client("rds", "us-east-1", retries={"max_attempts": 3})
+        self.assertIs(get_client("rds", "us-east-1", retries={"max_attempts": 3}), rds)
+        self.assertIsNot(get_client("rds", "us-east-1"), rds)
+        self.assertIsNot(get_client("rds", "us-east-1", max_pool_connections=4), rds)
+
+    def test_pool_size(self):
+        rds = get_client("rds", "us-east-1", max_pool_connections=50)
+        self.assertEqual(rds.meta.config.max_pool_connections, 50)
+        self.assertEqual(rds.meta.region_name, "us-east-1")
+
+
+class TestColdStart(unittest.TestCase):
+    def test_lambda_import_stays_light(self):
+        # a fresh interpreter, other tests already imported everything.
+        script = (
+            "import sys, aws_lambda; "
+            "print(' '.join(m for m in ('boto3', 'concurrent.futures', 'sqlite3') "
+            "if m in sys.modules))"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=root)
+        self.assertEqual(output.decode("utf-8").strip(), "")
@@ -0,0 +1,61 @@
+import unittest
+
+import mock
+
+from dbsnap import get_latest_snapshot
+from dbsnap.copy_job import CopyJob, wait_for_copies
+from dbsnap.testing.fake_aws import FakeAWS
+
+from dbsnap_copy.__main__ import wait_for_copy
+
+
+class TestCopyJob(unittest.TestCase):
+    def setUp(self):
+        # 100GB snapshots take 600 simulated seconds to copy.
+        self.aws = FakeAWS(copy_seconds_per_gb=6)
+        self.rds = self.aws.rds("us-east-1")
+        self.west = self.aws.rds("us-west-2")
+        for i in range(3):
+            self.rds.add_instance("db-{}".format(i), allocated_storage=100)
+            self.rds.add_snapshot("db-{}".format(i))
+
+    def start(self, identifier):
+        source = get_latest_snapshot(self.rds, identifier)
+        return CopyJob.start(
+            source, identifier + "-copy", dest_session=self.west, clock=self.aws.clock
+        )
+
+    def test_wait_for_many_copies(self):
+        jobs = [self.start("db-{}".format(i)) for i in range(3)]
+        pending = wait_for_copies(jobs, sleep=self.aws.advance, clock=self.aws.clock)
+        self.assertEqual(pending, [])
+        for job in jobs:
+            self.assertTrue(job.available)
+            self.assertAlmostEqual(job.throughput, 10.0, delta=2.0)
+        # one describe per poll for all three jobs, and backing off instead
+        # of polling every min_delay seconds.
+        polls = jobs[0].polls
+        self.assertEqual(self.west.calls["describe_db_snapshots"], polls)
+        self.assertLess(polls, 600 / jobs[0].min_delay / 4)
+
+    def test_failed_copy(self):
+        job = self.start("db-0")
+        self.aws.advance(60)
+        self.assertFalse(job.poll())
+        self.assertEqual(job.percent_progress, 10)
+        self.west.fail_snapshot("db-0-copy")
+        self.assertFalse(job.wait(sleep=self.aws.advance))
+        self.assertTrue(job.failed)
+        self.assertIsNone(job.throughput)
+
+        with mock.patch("sys.stdout"):
+            with self.assertRaises(RuntimeError):
+                wait_for_copy(job.source, job, 60)
+
+    def test_timeout(self):
+        job = self.start("db-0")
+        self.assertFalse(job.wait(timeout=120, sleep=self.aws.advance))
+        self.assertFalse(job.done)
+        self.assertGreaterEqual(job.duration, 120)
+        with mock.patch("sys.stdout"):
+            self.assertFalse(wait_for_copy(job.source, job, 0))
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from dbsnap import get_latest_snapshot
+from dbsnap.copy_job import poll_copies
+from dbsnap.copy_scheduler import CopyRequest, CopyScheduler, load_copy_scheduler
+from dbsnap.testing.fake_aws import FakeAWS
+
+from dbsnap_copy.__main__ import main as copy_main
+
+
+class TestCopyScheduler(unittest.TestCase):
+    def setUp(self):
+        # 10GB per database number, 6 simulated seconds per GB.
+        self.aws = FakeAWS(copy_quota=2, copy_seconds_per_gb=6)
+        self.rds = self.aws.rds("us-east-1")
+        self.west = self.aws.rds("us-west-2")
+        self.sessions = {"us-east-1": self.rds, "us-west-2": self.west}
+        self.identifiers = ["db-{}".format(i) for i in range(1, 6)]
+        for i, identifier in enumerate(self.identifiers, 1):
+            self.rds.add_instance(identifier, allocated_storage=10 * i)
+            self.rds.add_snapshot(identifier)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def scheduler(self, **kwargs):
+        return CopyScheduler(clock=self.aws.clock, sleep=self.aws.advance, **kwargs)
+
+    def request(self, identifier):
+        source = get_latest_snapshot(self.rds, identifier)
+        return CopyRequest(
+            identifier + ">us-west-2", source, "us-west-2", identifier + "-copy"
+        )
+
+    def started_order(self, scheduler):
+        jobs = sorted(scheduler.jobs.values(), key=lambda j: j.started)
+        return [j.id.replace("-copy", "") for j in jobs]
+
+    def test_drains_within_the_quota_by_size(self):
+        scheduler = self.scheduler(quota=2, priority="size")
+        for identifier in self.identifiers:
+            self.assertTrue(scheduler.submit(self.request(identifier)))
+        self.assertEqual(scheduler.run(self.sessions), [])
+        self.assertEqual(scheduler.quota_errors, 0)
+        self.assertEqual(len(scheduler.jobs), 5)
+        self.assertEqual(self.started_order(scheduler)[:2], ["db-5", "db-4"])
+        # the same snapshot is not copied twice while in flight.
+        self.assertFalse(scheduler.submit(self.request("db-1")))
+
+    def test_age_priority_and_quota_errors(self):
+        # copies of someone else's fill one of the two slots.
+        self.rds.add_instance("other", allocated_storage=100)
+        self.rds.add_snapshot("other")
+        get_latest_snapshot(self.rds, "other").copy(
+            "other-copy", dest_session=self.west
+        )
+
+        scheduler = self.scheduler(quota=2)
+        scheduler.last_copied = {"db-1>us-west-2": 100, "db-2>us-west-2": 50}
+        for identifier in self.identifiers:
+            scheduler.submit(self.request(identifier))
+        self.assertEqual(scheduler.run(self.sessions), [])
+        self.assertGreater(scheduler.quota_errors, 0)
+        self.assertEqual(scheduler.errors, {})
+        self.assertEqual(
+            self.started_order(scheduler), ["db-3", "db-4", "db-5", "db-2", "db-1"]
+        )
+
+    def test_resume_saved_queue(self):
+        location = os.path.join(self.tmp, "queue.json")
+        scheduler = self.scheduler(quota=2, location=location)
+        for identifier in self.identifiers:
+            scheduler.submit(self.request(identifier))
+        queued = scheduler.run(self.sessions, timeout=0)
+        self.assertEqual(len(queued), 3)
+        scheduler.save()
+
+        resumed = load_copy_scheduler(
+            location, clock=self.aws.clock, sleep=self.aws.advance, quota=2
+        )
+        self.assertEqual(len(resumed.queue), 3)
+        self.assertEqual(len(resumed.in_flight), 2)
+        self.assertEqual(resumed.run(self.sessions), [])
+        self.assertEqual(resumed.quota_errors, 0)
+        self.assertEqual(len(self.west.snapshots), 5)
+
+    def test_run_frees_finished_copies(self):
+        scheduler = self.scheduler(quota=2)
+        for identifier in self.identifiers[:2]:
+            scheduler.submit(self.request(identifier))
+        self.assertEqual(scheduler.run(self.sessions), [])
+        self.assertEqual(len(scheduler.in_flight), 2)
+        self.aws.advance(3600)
+        scheduler.run(self.sessions)
+        self.assertEqual(scheduler.in_flight, {})
+        self.assertEqual(
+            sorted(scheduler.last_copied), ["db-1>us-west-2", "db-2>us-west-2"]
+        )
+
+    def test_dbsnap_copy_saves_finished_copies(self):
+        location = os.path.join(self.tmp, "queue.json")
+        argv = ["us-east-1:" + i for i in self.identifiers]
+        argv += ["-d", "us-west-2:", "--copy-quota", "2", "--copy-queue", location]
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+
+        def wait_for_copies(jobs, timeout=None):
+            self.aws.advance(3600)
+            poll_copies(jobs)
+
+        with mock.patch("sys.stdout"), mock.patch(
+            "dbsnap_copy.__main__.wait_for_copies", wait_for_copies
+        ), mock.patch("dbsnap_copy.__main__.prune_source", return_value=None):
+            copy_main(argv + ["--prune-old", "2", "--copy-timeout", "0"])
+        saved = load_copy_scheduler(location)
+        self.assertEqual(len(saved.queue), 3)
+        self.assertEqual(saved.in_flight, {})
+        self.assertEqual(len(saved.last_copied), 2)
+
+    def test_dbsnap_copy_leaves_a_queue(self):
+        location = os.path.join(self.tmp, "queue.json")
+        argv = ["us-east-1:" + i for i in self.identifiers]
+        argv += ["-d", "us-west-2:", "--copy-quota", "2", "--copy-queue", location]
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+        with mock.patch("sys.stdout"):
+            copy_main(argv + ["--copy-timeout", "0"])
+        self.assertEqual(self.aws.calls["copy_db_snapshot"], 2)
+        self.assertEqual(len(load_copy_scheduler(location).queue), 3)
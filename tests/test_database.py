@@ -1,5 +1,10 @@
+from datetime import datetime
+
+import mock
+
 from test_helper import TestHelper
 from dbsnap.database import Database
+from dbsnap.utils import datetime_to_timestamp
 
 
 class TestDatabase(TestHelper):
@@ -34,3 +39,150 @@ class TestDatabase(TestHelper):
         session = self._magic_rds_session()
         with self.assertRaises(LookupError):
             Database(session=session, description=self.db_instance_desc_3)
+
+    def test_database_kind_is_remembered(self):
+        session = self._magic_rds_session()
+        session.describe_db_instances.return_value = {"DBInstances": []}
+        session.describe_db_clusters.return_value = {
+            "DBClusters": [
+                {
+                    "DBClusterIdentifier": "cluster1",
+                    "DBClusterArn": "arn:c1",
+                    "Status": "available",
+                    "Engine": "aurora-postgresql",
+                    "EngineVersion": "9.6.6",
+                    "DBClusterMembers": [],
+                }
+            ]
+        }
+        database = Database(session=session, identifier="cluster1")
+        self.assertTrue(database.is_cluster)
+        self.assertEqual(database.kind, "cluster")
+        self.assertEqual(session.describe_db_instances.call_count, 1)
+
+        database = Database(session=session, identifier="cluster1")
+        self.assertEqual(database.id, "cluster1")
+        # the second lookup goes straight to the cluster.
+        self.assertEqual(session.describe_db_instances.call_count, 1)
+        self.assertEqual(session.describe_db_clusters.call_count, 2)
+        session.describe_db_clusters.assert_called_with(
+            Filters=[{"Name": "db-cluster-id", "Values": ["cluster1"]}]
+        )
+
+    def test_database_kind_hint(self):
+        session = self._magic_rds_session()
+        session.describe_db_clusters.return_value = {"DBClusters": []}
+        database = Database(session=session, identifier="cluster1", kind="cluster")
+        self.assertFalse(database)
+        session.describe_db_instances.assert_not_called()
+
+    def test_cluster_members_in_one_call(self):
+        session = self._magic_rds_session()
+        cluster = Database(
+            session=session,
+            description={
+                "DBClusterIdentifier": "cluster1",
+                "DBClusterArn": "arn:c1",
+                "Status": "available",
+                "Engine": "aurora-postgresql",
+                "EngineVersion": "9.6.6",
+                "DBClusterMembers": [
+                    {"DBInstanceIdentifier": "member2"},
+                    {"DBInstanceIdentifier": "member1"},
+                ],
+            },
+        )
+        session.describe_db_instances.return_value = {
+            "DBInstances": [
+                {
+                    "DBInstanceIdentifier": member_id,
+                    "DBInstanceStatus": "available",
+                    "DBInstanceArn": "arn:" + member_id,
+                    "Engine": "aurora-postgresql",
+                    "EngineVersion": "9.6.6",
+                }
+                for member_id in ("member1", "member2")
+            ]
+        }
+        members = cluster.cluster_members
+        self.assertEqual([m.id for m in members], ["member2", "member1"])
+        session.describe_db_instances.assert_called_once_with(
+            Filters=[{"Name": "db-cluster-id", "Values": ["cluster1"]}]
+        )
+
+    def _events(self, *messages_and_minutes):
+        return [
+            {"Message": message, "Date": datetime(2018, 3, 5, 18, minute)}
+            for message, minute in messages_and_minutes
+        ]
+
+    def test_get_events_pages_and_source_type(self):
+        session = self._magic_rds_session()
+        database = Database(
+            session=session, description=self.db_instance_desc_1["DBInstances"][0]
+        )
+        session.describe_events.side_effect = [
+            {"Events": self._events(("a", 1), ("b", 2)), "Marker": "page-2"},
+            {"Events": self._events(("c", 3))},
+        ]
+        events = database.get_events()
+        self.assertEqual([e["Message"] for e in events], ["a", "b", "c"])
+        calls = session.describe_events.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0][1]["SourceType"], "db-instance")
+        self.assertEqual(calls[0][1]["Duration"], 1440)
+        self.assertEqual(calls[1][1]["Marker"], "page-2")
+        self.assertEqual(
+            database.events_seen_until,
+            datetime_to_timestamp(datetime(2018, 3, 5, 18, 3)),
+        )
+
+    def test_get_events_since(self):
+        session = self._magic_rds_session()
+        database = Database(
+            session=session, description=self.db_instance_desc_1["DBInstances"][0]
+        )
+        since = datetime_to_timestamp(datetime(2018, 3, 5, 18, 2))
+        session.describe_events.return_value = {
+            "Events": self._events(("b", 2), ("c", 3))
+        }
+        events = database.get_events(since=since)
+        self.assertEqual([e["Message"] for e in events], ["c"])
+        args = session.describe_events.call_args[1]
+        self.assertEqual(args["StartTime"], datetime(2018, 3, 5, 18, 2))
+        self.assertNotIn("Duration", args)
+
+    def test_wait_for_event(self):
+        session = self._magic_rds_session()
+        database = Database(
+            session=session, description=self.db_instance_desc_1["DBInstances"][0]
+        )
+        session.describe_events.side_effect = [
+            {"Events": self._events(("Backing up DB instance", 1))},
+            {"Events": self._events(("Reset master credentials", 2))},
+        ]
+        clock = mock.Mock(return_value=0)
+        sleep = mock.Mock()
+        event = database.wait_for_event(
+            lambda e: e["Message"] == "Reset master credentials",
+            timeout=60,
+            interval=30,
+            sleep=sleep,
+            clock=clock,
+        )
+        self.assertEqual(event["Message"], "Reset master credentials")
+        sleep.assert_called_once_with(30)
+        # the second poll only asks for events newer than the first.
+        self.assertEqual(
+            session.describe_events.call_args[1]["StartTime"],
+            datetime(2018, 3, 5, 18, 1),
+        )
+
+    def test_wait_for_event_gives_up(self):
+        session = self._magic_rds_session()
+        database = Database(
+            session=session, description=self.db_instance_desc_1["DBInstances"][0]
+        )
+        session.describe_events.return_value = {"Events": []}
+        self.assertEqual(database.wait_for_event(lambda e: True), None)
+        self.assertEqual(session.describe_events.call_count, 1)
@@ -9,8 +9,12 @@ from dbsnap_copy import (
     Dest,
     parse_source,
     parse_destination,
+    parse_manifest,
     sanitize_snapshot_name,
     get_snapshot_target_name,
+    account_id_stats,
+    get_account_id,
+    forget_account_id,
 )
 
 
@@ -75,3 +79,110 @@ class TestDbSnapcopy(unittest.TestCase):
         self.assertEqual(r, "my-snap")
         r = get_snapshot_target_name(Dest("us-east-1", ""), "source", "us-east-1", now)
         self.assertEqual(r, "source-copy-us-east-1-19700101T000000Z")
+
+    def test_get_account_id_is_memoized(self):
+        forget_account_id()
+        self.addCleanup(forget_account_id)
+        sts = mock.MagicMock()
+        sts.get_caller_identity.return_value = {"Account": "00123456789"}
+        self.assertEqual(get_account_id(sts), "00123456789")
+        self.assertEqual(get_account_id(), "00123456789")
+        self.assertEqual(sts.get_caller_identity.call_count, 1)
+        stats = account_id_stats()
+        self.assertEqual((stats["requests"], stats["lookups"]), (2, 1))
+        forget_account_id()
+        self.assertEqual(account_id_stats()["lookups"], 0)
+
+    def test_get_account_id_uses_the_shared_client(self):
+        forget_account_id()
+        self.addCleanup(forget_account_id)
+        with mock.patch("dbsnap_copy.get_client") as get_client:
+            get_client.return_value.get_caller_identity.return_value = {"Account": "1"}
+            self.assertEqual(get_account_id(), "1")
+        get_client.assert_called_once_with("sts")
+
+    def test_parse_manifest(self):
+        manifest = [
+            "# fleet manifest",
+            "us-east-1:db-1",
+            "",
+            "us-east-1:db-2 us-west-2:  # to another region",
+            "us-west-1:db-3 :named-copy",
+        ]
+        pairs = parse_manifest(manifest, default_dest="us-west-1:")
+        self.assertEqual(
+            pairs,
+            [
+                (Source("us-east-1", "db-1"), Dest("us-west-1", None)),
+                (Source("us-east-1", "db-2"), Dest("us-west-2", None)),
+                (Source("us-west-1", "db-3"), Dest("us-west-1", "named-copy")),
+            ],
+        )
+
+    def test_invalid_parse_manifest(self):
+        with self.assertRaises(ValueError):
+            parse_manifest(["us-east-1:db-1 us-west-2: extra"])
+        with self.assertRaises(ValueError):
+            parse_manifest(["db-1"])
+
+
+def fake_snapshot_description(db_id, region):
+    return {
+        "DBSnapshotIdentifier": "rds:{}-2018-06-02".format(db_id),
+        "DBSnapshotArn": "arn:aws:rds:{}:1:snapshot:rds:{}".format(region, db_id),
+        "Engine": "postgres",
+        "EngineVersion": "9.6.6",
+        "Status": "available",
+        "SnapshotType": "automated",
+        "SnapshotCreateTime": datetime(2018, 6, 2),
+    }
+
+
+class TestDbSnapCopyMain(unittest.TestCase):
+    def setUp(self):
+        self.clients = {}
+
+        def fake_client(service, region_name=None, **kwargs):
+            if region_name in self.clients:
+                return self.clients[region_name][0]
+            client = mock.MagicMock()
+
+            def describe_db_snapshots(DBInstanceIdentifier, **kwargs):
+                if DBInstanceIdentifier == "broken-db":
+                    raise RuntimeError("boom")
+                return {
+                    "DBSnapshots": [
+                        fake_snapshot_description(DBInstanceIdentifier, region_name)
+                    ]
+                }
+
+            def copy_db_snapshot(TargetDBSnapshotIdentifier, **kwargs):
+                description = fake_snapshot_description("copy", region_name)
+                description["DBSnapshotIdentifier"] = TargetDBSnapshotIdentifier
+                description["Status"] = "creating"
+                return {"DBSnapshot": description}
+
+            client.describe_db_snapshots.side_effect = describe_db_snapshots
+            client.copy_db_snapshot.side_effect = copy_db_snapshot
+            self.clients.setdefault(region_name, []).append(client)
+            return client
+
+        patcher = mock.patch("dbsnap_copy.__main__.get_client", fake_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_many_sources_share_region_clients(self):
+        from dbsnap_copy.__main__ import main
+
+        main(["us-east-1:db-1", "us-east-1:db-2", "-d", "us-west-2:"])
+        self.assertEqual(set(self.clients), {"us-east-1", "us-west-2"})
+        self.assertEqual(len(self.clients["us-east-1"]), 1)
+        self.assertEqual(len(self.clients["us-west-2"]), 1)
+        self.assertEqual(self.clients["us-west-2"][0].copy_db_snapshot.call_count, 2)
+
+    def test_failed_source_does_not_stop_the_others(self):
+        from dbsnap_copy.__main__ import main
+
+        with self.assertRaises(SystemExit):
+            main(["us-east-1:broken-db", "us-east-1:db-1"])
+        self.assertEqual(self.clients["us-east-1"][0].copy_db_snapshot.call_count, 1)
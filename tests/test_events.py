@@ -0,0 +1,128 @@
+import unittest
+
+import mock
+
+from dbsnap.identifier_index import CLUSTER, INSTANCE
+from dbsnap_verify import handle_rds_event, cycle_seconds
+from dbsnap_verify.events import (
+    classify_event_message,
+    get_event_action,
+    CREDENTIALS_RESET,
+    DELETED,
+    RESTORED,
+)
+from dbsnap_verify.state_doc import DbsnapVerifyStateDoc
+
+mock_none = mock.Mock(return_value=None)
+
+
+def rds_event(message, source_id="dbsv-test-db"):
+    return {
+        "source_id": source_id,
+        "source_type": "db-instance",
+        "message": message,
+        "time": "2018-03-05 18:22:14.893",
+    }
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "dbsnap_verify.state_doc.StateDoc._save_state_doc_in_s3", mock_none
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.state_doc = DbsnapVerifyStateDoc(
+            database="test-db",
+            state_doc_bucket="bucket-to-hold-state-documents",
+            snapshot_region="us-east-1",
+            event_driven=True,
+        )
+        self.state_doc.transition_state("wait", validate=False)
+
+    def test_classify_event_message(self):
+        self.assertEqual(
+            classify_event_message("Restored from snapshot rds:test-db-2018"),
+            RESTORED,
+        )
+        self.assertEqual(
+            classify_event_message("Reset master credentials"), CREDENTIALS_RESET
+        )
+        self.assertEqual(classify_event_message("DB cluster deleted"), DELETED)
+        self.assertEqual(classify_event_message("Backing up DB instance"), None)
+        self.assertEqual(classify_event_message(None), None)
+
+    def test_no_event_is_ambiguous(self):
+        self.assertEqual(get_event_action(self.state_doc), None)
+
+    def test_events_are_ignored_while_waiting(self):
+        self.state_doc.rds_event = rds_event("Reset master credentials")
+        self.assertEqual(get_event_action(self.state_doc), "ignore")
+
+    def test_credentials_reset_verifies_without_describe(self):
+        self.state_doc.transition_state("restore")
+        self.state_doc.transition_state("modify")
+        self.state_doc.tmp_password = "secret"
+        self.state_doc.rds_event = rds_event("Reset master credentials")
+        rds_session = mock.MagicMock()
+        # cleanup describes the temporary database which is still there.
+        with mock.patch("dbsnap_verify.cleanup") as cleanup:
+            self.assertTrue(handle_rds_event(self.state_doc, rds_session))
+        self.assertEqual(self.state_doc.current_state, "cleanup")
+        cleanup.assert_called_once_with(self.state_doc, rds_session)
+        rds_session.describe_db_instances.assert_not_called()
+        rds_session.describe_events.assert_not_called()
+
+    def test_restored_instance_modifies_without_waiting(self):
+        self.state_doc.transition_state("restore")
+        self.state_doc.tmp_database_kind = INSTANCE
+        self.state_doc.rds_event = rds_event("Restored from snapshot")
+        rds_session = mock.MagicMock()
+        with mock.patch("dbsnap_verify.modify") as modify:
+            self.assertTrue(handle_rds_event(self.state_doc, rds_session))
+        self.assertEqual(self.state_doc.current_state, "modify")
+        modify.assert_called_once_with(self.state_doc, rds_session, None)
+
+    def test_restored_cluster_waits_for_its_member_instance(self):
+        self.state_doc.transition_state("restore")
+        self.state_doc.tmp_database_kind = CLUSTER
+        self.state_doc.rds_event = rds_event("Restored from snapshot")
+        self.assertEqual(get_event_action(self.state_doc), None)
+        self.state_doc.rds_event = rds_event(
+            "DB instance created", source_id="i-dbsv-test-db"
+        )
+        self.assertEqual(get_event_action(self.state_doc), "modify")
+
+    def test_credentials_reset_we_did_not_ask_for_is_ambiguous(self):
+        self.state_doc.transition_state("restore")
+        self.state_doc.transition_state("modify")
+        self.state_doc.rds_event = rds_event("Reset master credentials")
+        self.assertEqual(get_event_action(self.state_doc), None)
+
+    def test_deleted_cleans_up_and_reports_cycle_time(self):
+        self.state_doc.transition_state("restore")
+        self.state_doc.states[-1]["timestamp"] -= 3600
+        self.state_doc.transition_state("modify")
+        self.state_doc.transition_state("verify")
+        self.state_doc.transition_state("cleanup")
+        self.assertGreaterEqual(cycle_seconds(self.state_doc), 3600)
+
+        self.state_doc.rds_event = rds_event("DB instance deleted")
+        rds_session = mock.MagicMock()
+        self.assertTrue(handle_rds_event(self.state_doc, rds_session))
+        self.assertEqual(self.state_doc.current_state, "wait")
+        self.assertGreaterEqual(self.state_doc.last_cycle_seconds, 3600)
+        rds_session.delete_db_subnet_group.assert_called_once_with(
+            DBSubnetGroupName="dbsv-test-db"
+        )
+        rds_session.describe_db_instances.assert_not_called()
+
+    def test_cluster_member_deleted_is_ambiguous(self):
+        self.state_doc.transition_state("restore")
+        self.state_doc.transition_state("modify")
+        self.state_doc.transition_state("verify")
+        self.state_doc.transition_state("cleanup")
+        self.state_doc.rds_event = rds_event(
+            "DB instance deleted", source_id="i-dbsv-test-db"
+        )
+        self.assertEqual(get_event_action(self.state_doc), None)
@@ -0,0 +1,162 @@
+import time
+import unittest
+
+import mock
+
+from dbsnap import get_latest_snapshot, get_available_snapshots
+from dbsnap.clients import get_client
+from dbsnap.database import Database
+from dbsnap.testing.fake_aws import EPOCH, FakeAWS, SimulatedClock
+from dbsnap.utils import paginate
+
+from dbsnap_copy.__main__ import main as copy_main
+
+import dbsnap_verify
+from dbsnap_verify.state_doc import DbsnapVerifyStateDoc
+
+VERIFY_EVENT = {
+    "database": "prod-db",
+    "state_doc_bucket": "state-docs",
+    "snapshot_region": "us-east-1",
+    "database_subnet_ids": "subnet-1111,subnet-2222",
+    "database_security_group_ids": "sg-0123456789",
+}
+
+
+class TestFakeAWS(unittest.TestCase):
+    def setUp(self):
+        self.aws = FakeAWS()
+        self.rds = self.aws.rds("us-east-1")
+        self.rds.add_instance("prod-db", allocated_storage=50)
+        self.rds.add_snapshot("prod-db", count=45)
+
+    def test_pagination(self):
+        pages = []
+        marker = None
+        while True:
+            kwargs = {"MaxRecords": 20}
+            if marker:
+                kwargs["Marker"] = marker
+            response = self.rds.describe_db_snapshots(**kwargs)
+            pages.append(len(response["DBSnapshots"]))
+            marker = response.get("Marker")
+            if not marker:
+                break
+        self.assertEqual(pages, [20, 20, 5])
+        self.assertEqual(self.rds.calls["describe_db_snapshots"], 3)
+        all_snapshots = list(
+            paginate(self.rds.describe_db_snapshots, "DBSnapshots", MaxRecords=100)
+        )
+        self.assertEqual(len(all_snapshots), 45)
+
+    def test_latest_snapshot(self):
+        snapshots = get_available_snapshots(self.rds, "prod-db")
+        latest = get_latest_snapshot(self.rds, "prod-db")
+        self.assertEqual(latest.id, snapshots[-1].id)
+        self.assertEqual(latest.engine, "postgres")
+
+    def test_throttling(self):
+        self.rds.throttle(2)
+        for _ in range(2):
+            with self.assertRaises(self.rds.exceptions.ThrottlingException) as e:
+                self.rds.describe_db_instances()
+            self.assertEqual(e.exception.response["Error"]["Code"], "Throttling")
+        self.rds.describe_db_instances()
+        self.assertEqual(self.rds.calls["throttled"], 2)
+
+    def test_not_found(self):
+        with self.assertRaises(self.rds.exceptions.DBInstanceNotFoundFault):
+            self.rds.describe_db_instances(DBInstanceIdentifier="nope")
+        self.assertFalse(Database(identifier="nope", session=self.rds))
+
+    def test_cross_region_copy_takes_time(self):
+        west = self.aws.rds("us-west-2")
+        latest = get_latest_snapshot(self.rds, "prod-db")
+        copy = latest.copy("prod-db-copy", dest_session=west)
+        self.assertEqual(copy.status, "creating")
+        self.aws.advance(150)
+        record = west.describe_db_snapshots(DBSnapshotIdentifier="prod-db-copy")[
+            "DBSnapshots"
+        ][0]
+        self.assertEqual(record["Status"], "creating")
+        self.assertEqual(record["PercentProgress"], 50)
+        self.aws.advance(150)
+        self.assertEqual(get_latest_snapshot(west, "prod-db").id, "prod-db-copy")
+
+    def test_copy_quota(self):
+        self.aws.copy_quota = 1
+        latest = get_latest_snapshot(self.rds, "prod-db")
+        latest.copy("copy-1")
+        with self.assertRaises(self.rds.exceptions.SnapshotQuotaExceededFault):
+            latest.copy("copy-2")
+
+    def test_s3_conditional_put(self):
+        s3 = self.aws.s3
+        etag = s3.put_object(Bucket="b", Key="k", Body="one")["ETag"]
+        with self.assertRaises(s3.exceptions.PreconditionFailed):
+            s3.put_object(Bucket="b", Key="k", Body="two", IfNoneMatch="*")
+        s3.put_object(Bucket="b", Key="k", Body="two", IfMatch=etag)
+        with self.assertRaises(s3.exceptions.PreconditionFailed):
+            s3.put_object(Bucket="b", Key="k", Body="three", IfMatch=etag)
+        self.assertEqual(s3.get_object(Bucket="b", Key="k")["Body"].read(), b"two")
+        with self.assertRaises(s3.exceptions.NoSuchKey):
+            s3.get_object(Bucket="b", Key="missing")
+
+
+class TestSimulatedClock(unittest.TestCase):
+    def test_starts_now(self):
+        self.assertLess(abs(SimulatedClock()() - time.time()), 5)
+
+    def test_fixed_start(self):
+        clock = SimulatedClock(EPOCH)
+        clock.advance(60)
+        self.assertEqual(clock(), EPOCH + 60)
+
+
+class TestFakeAWSEndToEnd(unittest.TestCase):
+    def setUp(self):
+        # the default clock starts now, as dbsnap-verify compares RDS event
+        # dates with the real time.
+        self.aws = FakeAWS(copy_seconds_per_gb=0)
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+        self.rds = self.aws.rds("us-east-1")
+
+    def test_get_client_returns_fakes(self):
+        self.assertIs(get_client("rds", "us-east-1"), self.rds)
+        self.assertIs(get_client("s3"), self.aws.s3)
+
+    def test_dbsnap_copy(self):
+        self.rds.add_instance("prod-db")
+        self.rds.add_snapshot("prod-db", count=3)
+        with mock.patch("sys.stdout"):
+            copy_main(["us-east-1:prod-db", "-d", "us-west-2:", "--prune-old", "2"])
+        west = self.aws.rds("us-west-2")
+        self.assertEqual(len(west.snapshots), 1)
+        self.assertEqual(self.aws.calls["copy_db_snapshot"], 1)
+
+    def verify_wakeup(self, minutes=5):
+        self.aws.advance(minutes * 60)
+        dbsnap_verify.handler(dict(VERIFY_EVENT))
+        state_doc = DbsnapVerifyStateDoc(**VERIFY_EVENT)
+        state_doc.load()
+        return state_doc
+
+    def test_dbsnap_verify_cycle(self):
+        self.rds.add_instance("prod-db")
+        self.rds.add_snapshot("prod-db", count=2)
+        latest = get_latest_snapshot(self.rds, "prod-db")
+
+        seen = []
+        state_doc = self.verify_wakeup(0)
+        for _ in range(20):
+            seen.append(state_doc.current_state)
+            if state_doc.current_state == "wait" and len(seen) > 1:
+                break
+            state_doc = self.verify_wakeup()
+
+        self.assertEqual(state_doc.snapshot_verified, latest.id)
+        self.assertIn("modify", seen)
+        self.assertIn("cleanup", seen)
+        self.assertEqual(self.rds.subnet_groups, {})
+        self.assertEqual(sorted(self.rds.instances), ["prod-db"])
@@ -0,0 +1,118 @@
+import unittest
+
+import mock
+
+from dbsnap_verify import handler
+from dbsnap_verify.fleet import RestoreSlots, get_database_configs
+from dbsnap_verify.state_doc import DbsnapVerifyStateDoc, StateDocConflict
+
+mock_none = mock.Mock(return_value=None)
+
+FLEET_EVENT = {
+    "state_doc_bucket": "bucket-to-hold-state-documents",
+    "snapshot_region": "us-east-1",
+    "database_subnet_ids": "subnet-1111",
+    "database_security_group_ids": "sg-0123456789",
+    "max_concurrent_restores": 2,
+    "databases": [
+        "db-1",
+        "db-2",
+        {"database": "db-3", "snapshot_region": "us-west-2"},
+        "db-4",
+    ],
+}
+
+
+class TestFleet(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "dbsnap_verify.state_doc.StateDoc._save_state_doc_in_s3", mock_none
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_database_configs(self):
+        configs = get_database_configs(FLEET_EVENT)
+        self.assertEqual(
+            [c["database"] for c in configs], ["db-1", "db-2", "db-3", "db-4"]
+        )
+        self.assertEqual(configs[0]["snapshot_region"], "us-east-1")
+        self.assertEqual(configs[2]["snapshot_region"], "us-west-2")
+        self.assertEqual(
+            configs[1]["state_doc_bucket"], "bucket-to-hold-state-documents"
+        )
+        for config in configs:
+            self.assertNotIn("databases", config)
+            self.assertNotIn("max_concurrent_restores", config)
+
+    def test_restore_slots(self):
+        slots = RestoreSlots(2, in_use=1)
+        self.assertTrue(slots.acquire())
+        self.assertFalse(slots.acquire())
+
+    def state_doc(self, config):
+        state_doc = DbsnapVerifyStateDoc(**config)
+        state_doc.transition_state("wait", validate=False)
+        if config["database"] == "db-4":
+            # db-4 already has a temporary database being modified.
+            state_doc.transition_state("restore")
+            state_doc.transition_state("modify")
+            state_doc.tmp_password = "secret"
+        return state_doc
+
+    @mock.patch("dbsnap_verify.restore")
+    @mock.patch("dbsnap_verify.get_client")
+    @mock.patch("dbsnap_verify.get_latest_snapshot")
+    def test_fleet_respects_restore_cap(self, get_latest_snapshot, get_client, restore):
+        get_latest_snapshot.return_value = mock.Mock(id="rds:new-snapshot")
+        modify = mock.Mock()
+        with mock.patch.dict("dbsnap_verify.state_handlers", modify=modify), mock.patch(
+            "dbsnap_verify.fleet.get_or_create_state_doc", side_effect=self.state_doc
+        ):
+            results = handler(FLEET_EVENT)
+
+        after = {r["database"]: r["after"] for r in results}
+        self.assertEqual(after["db-4"], "modify")
+        # one slot was taken by db-4, so only one of the waiting databases restores.
+        self.assertEqual(
+            sorted(after[db] for db in ("db-1", "db-2", "db-3")),
+            ["restore", "wait", "wait"],
+        )
+        self.assertEqual(restore.call_count, 1)
+        self.assertEqual(modify.call_count, 1)
+        regions = set(c[0][1] for c in get_client.call_args_list)
+        self.assertEqual(regions, {"us-east-1", "us-west-2"})
+
+    @mock.patch("dbsnap_verify.get_client")
+    @mock.patch("dbsnap_verify.get_latest_snapshot")
+    def test_fleet_isolates_errors(self, get_latest_snapshot, get_client):
+        get_latest_snapshot.side_effect = ValueError("No available snapshots")
+        event = dict(FLEET_EVENT, databases=["db-1", "db-2"])
+        with mock.patch(
+            "dbsnap_verify.fleet.get_or_create_state_doc", side_effect=self.state_doc
+        ):
+            results = handler(event)
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIn("No available snapshots", result["error"])
+
+    @mock.patch("dbsnap_verify.get_client")
+    @mock.patch("dbsnap_verify.get_latest_snapshot")
+    def test_fleet_skips_conflicts(self, get_latest_snapshot, get_client):
+        get_latest_snapshot.side_effect = StateDocConflict("state-doc-db-1.json")
+        event = dict(FLEET_EVENT, databases=["db-1"])
+        with mock.patch(
+            "dbsnap_verify.fleet.get_or_create_state_doc", side_effect=self.state_doc
+        ):
+            results = handler(event)
+        self.assertEqual(
+            results,
+            [{"database": "db-1", "before": "wait", "after": "wait", "error": None}],
+        )
+
+    def test_handler_skips_conflicts(self):
+        with mock.patch("dbsnap_verify.get_or_create_state_doc"), mock.patch(
+            "dbsnap_verify.advance", side_effect=StateDocConflict("state-doc-db-1.json")
+        ) as advance:
+            self.assertIsNone(handler({"database": "db-1"}))
+        self.assertTrue(advance.called)
@@ -0,0 +1,71 @@
+import unittest
+
+import mock
+from botocore.exceptions import ClientError
+
+from dbsnap.prune import prune_snapshots, delete_snapshot_with_backoff
+from dbsnap.rate_limit import LimitedClient
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "DeleteDBSnapshot")
+
+
+def fake_snapshot(snapshot_id, status="available", side_effect=None):
+    snapshot = mock.MagicMock()
+    snapshot.id = snapshot_id
+    snapshot.status = status
+    snapshot.delete.side_effect = side_effect
+    return snapshot
+
+
+class TestPrune(unittest.TestCase):
+    def test_prune_counts(self):
+        snapshots = [
+            fake_snapshot("ok-1"),
+            fake_snapshot("ok-2"),
+            fake_snapshot("creating", status="creating"),
+            fake_snapshot("gone", side_effect=client_error("DBSnapshotNotFound")),
+            fake_snapshot("broken", side_effect=client_error("InvalidDBSnapshotState")),
+        ]
+        result = prune_snapshots(snapshots, max_workers=3, sleep=mock.Mock())
+        self.assertEqual(sorted(s.id for s in result.deleted), ["ok-1", "ok-2"])
+        self.assertEqual([s.id for s, e in result.failed], ["broken"])
+        self.assertEqual(sorted(s.id for s in result.skipped), ["creating", "gone"])
+        stats = result.stats
+        self.assertEqual(
+            (stats["deleted"], stats["failed"], stats["skipped"]), (2, 1, 2)
+        )
+        self.assertIn("latency_max", stats)
+        snapshots[2].delete.assert_not_called()
+
+    def test_dry_run_skips_everything(self):
+        snapshots = [fake_snapshot("ok-1"), fake_snapshot("ok-2")]
+        result = prune_snapshots(snapshots, dry_run=True)
+        self.assertEqual(result.stats["skipped"], 2)
+        for snapshot in snapshots:
+            snapshot.delete.assert_not_called()
+
+    def test_throttled_delete_is_retried(self):
+        sleep = mock.Mock()
+        throttled = client_error("Throttling")
+        snapshot = fake_snapshot("throttled", side_effect=[throttled, throttled, None])
+        delete_snapshot_with_backoff(snapshot, base_delay=1, max_delay=2, sleep=sleep)
+        self.assertEqual(snapshot.delete.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        for call in sleep.call_args_list:
+            self.assertLessEqual(call[0][0], 2)
+
+    def test_throttled_delete_gives_up(self):
+        snapshot = fake_snapshot("throttled", side_effect=client_error("Throttling"))
+        result = prune_snapshots([snapshot], max_attempts=3, sleep=mock.Mock())
+        self.assertEqual(result.stats["failed"], 1)
+        self.assertEqual(snapshot.delete.call_count, 3)
+
+    def test_rate_limited_client_retries_alone(self):
+        # the LimitedClient of the session retries, prune does not on top.
+        snapshot = fake_snapshot("throttled", side_effect=client_error("Throttling"))
+        snapshot.session = LimitedClient(mock.MagicMock(), "us-east-1")
+        result = prune_snapshots([snapshot], max_attempts=3, sleep=mock.Mock())
+        self.assertEqual(result.stats["failed"], 1)
+        self.assertEqual(snapshot.delete.call_count, 1)
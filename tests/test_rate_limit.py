@@ -0,0 +1,141 @@
+import unittest
+
+import mock
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from dbsnap import get_available_snapshots
+from dbsnap.testing.fake_aws import FakeAWS, SimulatedClock
+from dbsnap.rate_limit import (
+    RetryBudget,
+    TokenBucket,
+    api_family,
+    get_bucket,
+    limit_client,
+    rate_limit_stats,
+    reset_rate_limits,
+)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.bucket = TokenBucket(
+            burst=1, max_rate=10.0, clock=self.clock, sleep=self.clock.advance
+        )
+
+    def test_unlimited_until_throttled(self):
+        for _ in range(20):
+            self.assertEqual(self.bucket.acquire(), 0)
+            self.clock.advance(0.05)
+        self.assertIsNone(self.bucket.rate)
+
+        # throttled at the observed 20 calls/s, capped at max_rate, halved.
+        self.bucket.on_throttle()
+        self.assertEqual(self.bucket.rate, 5.0)
+        self.assertAlmostEqual(self.bucket.acquire(), 0.2)
+        stats = self.bucket.stats
+        self.assertEqual(stats["throttles"], 1)
+        self.assertEqual(stats["requests"], 21)
+        self.assertAlmostEqual(stats["throttle_rate"], 1 / 21.0)
+        self.assertEqual(stats["wait_seconds"], 0.2)
+
+    def test_recovers_without_throttles(self):
+        self.bucket.on_throttle()
+        self.bucket.on_throttle()
+        self.assertEqual(self.bucket.rate, 2.5)
+        self.clock.advance(5)
+        self.bucket.acquire()
+        self.assertAlmostEqual(self.bucket.rate, 7.5)
+        self.clock.advance(5)
+        self.bucket.acquire()
+        self.assertIsNone(self.bucket.rate)
+
+    def test_min_rate(self):
+        for _ in range(20):
+            self.bucket.on_throttle()
+        self.assertEqual(self.bucket.rate, self.bucket.min_rate)
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_retries_are_a_fraction_of_calls(self):
+        budget = RetryBudget(ratio=0.5, min_tokens=1, max_tokens=2)
+        self.assertTrue(budget.try_retry())
+        self.assertFalse(budget.try_retry())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.try_retry())
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.tokens, 2)
+        self.assertEqual(budget.stats, {"retries": 2, "exhausted": 1, "tokens": 2})
+
+
+class TestLimitedClient(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        reset_rate_limits(clock=self.clock, sleep=self.clock.advance)
+        self.addCleanup(reset_rate_limits)
+        self.aws = FakeAWS(clock=self.clock)
+        self.rds = self.aws.rds("us-east-1")
+        self.rds.add_instance("db-0")
+        self.rds.add_snapshot("db-0", count=3)
+        self.session = limit_client(self.rds)
+        self.session.sleep = self.clock.advance
+
+    def test_api_family(self):
+        self.assertEqual(api_family("describe_db_snapshots"), "read")
+        self.assertEqual(api_family("list_tags_for_resource"), "read")
+        self.assertEqual(api_family("copy_db_snapshot"), "write")
+
+    def test_same_wrapper_and_passthrough(self):
+        self.assertIs(limit_client(self.rds), self.session)
+        self.assertEqual(self.session.region, "us-east-1")
+        self.assertIs(self.session.exceptions, self.rds.exceptions)
+        self.assertIs(self.session.meta, self.rds.meta)
+
+    def test_retries_throttles_and_limits_the_region(self):
+        self.rds.throttle(2)
+        self.assertEqual(len(get_available_snapshots(self.session, "db-0")), 3)
+        self.assertEqual(self.rds.calls["throttled"], 2)
+        bucket = get_bucket("us-east-1", "read")
+        self.assertEqual(bucket.throttles, 2)
+        self.assertIsNotNone(bucket.rate)
+        self.assertIsNone(get_bucket("us-east-1", "write").rate)
+
+        stats = rate_limit_stats()
+        self.assertEqual(stats["us-east-1/read"]["throttles"], 2)
+        self.assertEqual(stats["retry_budget"]["retries"], 2)
+
+    def test_retry_budget_exhausted(self):
+        reset_rate_limits(
+            budget=RetryBudget(min_tokens=1), clock=self.clock, sleep=self.clock.advance
+        )
+        self.rds.throttle(3)
+        with self.assertRaises(ClientError):
+            get_available_snapshots(self.session, "db-0")
+        self.assertEqual(self.rds.calls["throttled"], 2)
+        self.assertEqual(rate_limit_stats()["retry_budget"]["exhausted"], 1)
+
+    def test_other_errors_are_not_retried(self):
+        client = mock.MagicMock()
+        client.delete_db_snapshot.side_effect = ClientError(
+            {"Error": {"Code": "InvalidDBSnapshotState"}}, "DeleteDBSnapshot"
+        )
+        with self.assertRaises(ClientError):
+            limit_client(client, "us-east-1").delete_db_snapshot(
+                DBSnapshotIdentifier="x"
+            )
+        self.assertEqual(client.delete_db_snapshot.call_count, 1)
+
+    def test_connection_errors_are_retried(self):
+        # botocore retries nothing with NO_BOTOCORE_RETRIES, we do.
+        client = mock.MagicMock()
+        client.describe_db_snapshots.side_effect = [
+            EndpointConnectionError(endpoint_url="https://rds.us-east-1.amazonaws.com"),
+            ReadTimeoutError(endpoint_url="https://rds.us-east-1.amazonaws.com"),
+            {"DBSnapshots": []},
+        ]
+        limited = limit_client(client, "us-east-1")
+        self.assertEqual(limited.describe_db_snapshots(), {"DBSnapshots": []})
+        self.assertEqual(client.describe_db_snapshots.call_count, 3)
+        self.assertEqual(rate_limit_stats()["retry_budget"]["retries"], 2)
@@ -2,6 +2,7 @@ from test_helper import TestHelper
 
 from dbsnap.rds_funcs import (
     get_available_snapshots,
+    iter_available_snapshots,
     get_available_dbsnap_snapshots,
     get_old_dbsnap_snapshots,
     get_latest_snapshot,
@@ -14,6 +15,7 @@ from dbsnap.rds_funcs import (
 import mock
 
 from dbsnap.database import Database
+from dbsnap.utils import get_tags_for_rds_arns
 
 
 class TestRdsFuncs(TestHelper):
@@ -24,6 +26,51 @@ class TestRdsFuncs(TestHelper):
         r = get_available_snapshots(session, "whatever")
         self.assertEqual(len(r), 5)
 
+    def test_get_available_snapshots_paginated(self):
+        session = mock.MagicMock()
+        snapshots = self.fake_snapshot_desc["DBSnapshots"]
+        session.describe_db_snapshots.side_effect = [
+            {"DBSnapshots": snapshots[:3], "Marker": "page-2"},
+            {"DBSnapshots": snapshots[3:]},
+        ]
+        r = get_available_snapshots(session, "whatever", snapshot_type="manual")
+        self.assertEqual(len(r), 5)
+        self.assertEqual(r[-1].id, "rds:snapshot3")
+        calls = session.describe_db_snapshots.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertNotIn("Marker", calls[0][1])
+        self.assertEqual(calls[1][1]["Marker"], "page-2")
+        self.assertEqual(calls[1][1]["SnapshotType"], "manual")
+        self.assertEqual(calls[1][1]["MaxRecords"], 100)
+        session.describe_db_cluster_snapshots.assert_not_called()
+
+    def test_get_available_snapshots_falls_back_to_cluster(self):
+        session = mock.MagicMock()
+        session.describe_db_snapshots.return_value = {"DBSnapshots": []}
+        session.describe_db_cluster_snapshots.return_value = {
+            "DBClusterSnapshots": [
+                {
+                    "DBClusterSnapshotIdentifier": "rds:cluster-snapshot1",
+                    "DBClusterSnapshotArn": "arn:c1",
+                    "Engine": "aurora-postgresql",
+                    "EngineVersion": "9.6.6",
+                    "Status": "available",
+                    "SnapshotType": "automated",
+                    "SnapshotCreateTime": 1,
+                }
+            ]
+        }
+        r = get_available_snapshots(session, "whatever")
+        self.assertEqual(len(r), 1)
+        self.assertTrue(r[0].is_cluster)
+
+    def test_iter_available_snapshots_is_lazy(self):
+        session = mock.MagicMock()
+        session.describe_db_snapshots.return_value = self.fake_snapshot_desc
+        snapshots = iter_available_snapshots(session, "whatever")
+        session.describe_db_snapshots.assert_not_called()
+        self.assertEqual(next(snapshots).id, "rds:snapshot1")
+
     def test_zero_get_latest_snapshot(self):
         session = mock.MagicMock()
         session.describe_db_snapshots.return_value = {
@@ -91,6 +138,45 @@ class TestRdsFuncs(TestHelper):
         r = get_available_dbsnap_snapshots(session, "whatever")
         self.assertEqual(len(r), 4)
 
+    def test_get_available_dbsnap_snapshots_looks_up_each_arn_once(self):
+        session = mock.MagicMock()
+        session.list_tags_for_resource.side_effect = self.fake_list_tags
+        session.describe_db_snapshots.return_value = self.fake_snapshot_desc
+        r = get_available_dbsnap_snapshots(session, "whatever")
+        self.assertEqual(len(r), 4)
+        # reading tags again must not go back to the api.
+        for snapshot in r:
+            self.assertEqual(snapshot.tags["created_by"], "dbsnap-copy")
+        looked_up = sorted(
+            c[1]["ResourceName"] for c in session.list_tags_for_resource.call_args_list
+        )
+        self.assertEqual(looked_up, ["arn:1", "arn:2", "arn:3", "arn:5", "arn:6"])
+
+    def test_get_available_dbsnap_snapshots_uses_described_tags(self):
+        session = mock.MagicMock()
+        for description in self.fake_snapshot_desc["DBSnapshots"]:
+            description["TagList"] = self.fake_tags[description["DBSnapshotArn"]][
+                "TagList"
+            ]
+        session.describe_db_snapshots.return_value = self.fake_snapshot_desc
+        r = get_available_dbsnap_snapshots(session, "whatever")
+        self.assertEqual(len(r), 4)
+        session.list_tags_for_resource.assert_not_called()
+
+    def test_get_tags_for_rds_arns(self):
+        session = mock.MagicMock()
+        session.list_tags_for_resource.side_effect = self.fake_list_tags
+        r = get_tags_for_rds_arns(session, ["arn:1", "arn:6", "arn:7", "arn:1"])
+        self.assertEqual(
+            r,
+            {
+                "arn:1": {"created_by": "dbsnap-copy"},
+                "arn:6": {"created_by": "not-dbsnap-copy"},
+                "arn:7": {},
+            },
+        )
+        self.assertEqual(session.list_tags_for_resource.call_count, 3)
+
     def test_get_old_dbsnap_snapshots(self):
         # session, db_id, keep_count)
         session = mock.MagicMock()
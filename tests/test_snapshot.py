@@ -78,3 +78,13 @@ class TestSnapshot(unittest.TestCase):
     def test_malformed_snapshot_description(self):
         with self.assertRaises(LookupError):
             Snapshot(self.snapshot_description3)
+
+    def test_description_is_only_kept_when_asked(self):
+        snapshot = Snapshot(self.snapshot_description2)
+        self.assertIsNone(snapshot.description)
+        self.assertTrue(snapshot.is_cluster)
+        self.assertFalse(hasattr(snapshot, "__dict__"))
+        self.assertEqual(snapshot.created_time.year, 2018)
+        snapshot = Snapshot(self.snapshot_description1, keep_description=True)
+        self.assertIs(snapshot.description, self.snapshot_description1)
+        self.assertFalse(snapshot.is_cluster)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from dbsnap import get_latest_snapshot, get_old_dbsnap_snapshots
+from dbsnap.testing.fake_aws import FakeAWS
+from dbsnap.snapshot_index import SnapshotIndex, load_snapshot_index
+
+from dbsnap_copy.__main__ import main as copy_main
+
+
+class TestSnapshotIndex(unittest.TestCase):
+    def setUp(self):
+        # instant copies, dbsnap-copy waits for them before pruning.
+        self.aws = FakeAWS(copy_seconds_per_gb=0)
+        self.rds = self.aws.rds("us-east-1")
+        self.rds.add_instance("prod-db")
+        self.rds.add_snapshot("prod-db", count=10)
+        self.rds.add_snapshot(
+            "prod-db",
+            snapshot_id="copy",
+            snapshot_type="manual",
+            count=5,
+            tags={"created_by": "dbsnap-copy"},
+        )
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "index.json")
+
+    def index(self):
+        return load_snapshot_index(self.path, max_age=600, clock=self.aws.clock)
+
+    def test_answers_within_max_age(self):
+        index = self.index()
+        latest = get_latest_snapshot(self.rds, "prod-db", index=index)
+        self.assertEqual(latest.id, get_latest_snapshot(self.rds, "prod-db").id)
+        calls = self.aws.calls["describe_db_snapshots"]
+        self.assertEqual(
+            get_latest_snapshot(self.rds, "prod-db", index=index).id, latest.id
+        )
+        self.assertEqual(self.aws.calls["describe_db_snapshots"], calls)
+        self.assertEqual(index.stats["hits"], 1)
+
+        self.aws.advance(601)
+        get_latest_snapshot(self.rds, "prod-db", index=index)
+        self.assertEqual(self.aws.calls["describe_db_snapshots"], calls + 1)
+
+    def test_tags_survive_a_save(self):
+        index = self.index()
+        old = get_old_dbsnap_snapshots(self.rds, "prod-db", 2, index)
+        self.assertEqual(len(old), 3)
+        self.assertEqual(self.aws.calls["list_tags_for_resource"], 5)
+        index.save()
+
+        # a new run with a new snapshot and one deleted behind our back.
+        self.aws.advance(3600)
+        self.rds.add_snapshot(
+            "prod-db",
+            snapshot_id="new-copy",
+            snapshot_type="manual",
+            tags={"created_by": "dbsnap-copy"},
+        )
+        self.rds.delete_db_snapshot(DBSnapshotIdentifier=old[0].id)
+        index = self.index()
+        old = get_old_dbsnap_snapshots(self.rds, "prod-db", 2, index)
+        self.assertEqual(len(old), 3)
+        self.assertEqual(self.aws.calls["list_tags_for_resource"], 6)
+        self.assertEqual(index.stats["tags_reused"], 4)
+        self.assertEqual(index.stats["deletions_reconciled"], 1)
+
+    def test_forget(self):
+        index = SnapshotIndex(clock=self.aws.clock)
+        old = get_old_dbsnap_snapshots(self.rds, "prod-db", 2, index)
+        index.forget(self.rds, old)
+        self.assertEqual(len(index.get_snapshots(self.rds, "prod-db", "manual")), 2)
+
+    def test_dbsnap_copy_runs(self):
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+        argv = [
+            "us-east-1:prod-db",
+            "--prune-old",
+            "3",
+            "--snapshot-index",
+            self.path,
+            "--index-max-age",
+            "0",
+        ]
+        with mock.patch("sys.stdout"):
+            copy_main(argv)
+            first = sum(self.aws.calls.values())
+            self.aws.advance(86400)
+            self.rds.add_snapshot("prod-db")
+            copy_main(argv)
+        second = sum(self.aws.calls.values()) - first
+        self.assertLess(second, first)
+        self.assertTrue(os.path.exists(self.path))
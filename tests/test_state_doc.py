@@ -1,10 +1,20 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 import mock
 
 import json
 
-from dbsnap_verify.state_doc import DocToObject, StateDoc, DbsnapVerifyStateDoc
+from dbsnap.testing.fake_aws import FakeAWS
+
+from dbsnap_verify.state_doc import (
+    DocToObject,
+    StateDoc,
+    StateDocConflict,
+    DbsnapVerifyStateDoc,
+)
 
 
 JSON_STATE_DOC = """{
@@ -106,6 +116,13 @@ class TestStateDoc(unittest.TestCase):
         self.assertEqual(self.state_doc.current_state, "verify")
         self.assertEqual(len(self.state_doc.states), 4)
 
+    def test_checkpoint(self):
+        self.state_doc.checkpoint("verify")["cursor"] = 10
+        document = json.loads(self.state_doc.to_json)
+        self.assertEqual(document["checkpoints"], {"verify": {"cursor": 10}})
+        self.state_doc.clear_checkpoint("verify")
+        self.assertEqual(self.state_doc.checkpoint("verify"), {})
+
     @mock.patch(
         "dbsnap_verify.state_doc.StateDoc._load_state_doc_from_s3", mock_dict_state_doc
     )
@@ -143,13 +160,15 @@ class TestDictDbsnapVerifyStateDoc(unittest.TestCase):
 
     @mock.patch("dbsnap_verify.state_doc.StateDoc._save_state_doc_in_s3", mock_none)
     def test_clean(self):
-        self.state_doc.states = range(0, 1000)
+        self.state_doc.states = list(range(0, 1000))
         self.state_doc.tmp_password = "test-password"
+        self.state_doc.checkpoint("verify")["wakeups"] = 3
         self.assertEqual(len(self.state_doc.states), 1000)
         self.state_doc.save()
         self.state_doc.clean()
         self.assertEqual(len(self.state_doc.states), 100)
         self.assertEqual(self.state_doc.tmp_password, None)
+        self.assertEqual(self.state_doc.checkpoints, {})
 
     @mock.patch("dbsnap_verify.state_doc.StateDoc._save_state_doc_in_s3", mock_none)
     def test_valid_transitions(self):
@@ -194,3 +213,77 @@ class TestDictDbsnapVerifyStateDoc(unittest.TestCase):
         self.state_doc.transition_state("wait")
         with self.assertRaises(Exception):
             self.state_doc.transition_state("wait")
+
+
+class TestStateDocPersistence(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict("os.environ")
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop("STATE_DOC_BUCKET", None)
+        os.environ.pop("STATE_DOC_PATH", None)
+        self.aws = FakeAWS()
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def state_docs(self, **kwargs):
+        first = StateDoc("test", **kwargs)
+        first.transition_state("wait")
+        second = StateDoc("test", **kwargs)
+        second.load()
+        return first, second
+
+    def test_skips_unchanged_saves(self):
+        state_doc = StateDoc("test", state_doc_bucket="bucket")
+        self.assertTrue(state_doc.save())
+        self.assertFalse(state_doc.save())
+        state_doc.checkpoint("verify")["wakeups"] = 1
+        self.assertTrue(state_doc.save())
+        self.assertEqual(self.aws.calls["put_object"], 2)
+
+        response = self.aws.s3.get_object(Bucket="bucket", Key="state-doc-test.json")
+        body = response["Body"]
+        self.assertEqual(body.read().decode("utf-8"), state_doc.to_compact_json)
+        self.assertNotIn("_version", state_doc.to_compact_json)
+        loaded = StateDoc("test", state_doc_bucket="bucket")
+        loaded.load()
+        self.assertFalse(loaded.save())
+
+    def test_s3_lost_update(self):
+        first, second = self.state_docs(state_doc_bucket="bucket")
+        second.transition_state("restore")
+        with self.assertRaises(StateDocConflict):
+            first.transition_state("restore")
+        # a new document never overwrites an existing one.
+        with self.assertRaises(StateDocConflict):
+            StateDoc("test", state_doc_bucket="bucket", a=1).save()
+
+    def test_file_lost_update(self):
+        path = os.path.join(self.tmp, "state.json")
+        first, second = self.state_docs(state_doc_path=path)
+        second.transition_state("restore")
+        with self.assertRaises(StateDocConflict):
+            first.transition_state("restore")
+        self.assertEqual(
+            sorted(os.listdir(self.tmp)), ["state.json", "state.json.lock"]
+        )
+        with open(path) as f:
+            self.assertEqual(json.load(f)["states"][-1]["state"], "restore")
+
+    def test_file_keeps_its_mode(self):
+        path = os.path.join(self.tmp, "state.json")
+        state_doc = StateDoc("test", state_doc_path=path)
+        state_doc.save()
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+        os.chmod(path, 0o640)
+        state_doc.transition_state("wait")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_rds_event_is_not_saved(self):
+        state_doc = DbsnapVerifyStateDoc(
+            "test-db", state_doc_bucket="bucket", rds_event={"message": "hi"}
+        )
+        self.assertNotIn("rds_event", state_doc.to_compact_json)
+        self.assertIn("rds_event", state_doc.to_json)
@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from dbsnap.testing.fake_aws import FakeAWS
+
+from dbsnap_verify import handler
+from dbsnap_verify.state_doc import DbsnapVerifyStateDoc, get_or_create_state_doc
+from dbsnap_verify.state_store import (
+    DEFAULT_SHARDS,
+    ShardedS3StateStore,
+    SQLiteStateStore,
+    StateDocConflict,
+    StateDocNotFound,
+    get_state_store,
+)
+
+DATABASES = ["db-{}".format(i) for i in range(40)]
+
+
+class StateStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.aws = FakeAWS()
+        self.aws.install()
+        self.addCleanup(self.aws.uninstall)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        patcher = mock.patch.dict("dbsnap_verify.state_store._stores", clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environ = mock.patch.dict("os.environ")
+        environ.start()
+        self.addCleanup(environ.stop)
+        for name in ("STATE_STORE", "STATE_DOC_BUCKET", "STATE_DOC_PATH"):
+            os.environ.pop(name, None)
+
+
+class TestStateStores(StateStoreTestCase):
+    def check_store(self, store):
+        documents = {name: {"database": name, "states": []} for name in DATABASES}
+        store.save_many(documents)
+        self.assertEqual(store.load_many(DATABASES + ["missing"]), documents)
+        with store.batch():
+            store.save("db-1", {"database": "db-1", "states": [{"state": "wait"}]})
+            self.assertEqual(store.load("db-1"), documents["db-1"])
+        self.assertEqual(store.load("db-1")["states"], [{"state": "wait"}])
+        with self.assertRaises(StateDocNotFound):
+            store.load("missing")
+
+    def test_sqlite(self):
+        location = "sqlite://" + os.path.join(self.tmp, "state.db")
+        store = get_state_store(location)
+        self.assertIsInstance(store, SQLiteStateStore)
+        self.assertIs(get_state_store(location), store)
+        self.check_store(store)
+
+    def test_sharded_s3(self):
+        store = get_state_store("s3://bucket/dbsnap-verify")
+        self.assertIsInstance(store, ShardedS3StateStore)
+        self.check_store(store)
+
+        # round trips are bound by the shards, not the databases.
+        documents = {name: {"database": name} for name in DATABASES}
+        fresh = ShardedS3StateStore("bucket", "dbsnap-verify")
+        before = dict(self.aws.calls)
+        fresh.load_many(DATABASES)
+        fresh.save_many(documents)
+        for operation in ("get_object", "put_object"):
+            calls = self.aws.calls[operation] - before[operation]
+            self.assertLessEqual(calls, DEFAULT_SHARDS)
+
+    def test_sharded_s3_merges_concurrent_saves(self):
+        first = ShardedS3StateStore("bucket", shards=1)
+        second = ShardedS3StateStore("bucket", shards=1)
+        first.save_many({"db-1": {"n": 1}})
+        second.load_many(["db-1"])
+        first.save_many({"db-2": {"n": 2}})
+        # second's copy of the shard is stale, it merges instead of overwriting.
+        second.save_many({"db-3": {"n": 3}})
+        self.assertEqual(
+            first.load_many(["db-1", "db-2", "db-3"]),
+            {"db-1": {"n": 1}, "db-2": {"n": 2}, "db-3": {"n": 3}},
+        )
+
+    def check_conflicts(self, make_store):
+        first, second = make_store(), make_store()
+        first.save_many({"db-1": {"n": 1}, "db-2": {"n": 2}})
+        second.load_many(["db-1", "db-2"])
+        first.save_many({"db-1": {"n": 10}})
+        # db-1 changed since second loaded it, db-2 did not.
+        with self.assertRaises(StateDocConflict) as raised:
+            second.save_many({"db-1": {"n": 11}, "db-2": {"n": 20}})
+        self.assertIn("db-1", str(raised.exception))
+        self.assertEqual(
+            first.load_many(["db-1", "db-2"]), {"db-1": {"n": 10}, "db-2": {"n": 20}}
+        )
+        # a document we never loaded must not exist yet.
+        with self.assertRaises(StateDocConflict):
+            make_store().save_many({"db-2": {}})
+        # saving again after a save of our own is fine.
+        second.save_many({"db-2": {"n": 21}})
+
+    def test_sharded_s3_conflicts(self):
+        self.check_conflicts(lambda: ShardedS3StateStore("bucket", shards=1))
+
+    def test_sqlite_conflicts(self):
+        path = os.path.join(self.tmp, "state.db")
+        self.check_conflicts(lambda: SQLiteStateStore(path))
+
+    def test_invalid_location(self):
+        with self.assertRaises(ValueError):
+            get_state_store("bucket/state.json")
+
+
+class TestStateDocInStore(StateStoreTestCase):
+    def test_state_doc(self):
+        config = {
+            "database": "db-1",
+            "database_subnet_ids": "subnet-1111",
+            "database_security_group_ids": "sg-0123456789",
+            "snapshot_region": "us-east-1",
+            "state_store": "s3://bucket/dbsnap-verify",
+        }
+        state_doc = get_or_create_state_doc(config)
+        self.assertEqual(state_doc.current_state, "wait")
+        loaded = get_or_create_state_doc(config)
+        self.assertEqual(loaded.states, state_doc.states)
+        state_doc = DbsnapVerifyStateDoc(state_doc_bucket="bucket", **config)
+        with self.assertRaises(Exception):
+            state_doc.persistence
+
+    def test_fleet_round_trips(self):
+        rds = self.aws.rds("us-east-1")
+        for database in DATABASES:
+            rds.add_instance(database)
+        event = {
+            "state_store": "s3://bucket/dbsnap-verify",
+            "snapshot_region": "us-east-1",
+            "database_subnet_ids": "subnet-1111",
+            "database_security_group_ids": "sg-0123456789",
+            "databases": DATABASES,
+        }
+        with mock.patch("dbsnap_verify.get_latest_snapshot") as get_latest_snapshot:
+            get_latest_snapshot.return_value = mock.Mock(id=None)
+            handler(event)
+            handler(event)
+        # two wakeups of 40 databases, at most a GET and a PUT per shard each.
+        self.assertLessEqual(self.aws.calls["put_object"], 2 * DEFAULT_SHARDS)
+        self.assertLessEqual(self.aws.calls["get_object"], 2 * DEFAULT_SHARDS)
+        store = get_state_store(event["state_store"])
+        self.assertEqual(len(store.load_many(DATABASES)), len(DATABASES))
+
+    def test_fleet_skips_conflicts(self):
+        rds = self.aws.rds("us-east-1")
+        rds.add_instance("db-1")
+        rds.add_instance("db-2")
+        event = {
+            "state_store": "s3://bucket/dbsnap-verify",
+            "snapshot_region": "us-east-1",
+            "database_subnet_ids": "subnet-1111",
+            "database_security_group_ids": "sg-0123456789",
+            "databases": ["db-1", "db-2"],
+        }
+        store = get_state_store(event["state_store"])
+        with mock.patch("dbsnap_verify.get_latest_snapshot") as get_latest_snapshot:
+            get_latest_snapshot.return_value = mock.Mock(id=None)
+            handler(event)
+            # another wakeup saves db-1 while this one is running.
+            other = ShardedS3StateStore("bucket", "dbsnap-verify")
+            other_doc = dict(other.load("db-1"), note="other")
+            original_load_many = store.load_many
+
+            def load_many(names):
+                documents = original_load_many(names)
+                other.save_many({"db-1": other_doc})
+                return documents
+
+            get_latest_snapshot.return_value = mock.Mock(id="rds:new")
+            with mock.patch.object(store, "load_many", load_many), mock.patch(
+                "dbsnap_verify.restore"
+            ):
+                handler(event)
+        fresh = ShardedS3StateStore("bucket", "dbsnap-verify")
+        self.assertEqual(fresh.load("db-1"), other_doc)
+        self.assertEqual(fresh.load("db-2")["snapshot_verifying"], "rds:new")
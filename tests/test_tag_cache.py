@@ -0,0 +1,107 @@
+import unittest
+
+import mock
+
+from dbsnap.tag_cache import TagCache, get_tag_cache
+from dbsnap.snapshot import Snapshot
+from dbsnap.database import Database
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTagCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TagCache(ttl=60, clock=self.clock)
+
+    def test_hit_and_miss_counters(self):
+        self.assertEqual(self.cache.get("arn:1"), None)
+        self.cache.set("arn:1", {"a": "b"})
+        self.assertEqual(self.cache.get("arn:1"), {"a": "b"})
+        self.assertEqual(self.cache.get("arn:1"), {"a": "b"})
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.stats["size"], 1)
+
+    def test_ttl(self):
+        self.cache.set("arn:1", {"a": "b"})
+        self.clock.now += 59
+        self.assertEqual(self.cache.get("arn:1"), {"a": "b"})
+        self.clock.now += 2
+        self.assertEqual(self.cache.get("arn:1"), None)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        self.cache.set("arn:1", {"a": "b"})
+        self.cache.set("arn:2", {"c": "d"})
+        self.cache.invalidate("arn:1")
+        self.assertEqual(self.cache.get("arn:1"), None)
+        self.assertEqual(self.cache.get("arn:2"), {"c": "d"})
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_get_tag_cache_is_per_session(self):
+        session1 = mock.MagicMock()
+        session2 = mock.MagicMock()
+        self.assertIs(get_tag_cache(session1), get_tag_cache(session1))
+        self.assertIsNot(get_tag_cache(session1), get_tag_cache(session2))
+
+
+class TestSharedTags(unittest.TestCase):
+    def test_snapshot_and_database_share_lookups(self):
+        session = mock.MagicMock()
+        session.list_tags_for_resource.return_value = {
+            "TagList": [{"Key": "dbsnap-verify", "Value": "true"}]
+        }
+        database = Database(
+            session=session,
+            description={
+                "DBInstanceIdentifier": "instance1",
+                "DBInstanceStatus": "available",
+                "DBInstanceArn": "arn:1234",
+                "Engine": "postgres",
+                "EngineVersion": "9.6.6",
+            },
+        )
+        self.assertEqual(database.tags, {"dbsnap-verify": "true"})
+        self.assertEqual(database.tags, {"dbsnap-verify": "true"})
+        other = Database(session=session, description=database.description)
+        self.assertEqual(other.tags, {"dbsnap-verify": "true"})
+        self.assertEqual(session.list_tags_for_resource.call_count, 1)
+
+        database.invalidate_tags()
+        self.assertEqual(database.tags, {"dbsnap-verify": "true"})
+        self.assertEqual(session.list_tags_for_resource.call_count, 2)
+
+    def test_copy_invalidates_target_tags(self):
+        session = mock.MagicMock()
+        target_description = {
+            "DBSnapshotIdentifier": "copy1",
+            "DBSnapshotArn": "arn:aws:rds:us-west-2:1:snapshot:copy1",
+            "Engine": "postgres",
+            "EngineVersion": "9.6.6",
+            "Status": "creating",
+            "SnapshotType": "manual",
+        }
+        session.copy_db_snapshot.return_value = {"DBSnapshot": target_description}
+        get_tag_cache(session).set(target_description["DBSnapshotArn"], {"old": "1"})
+        snapshot = Snapshot(
+            {
+                "DBSnapshotIdentifier": "rds:snapshot1",
+                "DBSnapshotArn": "arn:aws:rds:us-east-1:1:snapshot:rds:snapshot1",
+                "Engine": "postgres",
+                "EngineVersion": "9.6.6",
+                "Status": "available",
+                "SnapshotType": "automated",
+            },
+            session,
+        )
+        target = snapshot.copy("copy1", tags={"created_by": "dbsnap-copy"})
+        self.assertEqual(target.id, "copy1")
+        self.assertEqual(get_tag_cache(session).get(target.arn), None)